@@ -0,0 +1,392 @@
+"""
+Контроль нагрузки на HTTP API и на вызовы Telegram Bot API.
+
+Входящие запросы (AdmissionMiddleware, ASGI):
+- ведро токенов на IP — общий лимит частоты на все /api/ запросы клиента;
+- ведро токенов на покупателя для дорогих маршрутов (заказ, загрузка фото, импорт):
+  ключ — ID из проверенной initData, без неё — IP;
+- лимит одновременно выполняемых запросов: общий и на маршрут. Потоковые маршруты
+  (лента событий SSE) держат соединение часами и общий лимит не занимают — у них
+  только свой лимит на число открытых потоков.
+Сверх лимита частоты сразу отвечаем 429 с Retry-After, сверх лимита одновременных
+запросов — 503: лишний запрос не встаёт в очередь и не занимает память.
+
+IP — адрес соединения. X-Forwarded-For учитывается, только если соединение пришло
+от доверенного прокси (loopback — туннель на этой же машине — или адреса из
+TRUSTED_PROXIES): берётся самый правый адрес цепочки, не являющийся доверенным прокси.
+Левые адреса клиент может подставить сам, и каждый запрос получал бы новое ведро.
+Соединения от доверенного прокси без X-Forwarded-For (туннель без заголовка, локальные
+скрипты) лимитом на IP не ограничиваются, иначе все покупатели делили бы одно ведро.
+
+Исходящие вызовы Bot API (TelegramGuard, middleware сессии aiogram):
+- таймаут на каждый вызов (кроме long polling getUpdates); у вызовов с файлами
+  (sendDocument, sendPhoto...) — отдельный, намного больший TELEGRAM_UPLOAD_TIMEOUT:
+  выгрузка в 50 МБ идёт долго и при живом Telegram, и её таймаут цепь не размыкает;
+- размыкатель цепи: после TELEGRAM_BREAKER_FAILURES подряд таймаутов и сетевых ошибок
+  вызовы TELEGRAM_BREAKER_COOLDOWN секунд сразу завершаются ошибкой CircuitOpenError,
+  затем один пробный вызов решает, замкнуть цепь или подождать ещё.
+CircuitOpenError — подкласс TelegramNetworkError, поэтому код, который уже повторяет
+отправку при сетевых ошибках (рассылки), обрабатывает её так же.
+"""
+import asyncio
+import ipaddress
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramServerError
+from aiogram.methods import GetUpdates
+from aiogram.types import InputFile
+from starlette.responses import JSONResponse
+
+from log_setup import sampled
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() == "true"
+# Запросов в секунду с одного IP (в среднем) и сколько подряд
+ADMISSION_IP_RATE = float(os.environ.get("ADMISSION_IP_RATE", "30"))
+ADMISSION_IP_BURST = float(os.environ.get("ADMISSION_IP_BURST", "100"))
+# Заказов в минуту от одного покупателя и сколько подряд
+ADMISSION_ORDERS_PER_MINUTE = float(os.environ.get("ADMISSION_ORDERS_PER_MINUTE", "6"))
+ADMISSION_ORDER_BURST = float(os.environ.get("ADMISSION_ORDER_BURST", "3"))
+# Одновременно выполняемых /api/ запросов на весь процесс
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", "256"))
+# Открытых лент событий администраторов (SSE) на процесс
+EVENTS_MAX_STREAMS = int(os.environ.get("EVENTS_MAX_STREAMS", "1000"))
+# Прокси, которым доверяем X-Forwarded-For, через запятую: адреса и подсети (loopback — всегда)
+TRUSTED_PROXIES = tuple(
+    ipaddress.ip_network(item.strip(), strict=False)
+    for item in os.environ.get("TRUSTED_PROXIES", "").split(",") if item.strip()
+)
+
+TELEGRAM_CALL_TIMEOUT = float(os.environ.get("TELEGRAM_CALL_TIMEOUT", "10"))
+# Таймаут вызова с файлом (документы, фото): выгрузки заказов до 50 МБ
+TELEGRAM_UPLOAD_TIMEOUT = float(os.environ.get("TELEGRAM_UPLOAD_TIMEOUT", "600"))
+TELEGRAM_BREAKER_FAILURES = int(os.environ.get("TELEGRAM_BREAKER_FAILURES", "5"))
+TELEGRAM_BREAKER_COOLDOWN = float(os.environ.get("TELEGRAM_BREAKER_COOLDOWN", "30"))
+
+# Сколько ключей (IP, покупателей) помнит каждый лимит; давние вытесняются
+MAX_TRACKED_KEYS = 50_000
+
+# Маршруты без лимитов: webhook Telegram и проверка работоспособности
+EXEMPT_PATHS = ("/api/webhook", "/api/health")
+
+
+class KeyedBuckets:
+    """Ведро токенов на каждый ключ (IP или покупатель)"""
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = MAX_TRACKED_KEYS):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def try_acquire(self, key: str) -> float:
+        """0 — токен выдан; иначе через сколько секунд можно повторить"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        if bucket.try_acquire():
+            return 0.0
+        return max(bucket.wait_time(), 0.001)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RouteLimit:
+    """Лимиты одного маршрута: частота на покупателя и число одновременных запросов"""
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None,
+                 max_in_flight: Optional[int] = None, streaming: bool = False):
+        self.clients = KeyedBuckets(rate, burst or max(1.0, rate)) if rate else None
+        self.max_in_flight = max_in_flight
+        # Долгоживущий поток: не учитывается в общем числе выполняемых запросов
+        self.streaming = streaming
+        self.in_flight = 0
+        self.stats = {"admitted": 0, "rejected_rate": 0, "rejected_busy": 0, "peak_in_flight": 0}
+
+    def report(self) -> dict:
+        return {
+            **self.stats,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "rate_per_s": self.clients.rate if self.clients else None,
+            "tracked_clients": len(self.clients) if self.clients else 0,
+        }
+
+
+def default_routes() -> Dict[Tuple[str, str], RouteLimit]:
+    return {
+        ("POST", "/api/order"): RouteLimit(ADMISSION_ORDERS_PER_MINUTE / 60, ADMISSION_ORDER_BURST, max_in_flight=64),
+        ("POST", "/api/cart/quote"): RouteLimit(2, 10),
+        ("POST", "/api/products/upload-image"): RouteLimit(1, 5, max_in_flight=4),
+        ("POST", "/api/admin/catalog/import"): RouteLimit(max_in_flight=1),
+        ("GET", "/api/admin/catalog/export"): RouteLimit(max_in_flight=2),
+        ("GET", "/api/admin/orders/export"): RouteLimit(max_in_flight=2),
+        ("GET", "/api/admin/events"): RouteLimit(max_in_flight=EVENTS_MAX_STREAMS, streaming=True),
+    }
+
+
+class Rejection:
+    def __init__(self, status: int, message: str, retry_after: float):
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+    def response(self) -> JSONResponse:
+        return JSONResponse(
+            status_code=self.status,
+            content={"status": "error", "message": self.message},
+            headers={"Retry-After": str(max(1, math.ceil(self.retry_after)))},
+        )
+
+
+class AdmissionController:
+    """Решает, пускать ли запрос, и считает, сколько запросов сейчас выполняется"""
+
+    def __init__(self, enabled: bool = ADMISSION_ENABLED, ip_rate: float = ADMISSION_IP_RATE,
+                 ip_burst: float = ADMISSION_IP_BURST, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+                 routes: Optional[Dict[Tuple[str, str], RouteLimit]] = None):
+        self.enabled = enabled
+        self.ips = KeyedBuckets(ip_rate, ip_burst)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.routes = routes if routes is not None else default_routes()
+        self.stats = {"admitted": 0, "rejected_ip_rate": 0, "rejected_busy": 0, "peak_in_flight": 0}
+
+    def admit(self, method: str, path: str, ip: Optional[str], user_id: Optional[int]):
+        """RouteLimit (или None) для запроса, который пущен, либо Rejection"""
+        route = self.routes.get((method, path))
+        if ip is not None:
+            wait = self.ips.try_acquire(ip)
+            if wait:
+                self.stats["rejected_ip_rate"] += 1
+                return Rejection(429, f"Слишком много запросов, повторите через {math.ceil(wait)} с", wait)
+        if route is not None and route.clients is not None:
+            client = f"u:{user_id}" if user_id is not None else f"ip:{ip}"
+            wait = route.clients.try_acquire(client)
+            if wait:
+                route.stats["rejected_rate"] += 1
+                return Rejection(429, f"Слишком часто, повторите через {math.ceil(wait)} с", wait)
+        streaming = route is not None and route.streaming
+        if not streaming and self.in_flight >= self.max_in_flight:
+            self.stats["rejected_busy"] += 1
+            return Rejection(503, "Сервер перегружен, повторите через несколько секунд", 1)
+        if route is not None and route.max_in_flight is not None and route.in_flight >= route.max_in_flight:
+            route.stats["rejected_busy"] += 1
+            return Rejection(503, "Сервер занят обработкой таких же запросов, повторите чуть позже", 1)
+
+        if not streaming:
+            self.in_flight += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.in_flight)
+        self.stats["admitted"] += 1
+        if route is not None:
+            route.in_flight += 1
+            route.stats["admitted"] += 1
+            route.stats["peak_in_flight"] = max(route.stats["peak_in_flight"], route.in_flight)
+        return route
+
+    def release(self, route: Optional[RouteLimit]):
+        if route is None or not route.streaming:
+            self.in_flight -= 1
+        if route is not None:
+            route.in_flight -= 1
+
+    def report(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            **self.stats,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "ip_rate_per_s": self.ips.rate,
+            "tracked_ips": len(self.ips),
+            "routes": {f"{method} {path}": route.report() for (method, path), route in self.routes.items()},
+        }
+
+
+def is_trusted_proxy(address: str, trusted=TRUSTED_PROXIES) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return ip.is_loopback or any(ip in network for network in trusted)
+
+
+def client_ip(scope, trusted=TRUSTED_PROXIES) -> Optional[str]:
+    """IP клиента для лимита; None — лимит на IP не применять"""
+    client = scope.get("client")
+    peer = client[0] if client else None
+    if peer is not None and not is_trusted_proxy(peer, trusted):
+        # Прямое соединение: X-Forwarded-For от клиента ничего не значит
+        return peer
+    hops = []
+    for name, value in scope.get("headers", ()):
+        if name == b"x-forwarded-for":
+            hops.extend(hop.strip() for hop in value.decode("latin-1").split(","))
+    # Справа налево: адреса, дописанные нашими прокси, пропускаем; первый чужой — клиент
+    for hop in reversed(hops):
+        if hop and not is_trusted_proxy(hop, trusted):
+            return hop
+    return None
+
+
+class AdmissionMiddleware:
+    """ASGI middleware: запрос сверх лимитов получает 429/503, не доходя до обработчика.
+
+    Счётчик выполняемых запросов уменьшается, когда ответ отдан целиком (в том числе
+    потоковые выгрузки), поэтому лимит одновременных выгрузок действует до конца передачи.
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        # Путь магазина с префиксом (/t/<магазин>/api/..., см. tenants.py): лимиты — по маршруту
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        if (scope["type"] != "http" or not self.controller.enabled
+                or not path.startswith("/api/") or path.startswith(EXEMPT_PATHS)):
+            await self.app(scope, receive, send)
+            return
+        # Пользователя кладёт в scope["state"] TelegramAuthMiddleware (он снаружи)
+        tg_user = scope.get("state", {}).get("tg_user")
+        ip = client_ip(scope)
+        ticket = self.controller.admit(scope["method"], path, ip, tg_user["id"] if tg_user else None)
+        if isinstance(ticket, Rejection):
+            logger.info("🚦 %s %s отклонён (%s): %s", scope["method"], path, ticket.status, ticket.message,
+                        extra=sampled())
+            await ticket.response()(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(ticket)
+
+
+class CircuitOpenError(TelegramNetworkError):
+    """Telegram недоступен: вызов не выполнялся, цепь разомкнута"""
+
+
+class CircuitBreaker:
+    """Размыкатель цепи: closed → (failures ошибок подряд) → open → (cooldown) → half_open"""
+
+    def __init__(self, failures: int = TELEGRAM_BREAKER_FAILURES, cooldown: float = TELEGRAM_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.stats = {"calls": 0, "failures": 0, "timeouts": 0, "upload_timeouts": 0, "short_circuited": 0, "opened": 0}
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+            self.state = "half_open"
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self._probe_in_flight:
+            # Один пробный вызов; остальные отклоняются, пока он не завершится
+            self._probe_in_flight = True
+            return True
+        self.stats["short_circuited"] += 1
+        return False
+
+    def release_probe(self):
+        """Пробный вызов прерван, не дав ответа: следующий вызов станет пробным"""
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self._probe_in_flight = False
+        self._consecutive = 0
+        if self.state != "closed":
+            logger.info("🔌 Telegram снова отвечает, цепь замкнута")
+        self.state = "closed"
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.stats["failures"] += 1
+        self._consecutive += 1
+        if self.state == "half_open" or (self.state == "closed" and self._consecutive >= self.failures):
+            if self.state == "closed":
+                self.stats["opened"] += 1
+            logger.warning("🔌 Telegram не отвечает (%s ошибок подряд), вызовы Bot API приостановлены на %s с",
+                           self._consecutive, self.cooldown)
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def report(self) -> dict:
+        retry_in = None
+        if self.state == "open":
+            retry_in = round(max(0.0, self._opened_at + self.cooldown - time.monotonic()), 1)
+        return {**self.stats, "state": self.state, "consecutive_failures": self._consecutive, "retry_in_s": retry_in}
+
+
+def carries_file(method) -> bool:
+    """Вызов отправляет файл: InputFile в полях метода или в media группы (sendMediaGroup)"""
+    for _, value in method:
+        for item in value if isinstance(value, list) else (value,):
+            if isinstance(item, InputFile) or isinstance(getattr(item, "media", None), InputFile):
+                return True
+    return False
+
+
+class TelegramGuard(BaseRequestMiddleware):
+    """Middleware сессии бота: таймаут и размыкатель цепи на каждый вызов Bot API"""
+
+    def __init__(self, breaker: CircuitBreaker, timeout: float = TELEGRAM_CALL_TIMEOUT,
+                 upload_timeout: float = TELEGRAM_UPLOAD_TIMEOUT):
+        self.breaker = breaker
+        self.timeout = timeout
+        self.upload_timeout = upload_timeout
+
+    async def __call__(self, make_request, bot, method):
+        # Long polling сам ждёт обновлений десятки секунд — это не признак недоступности
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        if not self.breaker.allow():
+            raise CircuitOpenError(method, "Telegram недоступен, вызов не выполнялся")
+        self.breaker.stats["calls"] += 1
+        upload = carries_file(method)
+        try:
+            if upload:
+                # Таймаут запроса aiohttp в сессии (по умолчанию 60 с) заменяем бюджетом выгрузки;
+                # TelegramGuard — единственный middleware, make_request — вызов самой сессии
+                response = await make_request(bot, method, timeout=self.upload_timeout)
+            else:
+                response = await asyncio.wait_for(make_request(bot, method), self.timeout)
+        except asyncio.TimeoutError:
+            self.breaker.stats["timeouts"] += 1
+            self.breaker.record_failure()
+            raise TelegramNetworkError(method, f"Telegram не ответил за {self.timeout:g} с")
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if upload and isinstance(e.__cause__, asyncio.TimeoutError):
+                # Файл не успел уйти — медленный канал, а не недоступный Telegram: цепь не размыкаем
+                self.breaker.stats["upload_timeouts"] += 1
+                self.breaker.release_probe()
+                raise
+            self.breaker.record_failure()
+            raise
+        except TelegramAPIError:
+            # Telegram ответил (ошибка запроса, лимит) — связь есть
+            self.breaker.record_success()
+            raise
+        except BaseException:
+            # Отмена вызывающим: пробный вызов не дал ответа, пусть будет следующий
+            self.breaker.release_probe()
+            raise
+        self.breaker.record_success()
+        return response
@@ -0,0 +1,45 @@
+"""
+Минимальный ASGI-клиент для бенчмарков: запросы к приложению bot.py без сервера и сети.
+Проходят все middleware (аутентификация, лимиты admission.py, магазины tenants.py).
+"""
+import asyncio
+import json
+
+
+def http_scope(method: str, path: str, headers=None) -> dict:
+    """scope HTTP-запроса; query string — из path после «?», заголовки — dict"""
+    path, _, query = path.partition("?")
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "headers": [(b"content-type", b"application/json")] + [
+            (name.lower().encode(), value.encode()) for name, value in (headers or {}).items()],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80), "scheme": "http", "root_path": "",
+    }
+
+
+async def asgi_request(app, method: str, path: str, payload=None, headers=None):
+    """Запрос с JSON-телом (или без тела), возвращает (статус, разобранный JSON ответа)"""
+    body = json.dumps(payload).encode() if payload is not None else b""
+    sent = False
+    response = {"status": None, "body": b""}
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await app(http_scope(method, path, headers), receive, send)
+    return response["status"], json.loads(response["body"] or b"null")
+
+
+async def asgi_post(app, path: str, payload: dict, headers=None):
+    return await asgi_request(app, "POST", path, payload, headers)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест контроля нагрузки (admission.py) через ASGI-приложение bot.py.
+
+Telegram «завис»: вызовы Bot API не отвечают (заглушка make_request сессии бота ждёт
+события). На POST /api/order идёт поток заказов от множества клиентов (разные
+X-Forwarded-For), параллельно раз в 20 мс проверяется GET /api/products/facets.
+Два прогона:
+- без защиты (лимиты выключены, таймаута у вызовов Bot API нет) — запросы копятся;
+- с защитой — лишнее отклоняется сразу (429/503), вызовы Telegram обрываются по
+  таймауту, после нескольких таймаутов цепь размыкается и заказы принимаются
+  без ожидания Telegram (уведомление отправится позже).
+В конце — один клиент шлёт заказы подряд (лимит на покупателя) и Telegram «оживает»
+(пробный вызов замыкает цепь).
+Запуск: python benchmarks/bench_admission.py [заказов_в_секунду] [секунд_нагрузки]
+"""
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _asgi import asgi_request  # noqa: E402
+from bench_stock import order_payload  # noqa: E402
+
+REQUESTS_PER_CLIENT = 5
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[max(0, int(len(values) * share) - 1)] if values else 0.0
+
+
+async def overload(bot, rate: int, seconds: float):
+    """Поток заказов с частотой rate в секунду; возвращает сводку на конец нагрузки"""
+    payload = order_payload([(1, 1)], None)
+    results = []
+    probes = []
+    stop = asyncio.Event()
+    rss_before = rss_mb()
+
+    async def order(n):
+        headers = {"X-Forwarded-For": f"10.0.{n // REQUESTS_PER_CLIENT // 256}.{n // REQUESTS_PER_CLIENT % 256}"}
+        start = time.perf_counter()
+        status, body = await asgi_request(bot.app, "POST", "/api/order", payload, headers)
+        results.append((status, (body or {}).get("message"), time.perf_counter() - start))
+
+    async def probe():
+        while not stop.is_set():
+            start = time.perf_counter()
+            status, _ = await asgi_request(bot.app, "GET", "/api/products/facets")
+            assert status == 200
+            probes.append(time.perf_counter() - start)
+            await asyncio.sleep(0.02)
+
+    prober = asyncio.create_task(probe())
+    tasks = []
+    started = time.perf_counter()
+    total = int(rate * seconds)
+    for n in range(total):
+        delay = started + n / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(order(n)))
+    await asyncio.sleep(0.5)
+    stop.set()
+    await prober
+    pending = sum(1 for task in tasks if not task.done())
+    summary = {
+        "sent": total,
+        "pending": pending,
+        "rss_mb": rss_mb() - rss_before,
+        "statuses": Counter(f"{status} {message}" for status, message, _ in results),
+        "answer_p95_ms": percentile([elapsed for *_, elapsed in results], 0.95) * 1000,
+        "probe_p50_ms": statistics.median(probes) * 1000,
+        "probe_p95_ms": percentile(probes, 0.95) * 1000,
+    }
+    return summary, tasks
+
+
+def print_summary(title: str, summary: dict):
+    print(f"\n{title}")
+    print(f"  отправлено {summary['sent']}, без ответа к концу нагрузки {summary['pending']}, "
+          f"прирост RSS {summary['rss_mb']:.1f} МБ")
+    for status, count in summary["statuses"].most_common():
+        print(f"  {count:6d} × {status}")
+    print(f"  ответ p95 {summary['answer_p95_ms']:.1f} мс; "
+          f"GET /api/products/facets под нагрузкой: p50 {summary['probe_p50_ms']:.2f} мс, "
+          f"p95 {summary['probe_p95_ms']:.2f} мс")
+
+
+async def main():
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 4
+    workdir = tempfile.mkdtemp()
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench_admission.sqlite3")
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    os.environ.setdefault("TELEGRAM_CALL_TIMEOUT", "1")
+    os.environ.setdefault("TELEGRAM_BREAKER_COOLDOWN", "3")
+    import bot
+
+    telegram_up = asyncio.Event()
+
+    async def fake_make_request(bot_, method, timeout=None):
+        # Пока Telegram «лежит», вызов не отвечает
+        await telegram_up.wait()
+        return None
+
+    bot.shop().bot.session.make_request = fake_make_request
+    await bot.init_db()
+    bot.shop().initialized = True
+    with sqlite3.connect(os.environ["DB_PATH"]) as conn:
+        conn.execute("INSERT INTO products(id, name, price) VALUES(1, 'Шина 1', 5000)")
+    print(f"Нагрузка: {rate} заказов/с в течение {seconds:g} с, по {REQUESTS_PER_CLIENT} заказов с клиента; "
+          f"Telegram не отвечает")
+
+    # 1. Без защиты
+    guard_timeout = bot.telegram_guard.timeout
+    bot.admission.enabled = False
+    bot.telegram_guard.timeout = None
+    summary, tasks = await overload(bot, rate, seconds)
+    print_summary("Без защиты:", summary)
+    telegram_up.set()
+    await asyncio.gather(*tasks)
+    telegram_up.clear()
+
+    # 2. С защитой
+    bot.admission.enabled = True
+    bot.telegram_guard.timeout = guard_timeout
+    summary, tasks = await overload(bot, rate, seconds)
+    print_summary("С защитой:", summary)
+    await asyncio.gather(*tasks)
+    report = bot.admission.report()
+    order_route = report["routes"]["POST /api/order"]
+    print(f"  заказов одновременно: не больше {order_route['peak_in_flight']} (лимит {order_route['max_in_flight']}); "
+          f"цепь Telegram: {bot.telegram_breaker.report()}")
+
+    # 3. Один клиент шлёт заказы подряд
+    statuses = Counter()
+    for _ in range(20):
+        status, _ = await asgi_request(bot.app, "POST", "/api/order", order_payload([(1, 1)], None),
+                                       {"X-Forwarded-For": "192.0.2.1"})
+        statuses[status] += 1
+    print(f"\nОдин клиент, 20 заказов подряд: {dict(statuses)}")
+
+    # 4. Telegram снова отвечает: после паузы пробный вызов замыкает цепь
+    telegram_up.set()
+    await asyncio.sleep(bot.telegram_breaker.cooldown)
+    status, body = await asgi_request(bot.app, "POST", "/api/order", order_payload([(1, 1)], None),
+                                      {"X-Forwarded-For": "192.0.2.2"})
+    print(f"Telegram ожил: {status} {body['message']}, цепь {bot.telegram_breaker.state}")
+    await bot.shop().storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
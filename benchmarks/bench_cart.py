@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк расчёта корзины из 50 позиций (price_cart в bot.py).
+Сравнивается проверка цен отдельным запросом на каждую позицию, одним запросом
+IN (...) (так считает create_order внутри своей транзакции) и по каталогу в памяти
+(так считает POST /api/cart/quote). Затем замеряются сами эндпоинты через ASGI-приложение
+bot.py; уведомление в чат заказов подменено заглушкой.
+Запуск: python benchmarks/bench_cart.py [позиций_в_корзине] [повторов]
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _asgi import asgi_post  # noqa: E402
+
+PRODUCTS = 5000
+
+
+def report(title: str, timings: list):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{title:<34} среднее {statistics.mean(timings) * 1000:7.3f} мс, p95 {p95 * 1000:7.3f} мс")
+
+
+async def main():
+    cart_size = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench_cart.sqlite3")
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Все запросы идут от одного клиента — лимиты admission.py здесь не замеряются
+    os.environ.setdefault("ADMISSION_ENABLED", "false")
+    import bot
+
+    async def no_notification(*args, **kwargs):
+        return None
+
+    bot.shop().bot.send_message = no_notification
+    await bot.init_db()
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany("INSERT INTO products(name, price) VALUES(?, ?)",
+                         [(f"Шина {i} 205/55 R16", 3000 + i % 7000) for i in range(1, PRODUCTS + 1)])
+    # Повторный init_db разберёт характеристики новых товаров и построит индекс
+    await bot.init_db()
+    bot.shop().initialized = True
+
+    rnd = random.Random(1)
+    carts = []
+    for _ in range(repeats):
+        ids = rnd.sample(range(1, PRODUCTS + 1), cart_size)
+        carts.append([bot.OrderItem(id=i, name=f"Шина {i} 205/55 R16", price=3000 + i % 7000, qty=rnd.randint(1, 4))
+                      for i in ids])
+    print(f"Корзина: {cart_size} позиций, каталог {PRODUCTS} товаров, {repeats} повторов")
+
+    # 1. Отдельный запрос на каждую позицию
+    timings = []
+    async with aiosqlite.connect(db_path) as db:
+        for items in carts:
+            start = time.perf_counter()
+            catalog = {}
+            for item in items:
+                cur = await db.execute("SELECT name, price FROM products WHERE active=1 AND id=?", (item.id,))
+                row = await cur.fetchone()
+                if row:
+                    catalog[item.id] = {"name": row[0], "price": row[1]}
+            bot.price_cart(items, catalog)
+            timings.append(time.perf_counter() - start)
+    report("запрос на позицию", timings)
+
+    # 2. Один запрос IN (...)
+    timings = []
+    async with bot.shop().storage.read() as db:
+        for items in carts:
+            start = time.perf_counter()
+            quote = bot.price_cart(items, await bot.load_cart_catalog(db, items))
+            timings.append(time.perf_counter() - start)
+            assert not quote["unavailable"] and not quote["price_changed"]
+    report("один запрос IN (...)", timings)
+
+    # 3. Каталог в памяти
+    timings = []
+    for items in carts:
+        start = time.perf_counter()
+        bot.price_cart(items, {item.id: bot.shop().search_index.get(item.id) for item in items})
+        timings.append(time.perf_counter() - start)
+    report("каталог в памяти", timings)
+
+    # 4. Эндпоинты целиком
+    for path in ("/api/cart/quote", "/api/order"):
+        timings = []
+        for items in carts:
+            payload = {"items": [item.model_dump() for item in items], "phone": "+70000000000",
+                       "total": sum(item.price * item.qty for item in items)}
+            start = time.perf_counter()
+            status, body = await asgi_post(bot.app, path, payload)
+            timings.append(time.perf_counter() - start)
+            assert status == 200, (status, body)
+        report(f"POST {path}", timings)
+    await bot.shop().storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
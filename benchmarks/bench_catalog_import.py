@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк импорта и экспорта каталога (catalog_io.py + import_catalog в bot.py).
+Сравнивается построчная запись (как мастер /add: одна операция записи на товар)
+и импорт CSV пачками по IMPORT_CHUNK строк с executemany. Для экспорта замеряется
+пиковая память Python (tracemalloc): она не должна расти вместе с каталогом. Для импорта
+показывается временная память (пик минус то, что осталось занято после импорта: новые
+товары в индексе поиска и фасетах занимают память и без импорта).
+Запуск: python benchmarks/bench_catalog_import.py [строк]
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+BRANDS = ("Michelin", "Nokian", "Pirelli", "Continental", "Bridgestone")
+SIZES = ("205/55 R16", "225/45 R17", "195/65 R15", "245/40 R18")
+SEASONS = ("Летняя", "Зимняя", "Всесезонная")
+
+
+def make_rows(count: int, sku_prefix: str):
+    for i in range(count):
+        yield (f"{sku_prefix}{i}", f"{BRANDS[i % 5]} Model {i} {SIZES[i % 4]}", 4000 + i % 9000,
+               f"{SEASONS[i % 3]}; {SIZES[i % 4]}")
+
+
+def write_csv(path: str, count: int):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write("sku;name;price;specs\r\n")
+        for sku, name, price, specs in make_rows(count, "IMP"):
+            f.write(f'{sku};{name};{price};"{specs}"\r\n')
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    workdir = tempfile.mkdtemp()
+    os.environ["DB_PATH"] = os.path.join(workdir, "bench_catalog.sqlite3")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import bot
+
+    await bot.init_db()
+
+    # 1. Построчно, как мастер /add
+    start = time.perf_counter()
+    for sku, name, price, specs in make_rows(count, "ROW"):
+        async def op(db, sku=sku, name=name, price=price, specs=specs):
+            product_id = await db.fetchval(
+                "INSERT INTO products(sku, name, price, specs) VALUES(?,?,?,?) RETURNING id",
+                (sku, name, price, json.dumps(specs.split("; "), ensure_ascii=False))
+            )
+            return await bot.product_change(db, product_id)
+        bot.apply_product_change(await bot.shop().storage.write(op))
+    row_elapsed = time.perf_counter() - start
+    print(f"По одному товару:      {count} строк за {row_elapsed:6.2f} с ({count / row_elapsed:7.0f} строк/с)")
+
+    # 2. Импорт CSV: новые товары, затем повторный импорт того же файла (обновление)
+    csv_path = os.path.join(workdir, "catalog.csv")
+    write_csv(csv_path, count)
+    for title in ("Импорт CSV (новые):   ", "Импорт CSV (обновл.): "):
+        tracemalloc.start()
+        with open(csv_path, "rb") as f:
+            report = await bot.import_catalog(f)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert report["errors"] == 0, report["error_samples"]
+        print(f"{title}{report['rows']} строк за {report['elapsed_s']:6.2f} с "
+              f"({report['rows'] / max(report['elapsed_s'], 1e-3):7.0f} строк/с), "
+              f"добавлено {report['created']}, обновлено {report['updated']}, "
+              f"временная память {(peak - retained) / 1024 / 1024:.1f} МБ")
+
+    # 3. Экспорт всего каталога
+    total = sqlite3.connect(os.environ["DB_PATH"]).execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = 0
+    async for chunk in bot.iter_catalog_csv():
+        size += len(chunk.encode())
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"Экспорт:               {total} товаров, {size / 1024 / 1024:.1f} МБ за {elapsed:6.2f} с, "
+          f"пик памяти {peak / 1024 / 1024:.1f} МБ")
+    await bot.shop().storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк и проверка ленты событий администраторов (GET /api/admin/events, events.py).
+
+Через ASGI-приложение bot.py во временную БД (сообщения в чат заказов — заглушка):
+1. Открываются subscribers лент SSE; память на подписчика, лимиты admission.py
+   (ленты не занимают общий лимит одновременных запросов).
+2. Оформляются orders заказов через POST /api/order — задержка доставки события
+   каждому подписчику (от публикации до получения кадра), время ответа на заказ
+   с открытыми лентами и без них; каждый подписчик получил все заказы по порядку.
+3. Часть подписчиков отключается, приходят новые заказы, подписчики переподключаются
+   с Last-Event-ID — получают ровно пропущенное; неизвестный ID — событие reset.
+4. Медленный подписчик (не забирает данные): его буфер ограничен, поток завершается,
+   после переподключения он догоняет из истории.
+5. Пинг в простое.
+Запуск: python benchmarks/bench_events.py [подписчиков] [заказов]
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _asgi import asgi_post, http_scope  # noqa: E402
+from bench_admission import percentile, rss_mb  # noqa: E402
+from bench_stock import order_payload  # noqa: E402
+
+ADMIN_TOKEN = "bench-admin-token"
+
+
+class SseClient:
+    """Подписчик ленты поверх ASGI: разбирает кадры и замеряет задержку доставки"""
+
+    def __init__(self, app, last_event_id=None, slow=False):
+        self.app = app
+        self.last_event_id = last_event_id
+        self.events = []
+        self.latencies = []
+        self.pings = 0
+        self.status = None
+        self.slow = slow
+        self.unblock = asyncio.Event()
+        self._disconnect = asyncio.Event()
+        self._buffer = b""
+        self._task = None
+
+    def start(self):
+        headers = {"X-Admin-Token": ADMIN_TOKEN, "Accept": "text/event-stream"}
+        if self.last_event_id:
+            headers["Last-Event-ID"] = self.last_event_id
+        scope = http_scope("GET", "/api/admin/events", headers)
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await self._disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                self.status = message["status"]
+            elif message["type"] == "http.response.body":
+                if self.slow and self.events:
+                    # Как клиент с заполненным TCP-буфером: отправка не завершается
+                    await self.unblock.wait()
+                self._feed(message.get("body", b""))
+
+        self._task = asyncio.create_task(self.app(scope, receive, send))
+        return self
+
+    def _feed(self, chunk: bytes):
+        now = time.time()
+        self._buffer += chunk
+        while b"\n\n" in self._buffer:
+            frame, self._buffer = self._buffer.split(b"\n\n", 1)
+            fields = {}
+            for line in frame.decode().split("\n"):
+                if line.startswith(":"):
+                    self.pings += 1
+                    continue
+                name, _, value = line.partition(": ")
+                fields[name] = value
+            if "id" in fields:
+                self.last_event_id = fields["id"]
+            if "data" in fields:
+                data = json.loads(fields["data"])
+                # Только вид и номер заказа: разобранные события сотен подписчиков раздували бы
+                # кучу бенчмарка, и паузы сборщика мусора попадали бы в задержку доставки
+                self.events.append((fields.get("event"), data.get("order", {}).get("number")))
+                self.latencies.append(now - data["ts"])
+
+    @property
+    def finished(self) -> bool:
+        return self._task.done()
+
+    async def disconnect(self):
+        self._disconnect.set()
+        self.unblock.set()
+        await asyncio.wait_for(self._task, 5)
+
+
+async def wait_until(predicate, timeout: float = 10.0):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("условие не выполнилось за отведённое время")
+        await asyncio.sleep(0.005)
+
+
+def order_numbers(client: SseClient):
+    return [number for kind, number in client.events if kind == "order"]
+
+
+async def main():
+    subscribers = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    orders = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench_events.sqlite3")
+    os.environ["DB_PATH"] = db_path
+    os.environ["ADMIN_API_TOKEN"] = ADMIN_TOKEN
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Заказы идут от одного клиента: лимит заказов на покупателя здесь не замеряется
+    os.environ["ADMISSION_ORDERS_PER_MINUTE"] = "1000000"
+    os.environ["ADMISSION_ORDER_BURST"] = "1000000"
+    os.environ.setdefault("EVENTS_HEARTBEAT_SECONDS", "0.2")
+    os.environ.setdefault("EVENTS_SUBSCRIBER_BUFFER", "64")
+    import bot
+
+    async def no_telegram(chat_id, text, **kwargs):
+        return None
+
+    bot.shop().bot.send_message = no_telegram
+    await bot.init_db()
+    bot.shop().initialized = True
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO products(id, name, price) VALUES(1, 'Шина 1', 5000)")
+    payload = order_payload([(1, 1)], None)
+    hub = bot.shop().events
+
+    async def place_orders(count: int):
+        timings = []
+        for _ in range(count):
+            start = time.perf_counter()
+            status, body = await asgi_post(bot.app, "/api/order", payload, {})
+            timings.append(time.perf_counter() - start)
+            assert status == 200 and body["status"] == "ok", (status, body)
+        return timings
+
+    # Время заказа без подписчиков (после прогрева)
+    await place_orders(20)
+    baseline = await place_orders(orders)
+
+    # 1. Подключение подписчиков
+    rss_before = rss_mb()
+    clients = [SseClient(bot.app).start() for _ in range(subscribers)]
+    await wait_until(lambda: hub.report()["subscribers"] == subscribers and all(c.status for c in clients))
+    rss_after = rss_mb()
+    assert all(c.status == 200 for c in clients), {c.status for c in clients}
+    report = bot.admission.report()
+    route = report["routes"]["GET /api/admin/events"]
+    print(f"Подписчиков: {subscribers}, RSS +{rss_after - rss_before:.1f} МБ "
+          f"({(rss_after - rss_before) * 1024 / subscribers:.1f} КБ на подписчика); "
+          f"открыто лент по admission: {route['in_flight']}, общий in_flight: {report['in_flight']}")
+    assert report["in_flight"] == 0, "ленты не должны занимать общий лимит одновременных запросов"
+
+    # 2. Доставка заказов
+    with_feed = await place_orders(orders)
+    await wait_until(lambda: all(len(order_numbers(c)) == orders for c in clients))
+    expected = order_numbers(clients[0])
+    assert expected == sorted(expected) and all(order_numbers(c) == expected for c in clients), "порядок событий"
+    latencies = [value * 1000 for c in clients for value in c.latencies]
+    print(f"Заказов: {orders}, доставок: {len(latencies)}; задержка доставки, мс: "
+          f"p50 {percentile(latencies, 0.5):.2f}, p95 {percentile(latencies, 0.95):.2f}, "
+          f"p99 {percentile(latencies, 0.99):.2f}, макс {max(latencies):.2f}")
+    print(f"POST /api/order: без лент {statistics.mean(baseline) * 1000:.2f} мс, "
+          f"с {subscribers} лентами {statistics.mean(with_feed) * 1000:.2f} мс (среднее)")
+
+    # 3. Переподключение с Last-Event-ID
+    gone = clients[: max(1, subscribers // 10)]
+    for client in gone:
+        await client.disconnect()
+    await wait_until(lambda: hub.report()["subscribers"] == subscribers - len(gone))
+    missed = 10
+    await place_orders(missed)
+    resumed = [SseClient(bot.app, last_event_id=c.last_event_id).start() for c in gone]
+    await wait_until(lambda: all(len(order_numbers(c)) == missed for c in resumed))
+    await asyncio.sleep(0.05)
+    assert all(len(order_numbers(c)) == missed for c in resumed), "пропущенное пришло дважды"
+    assert order_numbers(resumed[0]) == order_numbers(clients[-1])[-missed:]
+    print(f"Переподключение с Last-Event-ID: {len(resumed)} подписчиков получили ровно {missed} пропущенных заказов")
+    stale = SseClient(bot.app, last_event_id="0-1").start()
+    await wait_until(lambda: stale.events)
+    assert stale.events[0][0] == "reset"
+    print("Неизвестный Last-Event-ID: первым событием пришёл reset")
+
+    # 4. Медленный подписчик
+    slow = SseClient(bot.app, slow=True).start()
+    await wait_until(lambda: slow.status == 200)
+    await place_orders(1)
+    await wait_until(lambda: slow.events)
+    await place_orders(hub.buffer * 2)
+    buffered = max((len(s.buffer) for s in hub._subscribers), default=0)
+    print(f"Медленный подписчик: в буфере {buffered} кадров из {hub.buffer * 2} новых (лимит {hub.buffer})")
+    assert buffered <= hub.buffer
+    slow.unblock.set()
+    await wait_until(lambda: slow.finished)
+    caught_up = SseClient(bot.app, last_event_id=slow.last_event_id).start()
+    await wait_until(lambda: len(order_numbers(slow)) + len(order_numbers(caught_up)) == 1 + hub.buffer * 2)
+    print(f"  поток завершён после {len(order_numbers(slow))} заказов, после переподключения "
+          f"догнал {len(order_numbers(caught_up))}")
+
+    # 5. Пинг в простое
+    pings = clients[-1].pings
+    await asyncio.sleep(hub.heartbeat * 3)
+    assert clients[-1].pings > pings, "нет пинга в простое"
+    print(f"Пинг в простое: раз в {hub.heartbeat:g} с")
+
+    # Отключение всех: подписки снимаются
+    for client in clients[len(gone):] + resumed + [stale, caught_up]:
+        await client.disconnect()
+    await wait_until(lambda: hub.report()["subscribers"] == 0)
+    print(f"Статистика: {json.dumps(hub.report(), ensure_ascii=False)}")
+    await bot.shop().storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
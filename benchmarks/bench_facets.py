@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк фильтрации каталога по характеристикам шин.
+Создаёт временную БД на 50 000 товаров, разбирает характеристики в product_attrs
+и замеряет время фильтрующих запросов /api/products и ответа /api/products/facets.
+Запуск: python benchmarks/bench_facets.py [количество_товаров]
+"""
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+BRANDS = ["Michelin", "Nokian", "Pirelli", "Кама", "Cordiant", "Hankook", "Yokohama", "Viatti"]
+SEASONS = ["Летняя", "Зимняя шипованная", "Всесезонная"]
+SIZES = [(w, p, r) for w in (175, 185, 195, 205, 215, 225, 235, 245, 255, 265)
+         for p in (45, 50, 55, 60, 65, 70) for r in (14, 15, 16, 17, 18, 19, 20)]
+
+
+def fill_products(db_path: str, count: int):
+    import sqlite3
+    rnd = random.Random(42)
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            image TEXT DEFAULT '🛞',
+            description TEXT DEFAULT '',
+            specs TEXT DEFAULT '[]',
+            active INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    rows = []
+    for i in range(count):
+        w, p, r = rnd.choice(SIZES)
+        specs = [f"{w}/{p} R{r}", rnd.choice(SEASONS)]
+        rows.append((f"{rnd.choice(BRANDS)} Model {i % 97}", rnd.randint(3000, 30000),
+                     json.dumps(specs, ensure_ascii=False), 1 if rnd.random() > 0.1 else 0))
+    conn.executemany("INSERT INTO products(name, price, specs, active) VALUES(?,?,?,?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def timed(samples, fn):
+    async def run():
+        durations = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            result = await fn()
+            durations.append((time.perf_counter() - start) * 1000)
+        return result, durations
+    return run()
+
+
+async def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    tmp_dir = tempfile.mkdtemp(prefix="bench_facets_")
+    db_path = os.path.join(tmp_dir, "bench.sqlite3")
+    os.environ["DB_PATH"] = db_path
+
+    print(f"Создание {count} товаров...")
+    fill_products(db_path, count)
+
+    import bot
+
+    start = time.perf_counter()
+    await bot.init_db()
+    print(f"Разбор характеристик и построение фасетов: {(time.perf_counter() - start) * 1000:.0f} мс")
+
+    cases = {
+        "205/55 R16": dict(width=205, profile=55, rim=16),
+        "R17 + зимние": dict(rim=17, season="winter"),
+        "бренд Michelin": dict(brand="Michelin"),
+        "зимние Nokian": dict(season="winter", brand="Nokian"),
+    }
+    # Страница по умолчанию и максимальная (без limit API больше не отдаёт весь каталог)
+    for limit in (bot.PRODUCTS_PAGE_SIZE, bot.PRODUCTS_MAX_PAGE_SIZE):
+        print(f"Фильтрация, limit={limit}:")
+        for title, params in cases.items():
+            result, durations = await timed(20, lambda: bot.api_products(limit=limit, offset=0, **params))
+            print(f"  {title:<16} найдено {len(result):>5}  медиана {statistics.median(durations):6.2f} мс"
+                  f"  p95 {sorted(durations)[int(len(durations) * 0.95) - 1]:6.2f} мс")
+
+    bot.apply_facet_delta(None, None)  # сбрасываем кэш ответа
+    _, cold = await timed(1, bot.api_product_facets)
+    _, warm = await timed(100, bot.api_product_facets)
+    print(f"  /api/products/facets: первый ответ {cold[0]:.2f} мс, из кэша {statistics.median(warm) * 1000:.1f} мкс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Проверка и замер идемпотентного оформления заказа (Idempotency-Key в POST /api/order).
+Через ASGI-приложение bot.py во временную БД; сообщения в чат заказов подсчитываются
+заглушкой вместо отправки в Telegram.
+
+1. Повторы без ключа — каждый создаёт заказ (как было раньше).
+2. Одновременные повторы с одним ключом — ровно один заказ и одно сообщение.
+3. Время ответа: первое оформление и повтор (LRU в памяти).
+4. Повтор после «перезапуска» (LRU очищен) — номер берётся из таблицы ключей.
+5. Устаревший ключ удаляется задачей обслуживания и снова оформляет заказ.
+Запуск: python benchmarks/bench_idempotency.py [одновременных_повторов]
+"""
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _asgi import asgi_post  # noqa: E402
+from bench_stock import order_payload  # noqa: E402
+
+
+async def main():
+    duplicates = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench_idempotency.sqlite3")
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Все запросы идут от одного клиента — лимиты admission.py здесь не замеряются
+    os.environ.setdefault("ADMISSION_ENABLED", "false")
+    import bot
+    import maintenance
+
+    notifications = []
+
+    async def count_notification(chat_id, text, **kwargs):
+        # Как медленная отправка в Telegram через туннель
+        await asyncio.sleep(0.05)
+        notifications.append(text)
+
+    bot.shop().bot.send_message = count_notification
+    await bot.init_db()
+    bot.shop().initialized = True
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO products(id, name, price) VALUES(1, 'Шина 1', 5000)")
+    payload = order_payload([(1, 1)], None)
+
+    def orders_in_db():
+        return sqlite3.connect(db_path).execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    async def submit(key=None):
+        headers = {"Idempotency-Key": key} if key else {}
+        status, body = await asgi_post(bot.app, "/api/order", payload, headers)
+        assert status == 200, (status, body)
+        return body
+
+    # 1. Без ключа
+    await asyncio.gather(*(submit() for _ in range(duplicates)))
+    print(f"Без ключа: {duplicates} одновременных повторов -> заказов {orders_in_db()}, "
+          f"сообщений в чат {len(notifications)}")
+
+    # 2. Одновременные повторы с одним ключом
+    before_orders, before_messages = orders_in_db(), len(notifications)
+    key = str(uuid.uuid4())
+    results = await asyncio.gather(*(submit(key) for _ in range(duplicates)))
+    numbers = {body["order_number"] for body in results}
+    created = orders_in_db() - before_orders
+    messages = len(notifications) - before_messages
+    print(f"С ключом:  {duplicates} одновременных повторов -> заказов {created}, сообщений в чат {messages}, "
+          f"номера {sorted(numbers)}")
+    assert created == 1 and messages == 1 and len(numbers) == 1, "повтор создал второй заказ"
+
+    # 3. Время ответа: первое оформление и повтор
+    first, repeat = [], []
+    for _ in range(100):
+        key = str(uuid.uuid4())
+        start = time.perf_counter()
+        await submit(key)
+        first.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        body = await submit(key)
+        repeat.append(time.perf_counter() - start)
+        assert body.get("duplicate")
+    print(f"Первое оформление: {statistics.mean(first) * 1000:.2f} мс (запись + сообщение в чат), "
+          f"повтор: {statistics.mean(repeat) * 1000:.2f} мс")
+
+    # 4. Повтор после перезапуска: LRU пуст, ключ находится в таблице
+    bot.shop().order_keys._done.clear()
+    before_orders, before_messages = orders_in_db(), len(notifications)
+    start = time.perf_counter()
+    body = await submit(key)
+    elapsed = (time.perf_counter() - start) * 1000
+    assert body.get("duplicate") and orders_in_db() == before_orders and len(notifications) == before_messages
+    print(f"Повтор после перезапуска: заказ №{body['order_number']} из таблицы ключей за {elapsed:.2f} мс")
+
+    # 5. Устаревший ключ
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("UPDATE order_idempotency SET created_at = datetime('now', '-2 days')")
+    print("Обслуживание:", maintenance.expire_idempotency_keys(db_path))
+    bot.shop().order_keys._done.clear()
+    body = await submit(key)
+    assert not body.get("duplicate"), "устаревший ключ вернул старый заказ"
+    print(f"Устаревший ключ оформил новый заказ №{body['order_number']}")
+    print("Статистика:", bot.shop().order_keys.report())
+    await bot.shop().storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
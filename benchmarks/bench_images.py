@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк обработки загруженных фото: прежний алгоритм (полное декодирование + LANCZOS)
+против images.resize_image_to_optimal (draft + reduce + LANCZOS).
+Каждый прогон выполняется в отдельном процессе, чтобы пиковая память (ru_maxrss)
+относилась только к одному изображению.
+Запуск: python benchmarks/bench_images.py [мегапикселей] [прогонов]
+"""
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+
+def legacy_resize(file_path: str, max_size: int = 800, quality: int = 85):
+    """Алгоритм до перехода на images.py: картинка декодируется в полном размере"""
+    from PIL import Image
+    with Image.open(file_path) as img:
+        img.load()
+        w, h = img.size
+        if w <= max_size and h <= max_size:
+            return
+        if w > h:
+            new_w, new_h = max_size, int(h * max_size / w)
+        else:
+            new_w, new_h = int(w * max_size / h), max_size
+        resized = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+        if resized.mode != "RGB":
+            resized = resized.convert("RGB")
+        resized.save(file_path, "JPEG", quality=quality, optimize=True)
+
+
+def make_photo(path: str, megapixels: float):
+    """Фото "с телефона": JPEG с EXIF (ориентация, производитель)"""
+    from PIL import Image
+    w = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    h = int(w * 3 / 4)
+    img = Image.effect_noise((w, h), 40).convert("RGB")
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    exif[0x010F] = "Phone"
+    img.save(path, "JPEG", quality=90, exif=exif.tobytes())
+    return w, h
+
+
+def child(mode: str, path: str):
+    """Выполняется в дочернем процессе: обрабатывает файл и печатает время и память"""
+    import PIL.Image  # noqa: F401 — импорт не входит в замер
+    import images
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == "legacy":
+        legacy_resize(path)
+    else:
+        images.resize_image_to_optimal(path)
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{elapsed} {(peak_rss - base_rss) / 1024}")
+
+
+def run(mode: str, source: str, workdir: str):
+    path = os.path.join(workdir, f"{mode}.jpg")
+    shutil.copyfile(source, path)
+    out = subprocess.run([sys.executable, __file__, "--child", mode, path],
+                         check=True, capture_output=True, text=True).stdout
+    elapsed, peak_mb = map(float, out.split())
+    return elapsed, peak_mb
+
+
+def main():
+    megapixels = float(sys.argv[1]) if len(sys.argv) > 1 else 48
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "source.jpg")
+        # Генерируем исходник в отдельном процессе: ru_maxrss родителя наследуется
+        # дочерними процессами через fork и исказил бы замер
+        out = subprocess.run([sys.executable, __file__, "--make", str(megapixels), source],
+                             check=True, capture_output=True, text=True).stdout
+        w, h = map(int, out.split())
+        size_mb = os.path.getsize(source) / 1024 / 1024
+        print(f"Исходник: {w}x{h} ({w * h / 1e6:.0f} Мп, {size_mb:.1f} МБ), прогонов: {runs}")
+
+        for mode in ("legacy", "draft"):
+            results = [run(mode, source, workdir) for _ in range(runs)]
+            times = [r[0] * 1000 for r in results]
+            peaks = [r[1] for r in results]
+            print(f"{mode:>7}: {statistics.median(times):7.0f} мс на фото, "
+                  f"прирост пиковой памяти {statistics.median(peaks):6.1f} МБ")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 4 and sys.argv[1] == "--make":
+        print(*make_photo(sys.argv[3], float(sys.argv[2])))
+    else:
+        main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк выгрузки заказов (orders_export.py).
+Заказы за период выгружаются в CSV и NDJSON для двух размеров БД; замеряется скорость
+и пиковая память Python (tracemalloc). Для сравнения — выгрузка «всё сразу» (fetchall
+и один json.dumps), как при ручном копировании данных скриптом. Потоковая выгрузка
+должна занимать одинаково мало памяти при любом числе заказов.
+Запуск: python benchmarks/bench_orders_export.py [заказов_в_малой_БД] [заказов_в_большой_БД]
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from orders_export import iter_orders_export, parse_period  # noqa: E402
+
+
+def make_db(path: str, count: int):
+    with sqlite3.connect(path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+        CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            payload TEXT NOT NULL,
+            payment_method TEXT DEFAULT 'cash',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        conn.execute("CREATE INDEX idx_orders_created ON orders(created_at)")
+        # Все заказы в пределах сентября 2026 года, по нескольку секунд друг от друга
+        step = 30 * 24 * 3600 / count
+        rows = []
+        for i in range(count):
+            seconds = int(i * step)
+            created_at = (f"2026-09-{1 + seconds // 86400:02d} {seconds // 3600 % 24:02d}:"
+                          f"{seconds // 60 % 60:02d}:{seconds % 60:02d}")
+            payload = json.dumps({
+                "user_id": 1000 + i % 5000, "full_name": f"Покупатель {i % 5000}", "phone": "+79170000000",
+                "items": [{"id": 1 + (i + k) % 300, "name": f"Шина {(i + k) % 300} 205/55 R16", "price": 5000,
+                           "qty": 4} for k in range(1 + i % 3)],
+                "total": 20000 * (1 + i % 3), "comment": "", "payment_method": "cash",
+                "delivery_type": "pickup", "branch_id": 1 + i % 2,
+            }, ensure_ascii=False)
+            rows.append((1000 + i % 5000, payload, "cash", created_at))
+        conn.executemany("INSERT INTO orders(user_id, payload, payment_method, created_at) VALUES(?,?,?,?)", rows)
+
+
+async def streaming(db_path: str, fmt: str):
+    start, end = parse_period("2026-09")
+    size = 0
+    async for chunk in iter_orders_export(db_path, None, start, end, fmt):
+        size += len(chunk.encode())
+    return size
+
+
+async def all_at_once(db_path: str, fmt: str):
+    start, end = parse_period("2026-09")
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT id, created_at, user_id, payment_method, payload FROM orders "
+                        "WHERE created_at >= ? AND created_at < ?", (start, end)).fetchall()
+    data = [{"id": r[0], "created_at": r[1], "user_id": r[2], **json.loads(r[4])} for r in rows]
+    return len(json.dumps(data, ensure_ascii=False).encode())
+
+
+async def measure(title: str, func, db_path: str, fmt: str, count: int):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = await func(db_path, fmt)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"  {title:<22} {count / elapsed:8.0f} заказов/с, {size / 1024 / 1024:6.1f} МБ, "
+          f"пик памяти {peak / 1024 / 1024:6.1f} МБ")
+
+
+async def main():
+    sizes = [int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+             int(sys.argv[2]) if len(sys.argv) > 2 else 200000]
+    workdir = tempfile.mkdtemp()
+    for count in sizes:
+        db_path = os.path.join(workdir, f"orders_{count}.sqlite3")
+        make_db(db_path, count)
+        print(f"{count} заказов за месяц:")
+        await measure("потоково, CSV", streaming, db_path, "csv", count)
+        await measure("потоково, NDJSON", streaming, db_path, "ndjson", count)
+        await measure("всё сразу (fetchall)", all_at_once, db_path, "json", count)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного старта bot.py.
+Замеряет время импорта модуля и время от запуска процесса до первого ответа
+/api/health. Telegram для замера не нужен: рукопожатие идёт параллельно с API,
+поэтому с фиктивным токеном бот не стартует, а API отвечает как обычно.
+Запуск: python benchmarks/bench_startup.py [количество_прогонов]
+"""
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import bot"], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def measure_first_request(env) -> dict:
+    port = free_port()
+    env = dict(env, PORT=str(port))
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "bot.py"], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + 60
+        while time.perf_counter() < deadline:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1):
+                    wall_s = time.perf_counter() - start
+                # Отчёт о запуске заполняется после первого ответа — читаем его вторым запросом
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/health", timeout=1) as resp:
+                    return {"wall_s": wall_s, **json.load(resp)["startup"]}
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError("API не ответил за 60 секунд")
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    tmp_dir = tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(
+        os.environ,
+        DB_PATH=os.path.join(tmp_dir, "bench.sqlite3"),
+        BOT_TOKEN="123456:BENCHMARK-TOKEN-NOT-VALID",
+        USE_WEBHOOK="false",
+    )
+
+    imports = [measure_import(env) for _ in range(runs)]
+    starts = [measure_first_request(env) for _ in range(runs)]
+
+    print(f"Прогонов: {runs}")
+    print(f"  python -c 'import bot':            медиана {statistics.median(imports):.3f} с")
+    print(f"  импорт модулей (внутри процесса):  медиана "
+          f"{statistics.median(s['import_s'] for s in starts):.3f} с")
+    print(f"  первый запрос (внутри процесса):   медиана "
+          f"{statistics.median(s['first_request_s'] for s in starts):.3f} с")
+    print(f"  первый ответ /api/health (снаружи): медиана "
+          f"{statistics.median(s['wall_s'] for s in starts):.3f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Нагрузочная проверка резервирования остатков в POST /api/order.
+Одновременные заказы идут через ASGI-приложение bot.py (все middleware, отдельное
+соединение с БД на запрос) во временную БД. Проверяется, что товар не продан сверх
+остатка, и замеряется пропускная способность. Уведомление в чат заказов подменяется
+заглушкой — замеряется только резервирование и запись заказа.
+Запуск: python benchmarks/bench_stock.py [заказов] [одновременных]
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _asgi import asgi_post  # noqa: E402
+
+BRANCHES = (1, 2)
+
+
+def order_payload(items, branch_id):
+    return {
+        "phone": "+70000000000",
+        "items": [{"id": pid, "name": f"Шина {pid}", "price": 5000, "qty": qty} for pid, qty in items],
+        "total": 5000 * sum(qty for _, qty in items),
+        "branch_id": branch_id,
+    }
+
+
+async def run_orders(bot, orders, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(items, branch_id):
+        async with semaphore:
+            return await asgi_post(bot.app, "/api/order", order_payload(items, branch_id))
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(items, branch_id) for items, branch_id in orders))
+    return results, time.perf_counter() - start
+
+
+async def main():
+    total_orders = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "bench_stock.sqlite3")
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Все запросы идут от одного клиента — лимиты admission.py здесь не замеряются
+    os.environ.setdefault("ADMISSION_ENABLED", "false")
+    import bot
+
+    async def no_notification(*args, **kwargs):
+        return None
+
+    bot.shop().bot.send_message = no_notification
+    await bot.init_db()
+    bot.shop().initialized = True
+
+    # 1. Последний комплект: много покупателей одновременно хотят один и тот же товар
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany("INSERT INTO products(name, price) VALUES(?, ?)",
+                         [(f"Шина {i}", 5000) for i in range(1, 21)])
+    hot_qty = 10
+    await bot.set_stock(1, 1, hot_qty)
+    results, elapsed = await run_orders(bot, [([(1, 1)], 1)] * 300, concurrency)
+    statuses = Counter(status for status, _ in results)
+    final_qty = sqlite3.connect(db_path).execute(
+        "SELECT qty FROM stock WHERE product_id=1 AND branch_id=1").fetchone()[0]
+    print(f"Последний товар: остаток {hot_qty}, 300 одновременных заказов -> "
+          f"успешно {statuses[200]}, отказ (409) {statuses[409]}, осталось {final_qty}")
+    assert statuses[200] == hot_qty and final_qty == 0, "продано больше, чем было на складе"
+    assert final_qty == bot.shop().stock[1][1], "карта остатков в памяти разошлась с БД"
+
+    # 2. Смешанная нагрузка: 20 товаров в двух филиалах, 1-3 позиции в заказе
+    initial = {}
+    for product_id in range(1, 21):
+        for branch_id in BRANCHES:
+            initial[(product_id, branch_id)] = 40
+            await bot.set_stock(product_id, branch_id, 40)
+    rnd = random.Random(42)
+    orders = []
+    for _ in range(total_orders):
+        items = [(pid, rnd.randint(1, 4)) for pid in rnd.sample(range(1, 21), rnd.randint(1, 3))]
+        orders.append((items, rnd.choice(BRANCHES)))
+    results, elapsed = await run_orders(bot, orders, concurrency)
+
+    sold = Counter()
+    accepted = 0
+    for (items, branch_id), (status, body) in zip(orders, results):
+        assert status in (200, 409), (status, body)
+        if status == 200:
+            accepted += 1
+            for pid, qty in items:
+                sold[(pid, branch_id)] += qty
+    conn = sqlite3.connect(db_path)
+    final = {(pid, bid): qty for pid, bid, qty in conn.execute("SELECT product_id, branch_id, qty FROM stock")}
+    for key, start_qty in initial.items():
+        assert final[key] == start_qty - sold[key] >= 0, f"расхождение остатка {key}"
+        assert bot.shop().stock[key[0]][key[1]] == final[key], f"карта остатков устарела {key}"
+    orders_in_db = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    assert orders_in_db == hot_qty + accepted, "число заказов не совпадает с успешными ответами"
+
+    print(f"Смешанная нагрузка: {total_orders} заказов, {concurrency} одновременно, "
+          f"принято {accepted}, отказ {total_orders - accepted}")
+    print(f"Пропускная способность: {total_orders / elapsed:.0f} заказов/с "
+          f"({elapsed * 1000 / total_orders:.2f} мс на заказ)")
+    print("Перепродаж нет, остатки в БД и в памяти совпадают ✅")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
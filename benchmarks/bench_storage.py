@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Проверка и сравнение бэкендов хранения (storage/): SQLite и PostgreSQL.
+
+1. Контракт репозиториев — одни и те же проверки на каждом бэкенде: товары
+   (создание, скрытие, фильтры, импорт по артикулу, сброс file_id), характеристики,
+   остатки (списание без ухода в минус, в том числе при одновременных заказах),
+   заказы (история по курсору, выгрузка за период), ключи идемпотентности, админы,
+   откат транзакции и IntegrityError.
+2. Пропускная способность: запись заказов и чтение страниц каталога при
+   одновременных клиентах.
+
+SQLite проверяется всегда (временный файл). PostgreSQL — если передан адрес
+аргументом или в DATABASE_URL; таблицы магазина в этой базе УДАЛЯЮТСЯ, поэтому
+укажите пустую тестовую базу.
+Запуск: python benchmarks/bench_storage.py [postgresql://...] [клиентов] [операций_на_клиента]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from storage import IntegrityError, Storage, open_storage  # noqa: E402
+
+SHOP_TABLES = ("products", "orders", "admins", "product_attrs", "stock", "order_idempotency")
+PAYLOAD = json.dumps({"items": [{"id": 1, "name": "Шина 1", "price": 5000, "qty": 4}], "total": 20000},
+                     ensure_ascii=False)
+CATALOG_SIZE = 2000
+
+
+class Rollback(Exception):
+    pass
+
+
+async def reset(storage: Storage):
+    """Пустая схема: для PostgreSQL таблицы удаляются и создаются заново"""
+    if storage.dialect != "sqlite":
+        async def drop(db):
+            await db.execute(f"DROP TABLE IF EXISTS {', '.join(SHOP_TABLES)}")
+        await storage.write(drop)
+    await storage.init_schema()
+
+
+async def check_products(storage: Storage):
+    products = storage.products
+
+    async def create(db):
+        first = await products.create(db, "Michelin 205/55 R16", 5000, "/api/uploads/a.jpg", "", '["лето"]',
+                                      "file-a", "uniq-a")
+        second = await products.create(db, "Nokian 195/65 R15", 4000, "🛞", "", "[]")
+        await products.save_attrs(db, {first: (205, 55, 16.0, "summer", "Michelin", 1),
+                                       second: (195, 65, 15.0, "winter", "Nokian", 1)})
+        return first, second
+
+    first, second = await storage.write(create)
+    assert first < second
+
+    async with storage.read() as db:
+        row = await products.get(db, first)
+        assert row["name"] == "Michelin 205/55 R16" and row["active"] == 1 and row["image_file_id"] == "file-a"
+        assert len(row["created_at"]) == 19, row["created_at"]
+        assert await products.get(db, 10 ** 9) is None
+        assert [r["id"] for r in await products.recent(db, 10)] == [second, first]
+        assert [r["id"] for r in await products.list(db, {"width": 205})] == [first]
+        assert [r["id"] for r in await products.list(db, {"rim": 15.0, "season": "winter"})] == [second]
+        assert [r["id"] for r in await products.list(db, {}, limit=1, offset=1)] == [first]
+        assert await products.cart_catalog(db, [first, 10 ** 9]) == {first: {"name": "Michelin 205/55 R16",
+                                                                             "price": 5000}}
+        assert await products.file_id_for_image(db, "/api/uploads/a.jpg") == "file-a"
+        assert await products.attrs(db, [first]) == {first: (205, 55, 16.0, "summer", "Michelin", 1)}
+
+    # Скрытие и возврат товара
+    assert await storage.write(lambda db: products.toggle_active(db, second)) == 0
+    assert await storage.write(lambda db: products.toggle_active(db, 10 ** 9)) is None
+    async def hide_attrs(db):
+        await products.save_attrs(db, {second: (195, 65, 15.0, "winter", "Nokian", 0)})
+    await storage.write(hide_attrs)
+    async with storage.read() as db:
+        assert [r["id"] for r in await products.active(db)] == [first]
+        assert [r["id"] for r in await products.list(db, {"brand": "Nokian"})] == []
+        assert [r["id"] for r in await products.list(db, {"brand": "Nokian"}, include_inactive=True)] == [second]
+        assert await products.cart_catalog(db, [second]) == {}
+        assert sorted(await products.active_attrs(db)) == [(205, 55, 16.0, "summer", "Michelin")]
+    assert await storage.write(lambda db: products.set_active(db, second, True))
+
+    # Импорт по артикулу: повтор артикула в пачке обновляет только что добавленный товар
+    async def upsert(db):
+        return await products.upsert_by_sku(db, ("name", "price"), [("SKU-1", "Шина A", 100),
+                                                                    ("SKU-2", "Шина B", 200),
+                                                                    ("SKU-1", "Шина A2", 110)])
+    imported = await storage.write(upsert)
+    assert len(imported) == 2
+    async with storage.read() as db:
+        by_sku = await products.ids_by_sku(db, ["SKU-1", "SKU-2", "SKU-3"])
+        assert set(by_sku) == {"SKU-1", "SKU-2"} and sorted(by_sku.values()) == sorted(imported)
+        assert (await products.get(db, by_sku["SKU-1"]))["price"] == 110
+        assert await products.existing_ids(db, [first, 10 ** 9]) == {first}
+        assert {row["id"] for row in await products.without_attrs(db)} == set(imported)
+
+    # Обновление пачкой: новое фото сбрасывает file_id, то же фото — нет
+    async def update(db):
+        await products.update_many(db, ("image", "price"), [
+            (None, "/api/uploads/b.jpg", "/api/uploads/b.jpg", "/api/uploads/b.jpg", 5100, first),
+            ("SKU-0", "🛞", "🛞", "🛞", 4100, second),
+        ])
+    await storage.write(update)
+    async with storage.read() as db:
+        row = await products.get(db, first)
+        assert (row["image"], row["price"], row["image_file_id"], row["sku"]) == ("/api/uploads/b.jpg", 5100, None, None)
+        row = await products.get(db, second)
+        assert (row["sku"], row["price"]) == ("SKU-0", 4100)
+        page = await products.export_page(db, 0, 2)
+        assert [r[0] for r in page] == [first, second] and len(page[0]) == 8
+        assert await products.export_page(db, max(imported), 10) == []
+
+    # Артикул уже занят другим товаром — IntegrityError, пачка не записана
+    async def steal_sku(db):
+        await products.update_many(db, ("price",), [("SKU-2", 1, first)])
+    try:
+        await storage.write(steal_sku)
+    except IntegrityError:
+        pass
+    else:
+        raise AssertionError("ожидалась IntegrityError")
+    async with storage.read() as db:
+        assert (await products.get(db, first))["price"] == 5100
+
+    async def delete_attrs(db):
+        await products.delete_attrs(db, [second])
+    await storage.write(delete_attrs)
+    async with storage.read() as db:
+        assert await products.attrs(db, [first, second]) == {first: (205, 55, 16.0, "summer", "Michelin", 1)}
+    return first
+
+
+async def check_stock(storage: Storage, product_id: int):
+    stock = storage.stock
+    await storage.write(lambda db: stock.set(db, product_id, 1, 5))
+    await storage.write(lambda db: stock.set(db, product_id, 2, 1))
+    assert await storage.write(lambda db: stock.take(db, product_id, 1, 3)) == 2
+    assert await storage.write(lambda db: stock.take(db, product_id, 1, 3)) is None
+    assert await storage.write(lambda db: stock.take(db, 10 ** 9, 1, 1)) is None
+    async with storage.read() as db:
+        assert await stock.availability(db, product_id, 1) == (2, 2)
+        assert await stock.availability(db, product_id, 3) == (0, 2)
+        assert await stock.availability(db, 10 ** 9, 1) == (0, 0)
+        assert sorted(await stock.all(db)) == [(product_id, 1, 2), (product_id, 2, 1)]
+
+    # Откат: списание внутри упавшей операции не сохраняется
+    async def failing(db):
+        await stock.take(db, product_id, 1, 1)
+        raise Rollback()
+    try:
+        await storage.write(failing)
+    except Rollback:
+        pass
+    async with storage.read() as db:
+        assert await stock.availability(db, product_id, 1) == (2, 2)
+
+    # Последний комплект: одновременные списания не уводят остаток в минус
+    await storage.write(lambda db: stock.set(db, product_id, 1, 10))
+    taken = await asyncio.gather(*(storage.write(lambda db: stock.take(db, product_id, 1, 1)) for _ in range(50)))
+    assert sum(1 for qty in taken if qty is not None) == 10, taken
+    async with storage.read() as db:
+        assert await stock.availability(db, product_id, 1) == (0, 2)
+
+
+async def check_orders(storage: Storage):
+    orders = storage.orders
+    ids = []
+    for user_id in (7, 7, 7, 8, None):
+        ids.append(await storage.write(lambda db, user_id=user_id: orders.create(db, user_id, PAYLOAD, "cash")))
+    assert ids == sorted(ids)
+    async with storage.read() as db:
+        page = await orders.for_user(db, 7, 2)
+        assert [row[0] for row in page] == [ids[2], ids[1]]
+        order_id, payload, payment_method, created_at = page[-1]
+        assert json.loads(payload)["total"] == 20000 and payment_method == "cash" and len(created_at) == 19
+        rest = await orders.for_user(db, 7, 2, before=(created_at, order_id))
+        assert [row[0] for row in rest] == [ids[0]]
+        assert sorted(await orders.customer_ids(db)) == [7, 8]
+
+    # Выгрузка за период: все заказы, по возрастанию, строки в формате orders_export
+    rows = []
+    async for chunk in storage.iter_order_rows("2000-01-01 00:00:00", "2100-01-01 00:00:00", 2):
+        assert len(chunk) <= 2
+        rows.extend(chunk)
+    assert [row[0] for row in rows] == ids and rows[0][2:4] == (7, "cash") and rows[-1][2] is None
+    async for _ in storage.iter_order_rows("2000-01-01 00:00:00", "2000-01-02 00:00:00", 2):
+        raise AssertionError("заказов за этот период быть не должно")
+
+    # Ключи идемпотентности
+    assert await storage.write(lambda db: orders.claim_key(db, "7:k", ids[0], 24)) is None
+    assert await storage.write(lambda db: orders.claim_key(db, "7:k", ids[1], 24)) == ids[0]
+    async with storage.read() as db:
+        assert await orders.order_for_key(db, "7:k", 24) == ids[0]
+        assert await orders.order_for_key(db, "7:other", 24) is None
+    # Ключ считается устаревшим сразу (ttl 0): его можно закрепить заново, а затем удалить
+    await asyncio.sleep(1.1)
+    async with storage.read() as db:
+        assert await orders.order_for_key(db, "7:k", 0) is None
+    assert await storage.write(lambda db: orders.claim_key(db, "7:k", ids[1], 0)) is None
+    async with storage.read() as db:
+        assert await orders.order_for_key(db, "7:k", 24) == ids[1]
+    await asyncio.sleep(1.1)
+    assert await storage.write(lambda db: orders.expire_keys(db, 0, 100)) == 1
+    assert await storage.write(lambda db: orders.expire_keys(db, 0, 100)) == 0
+
+
+async def check_admins(storage: Storage):
+    await storage.write(lambda db: storage.admins.add(db, 42, "first"))
+    await storage.write(lambda db: storage.admins.add(db, 42, "renamed"))
+    await storage.write(lambda db: storage.admins.add(db, 43, None))
+    async with storage.read() as db:
+        assert sorted(await storage.admins.ids(db)) == [42, 43]
+        assert await db.fetchval("SELECT username FROM admins WHERE user_id=?", (42,)) == "renamed"
+
+
+async def check_contract(storage: Storage):
+    await reset(storage)
+    product_id = await check_products(storage)
+    await check_stock(storage, product_id)
+    await check_orders(storage)
+    await check_admins(storage)
+
+
+async def run_clients(clients: int, per_client: int, operation) -> float:
+    async def client(n):
+        for i in range(per_client):
+            await operation(n, i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return time.perf_counter() - start
+
+
+async def measure(storage: Storage, clients: int, per_client: int) -> dict:
+    await reset(storage)
+    total = clients * per_client
+
+    async def seed(db):
+        await storage.products.upsert_by_sku(db, ("name", "price", "specs"), [
+            (f"SKU-{i}", f"Шина {i} 205/55 R16", 3000 + i, "[]") for i in range(CATALOG_SIZE)])
+        rows = await db.fetch("SELECT id FROM products")
+        await storage.products.save_attrs(db, {
+            row["id"]: (195 + row["id"] % 4 * 10, 55, 16.0, "summer", "Brand", 1) for row in rows})
+    await storage.write(seed)
+
+    async def insert_order(n, i):
+        await storage.write(lambda db: storage.orders.create(db, n + 1, PAYLOAD, "cash"))
+
+    async def read_page(n, i):
+        async with storage.read() as db:
+            if i % 2:
+                await storage.products.list(db, {"width": 205}, limit=20, offset=i % 10 * 20)
+            else:
+                await storage.products.list(db, {}, limit=20, offset=i % 10 * 20)
+
+    results = {}
+    for title, operation in (("запись заказов", insert_order), ("чтение каталога", read_page)):
+        elapsed = await run_clients(clients, per_client, operation)
+        results[title] = total / elapsed
+    return results
+
+
+async def main():
+    args = sys.argv[1:]
+    url = args.pop(0) if args and "://" in args[0] else os.environ.get("DATABASE_URL", "")
+    clients = int(args[0]) if len(args) > 0 else 50
+    per_client = int(args[1]) if len(args) > 1 else 20
+
+    workdir = tempfile.mkdtemp()
+    backends = [("SQLite", lambda: open_storage("", os.path.join(workdir, "bench_storage.sqlite3")))]
+    if url:
+        backends.append(("PostgreSQL", lambda: open_storage(url, "")))
+    else:
+        print("PostgreSQL не проверяется: передайте адрес тестовой базы аргументом или в DATABASE_URL\n")
+
+    print(f"Нагрузка: {clients} клиентов × {per_client} операций, каталог {CATALOG_SIZE} товаров")
+    for title, factory in backends:
+        storage = factory()
+        try:
+            await check_contract(storage)
+            print(f"\n{title}: контракт репозиториев ✅")
+            for operation, rate in (await measure(storage, clients, per_client)).items():
+                print(f"  {operation:16s} {rate:8.0f} операций/с")
+            print(f"  {storage.report()}")
+        finally:
+            await storage.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
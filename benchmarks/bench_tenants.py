@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк памяти на магазин при размещении нескольких магазинов в одном процессе (tenants.py).
+
+Для каждого числа магазинов запускается отдельный процесс bot.py с TENANTS_FILE
+(фиктивные токены, у каждого магазина своя БД SQLite с products_per_shop товарами):
+он инициализирует БД всех магазинов и обслуживает по запросу каталога каждого
+(/t/<магазин>/api/products), после чего сообщает RSS. Telegram не нужен.
+Сравнивается прирост RSS на каждый следующий магазин с RSS отдельного процесса
+на один магазин (так магазины размещались раньше).
+Запуск: python benchmarks/bench_tenants.py [максимум_магазинов] [товаров_в_магазине]
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _asgi import asgi_request  # noqa: E402
+from bench_admission import rss_mb  # noqa: E402
+
+
+def write_tenants(tmp_dir: str, shops: int) -> str:
+    config = {
+        f"shop{i}": {
+            "bot_token": f"{100000 + i}:BENCHMARK-TOKEN-NOT-VALID",
+            "orders_chat": f"@bench_shop{i}",
+            "db_path": os.path.join(tmp_dir, f"shop{i}.sqlite3"),
+            "backup_dir": os.path.join(tmp_dir, "backups", f"shop{i}"),
+        }
+        for i in range(shops)
+    }
+    path = os.path.join(tmp_dir, f"tenants_{shops}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    return path
+
+
+async def child(products_per_shop: int):
+    """Процесс с магазинами из TENANTS_FILE: инициализация, по запросу на магазин, отчёт RSS"""
+    import bot
+    from tenants import current_shop
+
+    for shop in bot.shops:
+        token = current_shop.set(shop)
+        try:
+            await bot.init_db()
+            with sqlite3.connect(shop.db_path) as conn:
+                if conn.execute("SELECT COUNT(*) FROM products").fetchone()[0] == 0:
+                    conn.executemany(
+                        "INSERT INTO products(name, price, specs) VALUES(?, ?, ?)",
+                        [(f"{shop.slug} Nokian Hakkapeliitta {i} 205/55 R16", 5000 + i, '["Зима"]')
+                         for i in range(products_per_shop)],
+                    )
+            # Повторный init_db разберёт характеристики товаров и построит индекс поиска
+            await bot.init_db()
+            shop.initialized = True
+        finally:
+            current_shop.reset(token)
+
+    for shop in bot.shops:
+        status, body = await asgi_request(bot.app, "GET", f"/t/{shop.slug}/api/products")
+        assert status == 200 and body, (shop.slug, status, body)
+        assert body[0]["name"].startswith(shop.slug), "ответ из чужого магазина"
+    print(json.dumps({"shops": len(bot.shops), "rss_mb": rss_mb()}))
+    for shop in bot.shops:
+        await shop.storage.close()
+    await bot.telegram_session.close()
+
+
+def measure(tmp_dir: str, shops: int, products_per_shop: int) -> float:
+    env = dict(
+        os.environ,
+        TENANTS_FILE=write_tenants(tmp_dir, shops),
+        DB_PATH=os.path.join(tmp_dir, "unused.sqlite3"),
+        BOT_TOKEN="123456:BENCHMARK-TOKEN-NOT-VALID",
+        MAINTENANCE_ENABLED="false",
+    )
+    result = subprocess.run([sys.executable, __file__, "--child", str(products_per_shop)],
+                            cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])["rss_mb"]
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    max_shops = int(args[0]) if args else 20
+    products_per_shop = int(args[1]) if len(args) > 1 else 500
+    tmp_dir = tempfile.mkdtemp(prefix="bench_tenants_")
+
+    counts = sorted({1, 2, 5, max_shops})
+    rss = {n: measure(tmp_dir, n, products_per_shop) for n in counts}
+    single = rss[1]
+    print(f"Товаров в магазине: {products_per_shop}")
+    for n in counts:
+        per_shop = (rss[n] - single) / (n - 1) if n > 1 else None
+        extra = f", +{per_shop:.1f} МБ на каждый следующий" if per_shop is not None else ""
+        print(f"  {n:3} магазин(ов) в одном процессе: RSS {rss[n]:7.1f} МБ{extra}")
+    per_shop = (rss[max_shops] - single) / (max_shops - 1) if max_shops > 1 else 0
+    print(f"  отдельный процесс на магазин:      {single:.1f} МБ на магазин, "
+          f"{max_shops} магазинов — {single * max_shops:.1f} МБ")
+    if per_shop:
+        print(f"Магазин в общем процессе дешевле отдельного процесса в {single / per_shop:.1f} раза")
+
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        asyncio.run(child(int(sys.argv[-1])))
+    else:
+        main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк хранилища фото по содержимому (upload_store.py).
+
+1) Загрузка: uploads фото, из которых доля duplicates — повторы уже загруженных
+   (менеджер загружает одно и то же фото к разным товарам, повторяет /add). Сравнивается
+   место на диске и время с прежней схемой (каждая загрузка — новый uuid-файл,
+   каждое фото уменьшается заново).
+2) Сборка мусора: files файлов в раскладке ab/cd/, половина без ссылок из товаров —
+   время отчёта (dry-run) и удаления.
+Запуск: python benchmarks/bench_uploads.py [загрузок] [доля_повторов] [файлов_для_gc]
+"""
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from images import resize_image_to_optimal  # noqa: E402
+from upload_store import UploadStore, collect_garbage  # noqa: E402
+
+
+def make_photos(count: int):
+    """Разные JPEG 1600x1200 (как фото с телефона после пересылки в Telegram)"""
+    from PIL import Image
+    photos = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        Image.new("RGB", (1600, 1200), (i * 37 % 256, i * 91 % 256, i * 13 % 256)).save(buffer, "JPEG", quality=90)
+        photos.append(buffer.getvalue())
+    return photos
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+
+def upload_legacy(root: str, uploads):
+    os.makedirs(root, exist_ok=True)
+    for data in uploads:
+        path = os.path.join(root, f"{uuid.uuid4()}.jpg")
+        with open(path, "wb") as f:
+            f.write(data)
+        resize_image_to_optimal(path)
+
+
+def upload_store(root: str, uploads) -> UploadStore:
+    store = UploadStore(root)
+    for data in uploads:
+        temp = store.temp_path(".jpg")
+        with open(temp, "wb") as f:
+            f.write(data)
+        store.put(temp, ".jpg", resize_image_to_optimal)
+    return store
+
+
+def bench_gc(tmp_dir: str, files: int):
+    store = UploadStore(os.path.join(tmp_dir, "gc"))
+    referenced = []
+    for i in range(files):
+        name = f"{uuid.uuid4().hex}{uuid.uuid4().hex}"
+        path = os.path.join(store.root, name[:2], name[2:4], name + ".jpg")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"\xff" * 1024)
+        old = time.time() - 7 * 24 * 3600
+        os.utime(path, (old, old))
+        if i % 2 == 0:
+            referenced.append(f"/api/uploads/{name[:2]}/{name[2:4]}/{name}.jpg")
+
+    started = time.perf_counter()
+    report = collect_garbage(store, referenced, dry_run=True)
+    dry_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    collect_garbage(store, referenced, dry_run=False)
+    sweep_ms = (time.perf_counter() - started) * 1000
+    left = sum(1 for _ in store.iter_files())
+    assert left == len(referenced), (left, len(referenced))
+    print(f"Сборка мусора, {files} файлов: отчёт {dry_ms:.0f} мс (без ссылок {report['orphans']}), "
+          f"удаление {sweep_ms:.0f} мс, осталось {left}")
+
+
+def main():
+    uploads_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    duplicates = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    gc_files = int(sys.argv[3]) if len(sys.argv) > 3 else 20000
+    unique = max(1, int(uploads_count * (1 - duplicates)))
+    photos = make_photos(unique)
+    rnd = random.Random(1)
+    uploads = photos + [rnd.choice(photos) for _ in range(uploads_count - unique)]
+    rnd.shuffle(uploads)
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_uploads_")
+    try:
+        started = time.perf_counter()
+        upload_legacy(os.path.join(tmp_dir, "legacy"), uploads)
+        legacy_s = time.perf_counter() - started
+        started = time.perf_counter()
+        store = upload_store(os.path.join(tmp_dir, "store"), uploads)
+        store_s = time.perf_counter() - started
+
+        legacy_size = dir_size(os.path.join(tmp_dir, "legacy"))
+        store_size = dir_size(store.root)
+        print(f"Загрузок: {uploads_count}, повторов: {uploads_count - unique} ({duplicates:.0%})")
+        print(f"  uuid-имена:        {legacy_size / 1024 / 1024:6.2f} МБ, {len(uploads)} файлов, {legacy_s:.2f} с")
+        print(f"  по содержимому:    {store_size / 1024 / 1024:6.2f} МБ, {store.stats['stored']} файлов, "
+              f"{store_s:.2f} с (повторов не уменьшалось: {store.stats['deduplicated']})")
+        bench_gc(tmp_dir, gc_files)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк записи заказов при 100 одновременных клиентах:
+- прежняя схема: у каждой записи своё соединение и свой COMMIT;
+- DatabaseWriter (db_writer.py): один писатель, групповой коммит.
+Дополнительно замеряется POST /api/order целиком (через ASGI-приложение bot.py,
+уведомление в Telegram подменено заглушкой).
+Запуск: python benchmarks/bench_writes.py [клиентов] [заказов_на_клиента]
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from _asgi import asgi_post  # noqa: E402
+from bench_stock import order_payload  # noqa: E402
+from db_writer import DatabaseWriter  # noqa: E402
+
+PAYLOAD = json.dumps(order_payload([(1, 4)], 1), ensure_ascii=False)
+
+
+def create_schema(db_path: str):
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+        CREATE TABLE orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            payload TEXT NOT NULL,
+            payment_method TEXT DEFAULT 'cash',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+
+async def legacy_insert(db_path: str, user_id: int):
+    """Как create_order до очереди записи: соединение и COMMIT на каждый заказ"""
+    async with aiosqlite.connect(db_path) as db:
+        await db.execute("INSERT INTO orders(user_id, payload, payment_method) VALUES(?,?,?)",
+                         (user_id, PAYLOAD, "cash"))
+        await db.commit()
+
+
+async def run_clients(clients: int, per_client: int, insert):
+    errors = []
+
+    async def client(n):
+        for _ in range(per_client):
+            try:
+                await insert(n)
+            except Exception as e:
+                errors.append(e)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return time.perf_counter() - start, errors
+
+
+def report(title: str, total: int, elapsed: float, errors: list, extra: str = ""):
+    locked = sum("locked" in str(e) for e in errors)
+    print(f"{title:<24} {total / elapsed:8.0f} заказов/с   ошибок: {len(errors)} "
+          f"(database is locked: {locked}){extra}")
+
+
+async def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    per_client = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    total = clients * per_client
+    workdir = tempfile.mkdtemp()
+    print(f"{clients} клиентов × {per_client} заказов = {total}")
+
+    # 1. Прежняя схема
+    legacy_db = os.path.join(workdir, "legacy.sqlite3")
+    create_schema(legacy_db)
+    elapsed, errors = await run_clients(clients, per_client, lambda n: legacy_insert(legacy_db, n))
+    report("соединение + COMMIT", total, elapsed, errors)
+
+    # 2. Групповой коммит
+    writer_db = os.path.join(workdir, "writer.sqlite3")
+    create_schema(writer_db)
+    writer = DatabaseWriter(writer_db)
+
+    async def writer_insert(n):
+        async def op(db):
+            cur = await db.execute("INSERT INTO orders(user_id, payload, payment_method) VALUES(?,?,?)",
+                                   (n, PAYLOAD, "cash"))
+            return cur.lastrowid
+        return await writer.submit(op)
+
+    elapsed, errors = await run_clients(clients, per_client, writer_insert)
+    stats = writer.report()
+    await writer.stop()
+    stored = sqlite3.connect(writer_db).execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    assert stored == total - len(errors), "число записанных заказов не совпадает с ответами"
+    report("групповой коммит", total, elapsed, errors,
+           f"   транзакций: {stats['batches']}, в среднем {stats['avg_batch']} заказов в пачке")
+
+    # 3. Эндпоинт целиком
+    os.environ["DB_PATH"] = os.path.join(workdir, "api.sqlite3")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Все запросы идут от одного клиента — лимиты admission.py здесь не замеряются
+    os.environ.setdefault("ADMISSION_ENABLED", "false")
+    import bot
+
+    async def no_notification(*args, **kwargs):
+        return None
+
+    bot.shop().bot.send_message = no_notification
+    await bot.init_db()
+    bot.shop().initialized = True
+    # create_order сверяет корзину с каталогом: заказываемый товар должен существовать
+    with sqlite3.connect(os.environ["DB_PATH"]) as conn:
+        conn.execute("INSERT INTO products(id, name, price) VALUES(1, 'Шина 1', 5000)")
+    payload = order_payload([(1, 4)], 1)
+
+    async def api_insert(n):
+        status, body = await asgi_post(bot.app, "/api/order", payload)
+        if status != 200:
+            raise RuntimeError(f"HTTP {status}: {body}")
+
+    elapsed, errors = await run_clients(clients, per_client, api_insert)
+    stats = bot.shop().storage.report()
+    await bot.shop().storage.close()
+    report("POST /api/order", total, elapsed, errors,
+           f"   транзакций: {stats['batches']}, в среднем {stats['avg_batch']} заказов в пачке")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,70 +1,97 @@
+import time
+
+# Момент старта процесса — для отчёта о времени запуска (импорт, первый запрос)
+_PROCESS_START = time.perf_counter()
+
 import os
 import json
 import asyncio
 import signal
 import sys
+from collections import Counter
+from contextlib import nullcontext
 from typing import List, Optional
 import logging
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
-import aiosqlite
-from aiogram import Bot, Dispatcher, F
+from aiogram import Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramNetworkError, TelegramServerError
 from aiogram.filters import Command, StateFilter
 from aiogram.filters.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from fastapi import FastAPI, Request, UploadFile, File, Form
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile
+from aiogram.types import InlineQuery, InlineQueryResultArticle, InlineQueryResultCachedPhoto, InputTextMessageContent
+from fastapi import FastAPI, Request, UploadFile, File, Form, Depends, Header, HTTPException, Query
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request as StarletteRequest
+from starlette.datastructures import Headers, MutableHeaders
 from starlette.responses import Response
-from pydantic import BaseModel
-import uvicorn
+from pydantic import BaseModel, Field
+import base64
+import hmac
 import shutil
-import uuid
-from PIL import Image
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import tempfile
+from html import escape as html_escape
+from log_setup import setup_logging, sampled, trace_id_var, new_trace_id
+from tire_specs import ATTR_FIELDS, parse_tire_attrs, format_facet_value
+from profiling import SamplingProfiler, LoopLagMonitor, HeapSnapshots
+from maintenance import ARCHIVE_DB_PATH
+from orders_export import (EXPORT_CHUNK, FORMATS as ORDER_EXPORT_FORMATS, ExportPeriodError, iter_export_text,
+                           parse_period)
+from storage import DATABASE_URL, IntegrityError
+from admission import (TELEGRAM_BREAKER_COOLDOWN, AdmissionController, AdmissionMiddleware, CircuitBreaker,
+                       TelegramGuard)
+from idempotency import IDEMPOTENCY_TTL_HOURS, valid_key as valid_idempotency_key
+from catalog_io import (CatalogFormatError, CatalogReader, IMPORT_CHUNK, MAX_REPORTED_ERRORS,
+                        format_export_rows, iter_error_lines)
+from telegram_auth import InitDataError
+from broadcast import cancel_keyboard, format_progress, summary_lines
+from update_log import open_recorder
+from upload_store import UploadStore, collect_garbage, format_gc_report
+from tenants import TENANTS_FILE, Shop, ShopUpdateMiddleware, TenantMiddleware, current_shop, load_shops
+
+# Настройка логирования: запись через очередь и фоновый поток, JSON-вывод (LOG_FORMAT=text — текстовый)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Оптимальный размер изображений товаров (по длинной стороне)
-IMAGE_MAX_SIZE = 800
-IMAGE_JPEG_QUALITY = 85
+# Максимальная длина подписи к фото в Telegram
+PHOTO_CAPTION_LIMIT = 1024
 
 
 def resize_image_to_optimal(file_path: str) -> None:
     """Уменьшает изображение до оптимального размера для карточки товара."""
+    # Pillow нужен только при загрузке фото — не тянем его при старте
+    from images import resize_image_to_optimal as resize_image
     try:
-        with Image.open(file_path) as img:
-            img.load()
-            w, h = img.size
-            if w <= IMAGE_MAX_SIZE and h <= IMAGE_MAX_SIZE:
-                return
-            if w > h:
-                new_w = IMAGE_MAX_SIZE
-                new_h = int(h * IMAGE_MAX_SIZE / w)
-            else:
-                new_h = IMAGE_MAX_SIZE
-                new_w = int(w * IMAGE_MAX_SIZE / h)
-            resized = img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-            ext = os.path.splitext(file_path)[1].lower()
-            if ext in (".jpg", ".jpeg"):
-                if resized.mode != "RGB":
-                    resized = resized.convert("RGB")
-                resized.save(file_path, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
-            elif ext == ".png":
-                resized.save(file_path, "PNG", optimize=True)
-            else:
-                if resized.mode != "RGB":
-                    resized = resized.convert("RGB")
-                resized.save(file_path, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+        resize_image(file_path)
     except Exception as e:
-        logger.warning(f"Не удалось изменить размер изображения {file_path}: {e}")
+        logger.warning("Не удалось изменить размер изображения %s: %s", file_path, e)
+
+
+# Фоновые задачи (скачивание фото и т.п.): держим ссылки, чтобы их не собрал GC
+_background_tasks = set()
+# Скачивания фото из Telegram, которые ещё идут: имя файла в uploads/ -> задача
+_pending_downloads = {}
+# Фото мастера /add, которые скачиваются в хранилище: admin_id -> (file_unique_id, задача)
+_wizard_photos = {}
+
+# Фото товаров: имя файла — SHA-256 содержимого, одинаковые фото хранятся один раз (upload_store.py)
+upload_store = UploadStore()
+
+
+def spawn_background(coro) -> asyncio.Task:
+    """Запускает корутину в фоне, не теряя ссылку на задачу"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+
+def _background_task_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Ошибка в фоновой задаче: %s", task.exception(), exc_info=task.exception())
 
 
 # --- КОНФИГУРАЦИЯ ---
@@ -87,30 +114,91 @@ SHOP_PHONES = {
 SHOP_HOURS = "Работаем без выходных с 09:00 до 21:00"
 SHOP_DELIVERY = "Отправка транспортной компанией"
 
-# Создаем бота глобально, чтобы к нему был доступ из API
-bot = Bot(BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+# Токен для административных HTTP-эндпоинтов (заголовок X-Admin-Token).
+# Если не задан, административные эндпоинты API отключены
+ADMIN_API_TOKEN = os.environ.get("ADMIN_API_TOKEN", "")
+
+# Одна HTTP-сессия Bot API (пул соединений) на ботов всех магазинов.
+# Таймаут и размыкатель цепи на все вызовы Bot API: медленный Telegram не копит ожидающие запросы
+telegram_session = AiohttpSession()
+telegram_breaker = CircuitBreaker()
+telegram_guard = TelegramGuard(telegram_breaker)
+telegram_session.middleware(telegram_guard)
+
+# Магазины процесса: из TENANTS_FILE или один магазин с настройками выше.
+# У каждого свои бот, БД, кэши каталога, админы и рассылки (см. tenants.py)
+shops = load_shops(TENANTS_FILE, {
+    "bot_token": BOT_TOKEN,
+    "orders_chat": ORDERS_CHAT,
+    "db_path": DB_PATH,
+    "archive_db_path": ARCHIVE_DB_PATH,
+    "database_url": DATABASE_URL,
+    "webapp_url": WEBAPP_URL,
+    "address": SHOP_ADDRESS,
+    "phone": SHOP_PHONE,
+    "phones": SHOP_PHONES,
+    "hours": SHOP_HOURS,
+    "delivery": SHOP_DELIVERY,
+}, session=telegram_session)
+
+
+def shop_webhook_url(s: Shop) -> str:
+    """Адрес webhook бота магазина на публичном адресе процесса"""
+    return f"{WEBAPP_URL}{s.webhook_path}"
+
+
+def shop() -> Shop:
+    """Магазин текущего HTTP-запроса или обновления Telegram (вне их — первый магазин)"""
+    return current_shop.get() or shops.default
+
+
+fsm_storage = MemoryStorage()
+dp = Dispatcher(storage=fsm_storage)
+# Магазин обновления — по боту, который его получил
+dp.update.outer_middleware(ShopUpdateMiddleware(shops))
+# Журнал обновлений для replay_updates.py (UPDATE_LOG_PATH; по умолчанию выключен)
+update_recorder = open_recorder()
 app = FastAPI(title="KolesaUfa API")
 
-# Флаг для ленивой инициализации БД
-_db_initialized = False
+# Отчёт о запуске: время импорта модулей и время до первого обслуженного запроса (секунды)
+STARTUP_REPORT = {"import_s": None, "first_request_s": None}
+# Устанавливается, когда API начал принимать соединения
+api_started = asyncio.Event()
+
 
+# Middleware приложения — «чистые» ASGI, а не BaseHTTPMiddleware: тот пропускает каждый
+# кусок тела ответа через отдельный поток задач, что на ленте событий (SSE) с сотнями
+# подписчиков умножает стоимость доставки события в разы
 
 # --- MIDDLEWARE для туннелей и WebApp ---
-class WebAppMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: StarletteRequest, call_next):
-        response = await call_next(request)
-        # Разрешаем встраивание в iframe (для Telegram WebApp)
-        response.headers["X-Frame-Options"] = "ALLOWALL"
-        response.headers["Content-Security-Policy"] = "frame-ancestors *"
-        # Заголовки для различных туннелей (ngrok, cloudflare и т.д.)
-        response.headers["ngrok-skip-browser-warning"] = "true"
-        return response
+class WebAppMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                # Разрешаем встраивание в iframe (для Telegram WebApp)
+                headers["X-Frame-Options"] = "ALLOWALL"
+                headers["Content-Security-Policy"] = "frame-ancestors *"
+                # Заголовки для различных туннелей (ngrok, cloudflare и т.д.)
+                headers["ngrok-skip-browser-warning"] = "true"
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
 
 
 app.add_middleware(WebAppMiddleware)
 
+# --- Лимиты частоты и одновременных запросов (внутри TelegramAuthMiddleware: нужен пользователь) ---
+admission = AdmissionController()
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 # --- CORS ---
 app.add_middleware(
     CORSMiddleware,
@@ -123,20 +211,120 @@ app.add_middleware(
 
 
 # --- MIDDLEWARE для инициализации БД ---
-@app.middleware("http")
-async def init_db_middleware(request: Request, call_next):
-    """Ленивая инициализация БД при первом запросе"""
-    global _db_initialized
-    if not _db_initialized:
+class InitDbMiddleware:
+    """Ленивая инициализация БД магазина при первом запросе"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        current = shop()
+        if not current.initialized:
+            try:
+                await init_db()
+                current.initialized = True
+            except Exception as e:
+                logger.error("Ошибка инициализации БД: %s", e)
+        if STARTUP_REPORT["first_request_s"] is not None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_first(message):
+            if message["type"] == "http.response.start" and STARTUP_REPORT["first_request_s"] is None:
+                STARTUP_REPORT["first_request_s"] = round(time.perf_counter() - _PROCESS_START, 3)
+                logger.info(
+                    "⏱️ Первый запрос обслужен через %.3f с после старта (импорт модулей: %.3f с)",
+                    STARTUP_REPORT['first_request_s'], STARTUP_REPORT['import_s']
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_first)
+
+
+app.add_middleware(InitDbMiddleware)
+
+
+# --- MIDDLEWARE для проверки пользователя Telegram WebApp ---
+class TelegramAuthMiddleware:
+    """Проверяет initData из заголовка X-Telegram-Init-Data и кладёт пользователя
+    в request.state.tg_user. Запрос не отклоняется: это решают зависимости эндпоинтов."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        state = scope.setdefault("state", {})
+        state["tg_user"] = None
+        state["tg_auth_error"] = None
+        init_data = Headers(scope=scope).get("x-telegram-init-data")
+        if init_data:
+            try:
+                state["tg_user"] = shop().webapp_auth.validate(init_data)
+            except InitDataError as e:
+                state["tg_auth_error"] = str(e)
+                logger.debug("initData отклонена: %s", e)
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(TelegramAuthMiddleware)
+
+
+# --- MIDDLEWARE для сквозного trace_id ---
+class TraceIdMiddleware:
+    """Назначает запросу trace_id (или берёт X-Request-ID клиента) для всех записей лога"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace_id = Headers(scope=scope).get("x-request-id") or new_trace_id()
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Request-ID"] = trace_id
+            await send(message)
+
+        token = trace_id_var.set(trace_id)
         try:
-            await init_db()
-            _db_initialized = True
-        except Exception as e:
-            logger.error(f"Ошибка инициализации БД: {e}")
-    return await call_next(request)
+            await self.app(scope, receive, send_with_trace_id)
+        finally:
+            trace_id_var.reset(token)
+
+
+app.add_middleware(TraceIdMiddleware)
+
+
+# --- Магазин запроса (/t/<магазин>/..., /api/webhook/<магазин>); добавлен последним — внешний ---
+app.add_middleware(TenantMiddleware, registry=shops)
 
 
-ADMIN_IDS = set()
+# Администраторы, счётчики фасетов, карта остатков и индекс inline-поиска (@bot 205/55 R16)
+# держатся в памяти у каждого магазина (Shop в tenants.py) и обновляются после коммита записи
+INLINE_PAGE_SIZE = 20
+# Сколько секунд Telegram может кэшировать ответ на одинаковый inline-запрос
+INLINE_CACHE_TIME = 60
+
+
+# Диагностика: CPU-профайлер, монитор задержек event loop, снимки кучи
+profiler = SamplingProfiler()
+loop_lag_monitor = LoopLagMonitor(
+    threshold=float(os.environ.get("LOOP_LAG_THRESHOLD_MS", "200")) / 1000
+)
+heap_snapshots = HeapSnapshots()
+
+# Хранилище товаров, остатков, заказов и админов (SQLite или PostgreSQL), планировщик
+# обслуживания БД, ключи идемпотентности заказов и рассылки — у каждого магазина свои:
+# shop().storage, shop().maintenance, shop().order_keys, shop().broadcasts.
+# Обработчики работают с хранилищем только через его репозитории; записи — storage.write(op)
 
 
 # --- FSM STATES ---
@@ -150,11 +338,26 @@ class AddProduct(StatesGroup):
 
 
 # --- MODEL (Схема данных заказа) ---
+# Позиций в корзине не больше
+MAX_CART_ITEMS = 100
+
+
 class OrderItem(BaseModel):
     id: int
     name: str
     price: int
-    qty: int
+    qty: int = Field(ge=1)
+
+
+class CartItem(BaseModel):
+    id: int
+    qty: int = Field(ge=1)
+    price: Optional[int] = None  # цена, которую видел покупатель: если изменилась — попадёт в price_changed
+
+
+class CartQuoteRequest(BaseModel):
+    items: List[CartItem] = Field(min_length=1, max_length=MAX_CART_ITEMS)
+    branch_id: Optional[int] = None
 
 
 class OrderRequest(BaseModel):
@@ -162,87 +365,392 @@ class OrderRequest(BaseModel):
     username: Optional[str] = None
     full_name: Optional[str] = None
     phone: Optional[str] = None  # для обратной связи, если нет telegram username
-    items: List[OrderItem]
+    items: List[OrderItem] = Field(min_length=1, max_length=MAX_CART_ITEMS)
     total: int
     comment: Optional[str] = ""
     payment_method: Optional[str] = "cash"  # cash, sbp, qr
     delivery_type: Optional[str] = "pickup"  # delivery — доставка по городу, pickup — самовывоз
+    branch_id: Optional[int] = None  # филиал, со склада которого списываются товары
 
 
 # --- DATABASE ---
+async def _read(method, *args):
+    """Один запрос репозитория на отдельном соединении для чтения"""
+    async with shop().storage.read() as db:
+        return await method(db, *args)
+
+
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            price INTEGER NOT NULL,
-            image TEXT DEFAULT '🛞',
-            description TEXT DEFAULT '',
-            specs TEXT DEFAULT '[]',
-            active INTEGER DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            payload TEXT NOT NULL,
-            payment_method TEXT DEFAULT 'cash',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS admins (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        await db.commit()
+    storage = shop().storage
+    await storage.init_schema()
+    # Очередь рассылок всегда в файле SQLite
+    await shop().broadcasts.init_schema()
 
-        # Добавляем колонку payment_method, если её нет (для существующих БД)
-        try:
-            cur = await db.execute("PRAGMA table_info(orders)")
-            columns = await cur.fetchall()
-            column_names = [col[1] for col in columns]
-            if 'payment_method' not in column_names:
-                await db.execute("ALTER TABLE orders ADD COLUMN payment_method TEXT DEFAULT 'cash'")
-                await db.commit()
-        except Exception as e:
-            logger.warning(f"Ошибка при миграции БД (возможно, колонка уже существует): {e}")
+    # Разбираем характеристики товаров, добавленных до появления product_attrs
+    async def backfill_attrs(db):
+        missing = await storage.products.without_attrs(db)
+        await storage.products.save_attrs(
+            db, {row["id"]: _attrs_row(row["name"], row["specs"], row["active"]) for row in missing})
+        return len(missing)
+
+    backfilled = await storage.write(backfill_attrs)
+    if backfilled:
+        logger.info("Разобраны характеристики для %s товаров", backfilled)
+
+    async with storage.read() as db:
+        await load_facet_counts(db)
+        await rebuild_search_index(db)
+        await load_stock(db)
 
-        # Загружаем админов из БД в память
-        await load_admins_from_db()
+    # Загружаем админов из БД в память
+    await load_admins_from_db()
 
 
 async def load_admins_from_db():
     """Загружает список админов из базы данных"""
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            cur = await db.execute("SELECT user_id FROM admins")
-            rows = await cur.fetchall()
-            ADMIN_IDS.clear()
-            for row in rows:
-                ADMIN_IDS.add(row[0])
-            logger.info(f"Загружено {len(ADMIN_IDS)} администраторов из БД")
+        admin_ids = await _read(shop().storage.admins.ids)
+        shop().admin_ids.clear()
+        shop().admin_ids.update(admin_ids)
+        logger.info("Загружено %s администраторов из БД", len(admin_ids))
     except Exception as e:
-        logger.error(f"Ошибка загрузки админов из БД: {e}")
+        logger.error("Ошибка загрузки админов из БД: %s", e)
+
+
+def _attrs_row(name: str, specs_json: str, active) -> tuple:
+    """Значения колонок product_attrs (без product_id) для товара"""
+    attrs = parse_tire_attrs(name, json.loads(specs_json or "[]"))
+    return tuple(attrs[field] for field in ATTR_FIELDS) + (1 if active else 0,)
+
+
+def apply_facet_delta(old, new):
+    """Обновляет счётчики фасетов: вычитает старые атрибуты товара и добавляет новые"""
+    current = shop()
+    for attrs, sign in ((old, -1), (new, 1)):
+        # Последний элемент — флаг active; неактивные товары в фасетах не учитываются
+        if attrs is None or not attrs[-1]:
+            continue
+        for field, value in zip(ATTR_FIELDS, attrs):
+            if value is None:
+                continue
+            counter = current.facet_counts[field]
+            counter[value] += sign
+            if counter[value] <= 0:
+                del counter[value]
+    current.facets_response = None
+
+
+async def load_facet_counts(db):
+    """Полностью пересчитывает счётчики фасетов по таблице product_attrs"""
+    current = shop()
+    for counter in current.facet_counts.values():
+        counter.clear()
+    for row in await shop().storage.products.active_attrs(db):
+        for field, value in zip(ATTR_FIELDS, row):
+            if value is not None:
+                current.facet_counts[field][value] += 1
+    current.facets_response = None
+
+
+async def load_stock(db):
+    """Полностью загружает карту остатков из таблицы stock"""
+    current = shop()
+    current.stock.clear()
+    for product_id, branch_id, qty in await shop().storage.stock.all(db):
+        current.stock.setdefault(product_id, {})[branch_id] = qty
+    current.stock_version += 1
+
+
+def apply_stock_changes(changes):
+    """Обновляет карту остатков после коммита: changes — [(product_id, branch_id, qty), ...]"""
+    current = shop()
+    for product_id, branch_id, qty in changes:
+        current.stock.setdefault(product_id, {})[branch_id] = qty
+    if changes:
+        current.stock_version += 1
+
+
+class OutOfStock(Exception):
+    """Остатков в филиале не хватает; shortages — [{id, requested, available}, ...]"""
+
+    def __init__(self, shortages: list):
+        super().__init__(f"Недостаточно товара: {shortages}")
+        self.shortages = shortages
+
+
+async def reserve_stock(db, items, branch_id: Optional[int]):
+    """Списывает остатки под заказ внутри уже открытой транзакции.
+
+    Для каждого товара — один UPDATE ... WHERE qty >= ?: проверка и списание атомарны,
+    поэтому два одновременных заказа не продадут последний комплект дважды.
+    Возвращает изменения для apply_stock_changes; при нехватке бросает OutOfStock
+    (вызывающий откатывает свою транзакцию или точку сохранения).
+    """
+    storage = shop().storage
+    wanted = Counter()
+    for item in items:
+        wanted[item.id] += item.qty
+    changes, shortages = [], []
+    for product_id, qty in wanted.items():
+        left = await storage.stock.take(db, product_id, branch_id, qty)
+        if left is not None:
+            changes.append((product_id, branch_id, left))
+            continue
+        # Не списалось: либо товар не учитывается на складе, либо его не хватает
+        available, tracked = await storage.stock.availability(db, product_id, branch_id)
+        if tracked:
+            shortages.append({"id": product_id, "requested": qty, "available": available})
+    if shortages:
+        raise OutOfStock(shortages)
+    return changes
+
+
+class CartRejected(Exception):
+    """Корзину нельзя оформить: товары сняты с продажи или цены изменились; quote — актуальный расчёт"""
+
+    def __init__(self, message: str, quote: dict):
+        super().__init__(message)
+        self.quote = quote
+
+
+def price_cart(items, catalog: dict) -> dict:
+    """Расчёт корзины по ценам каталога. catalog — {product_id: товар с name и price}
+    только для активных товаров; позиции, которых в нём нет, попадают в unavailable."""
+    lines, unavailable, price_changed = [], [], []
+    total = 0
+    for item in items:
+        product = catalog.get(item.id)
+        if product is None:
+            unavailable.append({"id": item.id, "name": getattr(item, "name", None)})
+            continue
+        price = product["price"]
+        lines.append({"id": item.id, "name": product["name"], "price": price, "qty": item.qty,
+                      "sum": price * item.qty})
+        total += price * item.qty
+        if item.price is not None and item.price != price:
+            price_changed.append({"id": item.id, "name": product["name"], "old_price": item.price, "price": price})
+    return {"items": lines, "total": total, "unavailable": unavailable, "price_changed": price_changed}
+
+
+async def load_cart_catalog(db, items) -> dict:
+    """Цены и названия активных товаров корзины — одним запросом IN (...)"""
+    return await shop().storage.products.cart_catalog(db, list({item.id for item in items}))
+
+
+async def set_stock(product_id: int, branch_id: int, qty: int):
+    """Устанавливает остаток товара в филиале"""
+    storage = shop().storage
+    await storage.write(lambda db: storage.stock.set(db, product_id, branch_id, qty))
+    apply_stock_changes([(product_id, branch_id, qty)])
+
+
+def _search_doc(row) -> dict:
+    """Документ индекса поиска из строки products"""
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "price": row["price"],
+        "image": row["image"],
+        "image_file_id": row["image_file_id"],
+        "description": row["description"],
+        "specs": json.loads(row["specs"] or "[]"),
+    }
+
+
+async def rebuild_search_index(db):
+    """Полностью перестраивает индекс inline-поиска по активным товарам"""
+    rows = await shop().storage.products.active(db)
+    search_index = shop().search_index
+    search_index.clear()
+    for row in rows:
+        search_index.upsert(_search_doc(row))
+    logger.info("Индекс поиска построен: %s товаров", len(search_index))
+
+
+async def products_change(db, product_ids) -> list:
+    """Завершает операцию записи над товарами: пересчитывает product_attrs и читает
+    документы для индекса поиска — по одному запросу на пачку товаров.
+
+    Для каждого товара возвращает (product_id, (старые, новые атрибуты), документ поиска);
+    каждый элемент передаётся в apply_product_change после коммита, чтобы фасеты
+    и индекс не разошлись с БД.
+    """
+    storage = shop().storage
+    ids = list(dict.fromkeys(product_ids))
+    old_attrs = await storage.products.attrs(db, ids)
+    rows = await storage.products.get_many(db, ids)
+
+    new_attrs = {pid: _attrs_row(row["name"], row["specs"], row["active"]) for pid, row in rows.items()}
+    await storage.products.save_attrs(db, new_attrs)
+    await storage.products.delete_attrs(db, [pid for pid in ids if pid not in rows])
+
+    return [
+        (pid, (old_attrs.get(pid), new_attrs.get(pid)),
+         _search_doc(rows[pid]) if pid in rows and rows[pid]["active"] else None)
+        for pid in ids
+    ]
+
+
+async def product_change(db, product_id: int):
+    """products_change для одного товара"""
+    return (await products_change(db, [product_id]))[0]
+
+
+def apply_product_change(change, event: Optional[str] = None):
+    """Обновляет счётчики фасетов и индекс поиска (вызывать после commit).
+
+    event — действие для ленты событий администраторов (added, hidden, restored)."""
+    product_id, facet_delta, search_doc = change
+    current = shop()
+    # Скрытого товара нет в индексе: название для ленты берём из документа до удаления
+    previous = current.search_index.get(product_id)
+    apply_facet_delta(*facet_delta)
+    if search_doc is not None:
+        current.search_index.upsert(search_doc)
+    else:
+        current.search_index.remove(product_id)
+    if event is not None:
+        doc = search_doc or previous or {"id": product_id}
+        current.events.publish("product", {
+            "action": event,
+            "product": {key: doc.get(key) for key in ("id", "name", "price", "image")},
+        })
+
+
+async def _upsert_catalog_chunk(db, rows: list, columns: tuple, can_create: bool):
+    """Операция записи для пачки строк импорта: два executemany (обновление и вставка).
+
+    Возвращает (добавлено, обновлено, изменения для apply_product_change, ошибки по строкам).
+    """
+    storage = shop().storage
+    skus = list({row["sku"] for row in rows if row["sku"]})
+    ids = list({row["id"] for row in rows if row["id"] is not None})
+    by_sku = await storage.products.ids_by_sku(db, skus) if skus else {}
+    known_ids = await storage.products.existing_ids(db, ids) if ids else set()
+
+    updates, inserts, errors = [], [], []
+    for row in rows:
+        values = [row[column] for column in columns]
+        product_id = by_sku.get(row["sku"])
+        if product_id is None and row["id"] in known_ids:
+            product_id = row["id"]
+        if product_id is not None:
+            # Кэш file_id сбрасывается, только если фото в файле другое
+            image = [row["image"]] * 2 if "image" in columns else []
+            updates.append((row["sku"], *image, *values, product_id))
+        elif row["sku"] and can_create:
+            inserts.append((row["sku"], *values))
+        elif row["sku"]:
+            errors.append((row["line"], f"артикула {row['sku']} нет в каталоге, а для нового товара нужны колонки name и price"))
+        else:
+            errors.append((row["line"], f"товар id={row['id']} не найден"))
+
+    if updates:
+        await storage.products.update_many(db, columns, updates)
+    new_skus = list({values[0] for values in inserts})
+    new_ids = []
+    if inserts:
+        # Повтор нового артикула внутри файла — обновление только что добавленного товара
+        new_ids = await storage.products.upsert_by_sku(db, columns, inserts)
+
+    changed_ids = [values[-1] for values in updates] + new_ids
+    changes = await products_change(db, changed_ids) if changed_ids else []
+    return len(new_skus), len(updates), changes, errors
+
+
+async def import_catalog(binary, progress=None) -> dict:
+    """Импортирует CSV-каталог (формат — в catalog_io) из бинарного файла.
+
+    Файл читается потоково в отдельном потоке, пачками по IMPORT_CHUNK строк; каждая
+    пачка — одна операция записи. progress(report) вызывается после каждой пачки.
+    """
+    reader = await asyncio.to_thread(CatalogReader, binary)
+    report = {"rows": 0, "created": 0, "updated": 0, "errors": 0, "error_samples": [],
+              "ignored_columns": reader.ignored_columns}
+    started = time.perf_counter()
+
+    def add_errors(errors):
+        report["errors"] += len(errors)
+        room = MAX_REPORTED_ERRORS - len(report["error_samples"])
+        report["error_samples"].extend(errors[:max(room, 0)])
+
+    while True:
+        rows, errors = await asyncio.to_thread(reader.read_chunk)
+        if not rows and not errors:
+            break
+        report["rows"] += len(rows) + len(errors)
+        add_errors(errors)
+        if rows:
+            async def op(db):
+                return await _upsert_catalog_chunk(db, rows, reader.product_columns, reader.can_create)
+            try:
+                created, updated, changes, row_errors = await shop().storage.write(op)
+            except IntegrityError as e:
+                # Например, строка с id назначает артикул, который уже есть у другого товара
+                add_errors([(row["line"], f"пачка строк не записана: {e}") for row in rows])
+            else:
+                report["created"] += created
+                report["updated"] += updated
+                add_errors(row_errors)
+                for change in changes:
+                    apply_product_change(change)
+        if progress is not None:
+            await progress(report)
+
+    report["elapsed_s"] = round(time.perf_counter() - started, 2)
+    logger.info("📥 Импорт каталога: строк %s, добавлено %s, обновлено %s, ошибок %s за %s с",
+                report["rows"], report["created"], report["updated"], report["errors"], report["elapsed_s"])
+    return report
+
+
+async def iter_catalog_csv(page_size: int = IMPORT_CHUNK):
+    """CSV всего каталога постранично (keyset по id): в памяти не больше одной страницы"""
+    storage = shop().storage
+    # BOM — чтобы Excel открыл файл в UTF-8
+    yield "\ufeff" + format_export_rows((), header=True)
+    last_id = 0
+    async with storage.read() as db:
+        while True:
+            rows = await storage.products.export_page(db, last_id, page_size)
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield format_export_rows(rows)
 
 
 def is_admin(user_id: Optional[int]) -> bool:
-    result = user_id is not None and user_id in ADMIN_IDS
-    logger.debug(f"Проверка прав админа для user_id={user_id}: {result}, ADMIN_IDS={ADMIN_IDS}")
+    result = user_id is not None and user_id in shop().admin_ids
+    logger.debug("Проверка прав админа для user_id=%s: %s", user_id, result)
     return result
 
 
 # --- API ENDPOINTS ---
 
+async def require_webapp_user(request: Request) -> dict:
+    """Пользователь Telegram, подтверждённый подписью initData"""
+    user = request.state.tg_user
+    if user is None:
+        raise HTTPException(
+            status_code=401,
+            detail=request.state.tg_auth_error or "Откройте магазин через Telegram"
+        )
+    return user
+
+
+async def require_admin(request: Request, x_admin_token: Optional[str] = Header(None)):
+    """Проверка доступа к административным эндпоинтам: X-Admin-Token или initData администратора"""
+    if ADMIN_API_TOKEN and x_admin_token and hmac.compare_digest(x_admin_token, ADMIN_API_TOKEN):
+        return
+    user = request.state.tg_user
+    if user is not None and is_admin(user["id"]):
+        return
+    raise HTTPException(status_code=403, detail="Доступ только для администраторов")
+
+
 def get_webapp_url(request: Request = None) -> str:
     """Получает URL WebApp из переменной окружения или генерирует из запроса"""
-    if WEBAPP_URL:
-        return WEBAPP_URL
+    if shop().webapp_url:
+        return shop().webapp_url
     if request:
         return str(request.url).rstrip('/').replace('/index.html', '')
     return ""
@@ -253,22 +761,20 @@ async def health_check():
     """Проверка работоспособности API"""
     return {
         "status": "ok",
-        "db_path": DB_PATH,
-        "webapp_url": WEBAPP_URL
+        "shop": shop().slug,
+        "db_path": shop().db_path,
+        "webapp_url": shop().webapp_url,
+        "startup": STARTUP_REPORT
     }
 
 
 @app.get("/", response_class=HTMLResponse)
-async def root(request: Request):
+async def root():
     """Возвращает index.html для Telegram WebApp"""
     html_path = os.path.join(os.path.dirname(__file__), "index.html")
     try:
         with open(html_path, "r", encoding="utf-8") as f:
             html_content = f.read()
-            # Заменяем пустой API_URL на текущий домен
-            current_url = str(request.url).rstrip('/')
-            html_content = html_content.replace('const API_URL = window.location.origin || "";',
-                                                f'const API_URL = "{current_url}";')
             # Добавляем заголовки для WebApp
             response = HTMLResponse(content=html_content)
             response.headers["ngrok-skip-browser-warning"] = "true"
@@ -279,16 +785,12 @@ async def root(request: Request):
 
 
 @app.get("/index.html", response_class=HTMLResponse)
-async def index_html(request: Request):
+async def index_html():
     """Альтернативный путь к index.html"""
     html_path = os.path.join(os.path.dirname(__file__), "index.html")
     try:
         with open(html_path, "r", encoding="utf-8") as f:
             html_content = f.read()
-            # Заменяем пустой API_URL на текущий домен
-            current_url = str(request.url).rstrip('/').replace('/index.html', '')
-            html_content = html_content.replace('const API_URL = window.location.origin || "";',
-                                                f'const API_URL = "{current_url}";')
             # Добавляем заголовки для WebApp
             response = HTMLResponse(content=html_content)
             response.headers["ngrok-skip-browser-warning"] = "true"
@@ -298,16 +800,37 @@ async def index_html(request: Request):
         return HTMLResponse(content="<h1>WebApp not found</h1>", status_code=404)
 
 
+# Товаров на странице /api/products по умолчанию и максимум за запрос
+PRODUCTS_PAGE_SIZE = 50
+PRODUCTS_MAX_PAGE_SIZE = 200
+
+
 @app.get("/api/products")
-async def api_products(admin: bool = False):
-    """Возвращает список товаров. Если admin=True, возвращает все товары включая неактивные"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        if admin:
-            cur = await db.execute("SELECT * FROM products ORDER BY id DESC")
-        else:
-            cur = await db.execute("SELECT * FROM products WHERE active=1 ORDER BY id DESC")
-        rows = await cur.fetchall()
+async def api_products(
+        admin: bool = False,
+        width: Optional[int] = None,
+        profile: Optional[int] = None,
+        rim: Optional[float] = None,
+        season: Optional[str] = None,
+        brand: Optional[str] = None,
+        limit: int = Query(PRODUCTS_PAGE_SIZE, ge=1, le=PRODUCTS_MAX_PAGE_SIZE),
+        offset: int = Query(0, ge=0),
+):
+    """Возвращает список товаров. Если admin=True, возвращает все товары включая неактивные.
+
+    Параметры width/profile/rim/season/brand фильтруют каталог по разобранным
+    характеристикам (таблица product_attrs с составными индексами),
+    limit/offset — постраничная выдача: без limit — первые PRODUCTS_PAGE_SIZE товаров,
+    больше PRODUCTS_MAX_PAGE_SIZE за запрос не отдаётся (фильтр по бренду на большом
+    каталоге иначе возвращал бы десятки тысяч товаров).
+    """
+    filters = {
+        field: value
+        for field, value in (("width", width), ("profile", profile), ("rim", rim),
+                             ("season", season), ("brand", brand))
+        if value is not None
+    }
+    rows = await _read(shop().storage.products.list, filters, admin, limit, offset)
 
     out = []
     for r in rows:
@@ -319,48 +842,110 @@ async def api_products(admin: bool = False):
             "description": r["description"],
             "specs": json.loads(r["specs"] or "[]"),
             "active": r["active"] if admin else None,
+            "stock": shop().stock.get(r["id"]),
         })
     return out
 
 
-@app.delete("/api/products/{product_id}")
+@app.get("/api/stock")
+async def api_stock(request: Request):
+    """Карта остатков {product_id: {branch_id: qty}} из памяти; ETag — версия карты"""
+    current = shop()
+    etag = f'"stock-{current.stock_version}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse({"version": current.stock_version, "stock": current.stock}, headers={"ETag": etag})
+
+
+@app.put("/api/admin/stock/{product_id}/{branch_id}", dependencies=[Depends(require_admin)])
+async def admin_set_stock(product_id: int, branch_id: int, qty: int):
+    if qty < 0:
+        raise HTTPException(status_code=400, detail="Остаток не может быть отрицательным")
+    await set_stock(product_id, branch_id, qty)
+    return {"status": "ok", "product_id": product_id, "branch_id": branch_id, "qty": qty}
+
+
+@app.get("/api/products/facets")
+async def api_product_facets():
+    """Возвращает предрассчитанные счётчики фасетов по активным товарам"""
+    current = shop()
+    if current.facets_response is None:
+        current.facets_response = {
+            field: [
+                {"value": value, "title": format_facet_value(field, value), "count": count}
+                for value, count in sorted(counter.items())
+            ]
+            for field, counter in current.facet_counts.items()
+        }
+    return current.facets_response
+
+
+@app.delete("/api/products/{product_id}", dependencies=[Depends(require_admin)])
 async def delete_product(product_id: int):
     """Удаляет товар (помечает как неактивный)"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("UPDATE products SET active=0 WHERE id=?", (product_id,))
-        await db.commit()
+    storage = shop().storage
+    async def op(db):
+        await storage.products.set_active(db, product_id, False)
+        return await product_change(db, product_id)
+
+    apply_product_change(await storage.write(op), event="hidden")
     return {"status": "ok", "message": "Товар удален"}
 
 
-@app.post("/api/products/upload-image")
+@app.post("/api/products/upload-image", dependencies=[Depends(require_admin)])
 async def upload_image(file: UploadFile = File(...)):
-    """Загружает изображение товара и возвращает путь к нему"""
-    # Создаем папку для изображений, если её нет
-    upload_dir = os.path.join(os.path.dirname(__file__), "uploads")
-    os.makedirs(upload_dir, exist_ok=True)
-
-    # Генерируем уникальное имя файла
-    file_ext = os.path.splitext(file.filename)[1] if file.filename else ".jpg"
-    file_name = f"{uuid.uuid4()}{file_ext}"
-    file_path = os.path.join(upload_dir, file_name)
-
-    # Сохраняем файл
-    with open(file_path, "wb") as buffer:
+    """Загружает изображение товара и возвращает путь к нему. Повторная загрузка того же
+    файла возвращает уже сохранённый путь (duplicate: true) без второй копии на диске"""
+    from images import IMAGE_EXTENSIONS, ImageTooLarge, resize_image_to_optimal as resize_image
+    file_ext = os.path.splitext(file.filename or "")[1].lower()
+    if file_ext not in IMAGE_EXTENSIONS:
+        file_ext = ".jpg"
+
+    # Сохраняем во временный файл; имя в хранилище — по содержимому
+    temp_path = upload_store.temp_path(file_ext)
+    with open(temp_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
 
-    # Приводим к оптимальному размеру для карточки товара
-    resize_image_to_optimal(file_path)
+    def prepare(path):
+        # Приводим к оптимальному размеру для карточки товара; ImageTooLarge — отказ
+        try:
+            resize_image(path)
+        except ImageTooLarge:
+            raise
+        except Exception as e:
+            logger.warning("Не удалось изменить размер изображения %s: %s", path, e)
+
+    try:
+        # Хэширование и уменьшение — в потоке, не блокируя event loop
+        image_path, created = await asyncio.to_thread(upload_store.put, temp_path, file_ext, prepare)
+    except ImageTooLarge as e:
+        raise HTTPException(status_code=400, detail=f"Изображение слишком большое: {e}")
 
-    return {"status": "ok", "image_path": f"/api/uploads/{file_name}"}
+    return {"status": "ok", "image_path": image_path, "duplicate": not created}
 
 
-@app.get("/api/uploads/{filename}")
+@app.get("/api/uploads/{filename:path}")
 async def get_uploaded_image(filename: str):
-    """Возвращает загруженное изображение"""
-    upload_dir = os.path.join(os.path.dirname(__file__), "uploads")
-    file_path = os.path.join(upload_dir, filename)
+    """Возвращает загруженное изображение (ab/cd/<sha256>.jpg или старое плоское имя).
+
+    Если файла нет (фото из бота ещё скачивается или удалено сборкой мусора у скрытого
+    товара), дожидаемся скачивания или скачиваем его заново по сохранённому file_id.
+    """
+    file_path = upload_store.path_for(filename)
+    if file_path is None:
+        return JSONResponse(status_code=404, content={"error": "File not found"})
+    if not os.path.exists(file_path):
+        pending = _pending_downloads.get(filename)
+        if pending is not None:
+            await asyncio.shield(pending)
+        else:
+            file_id = await _read(shop().storage.products.file_id_for_image, f"/api/uploads/{filename}")
+            if file_id:
+                await ensure_product_photo(file_id, filename)
     if os.path.exists(file_path):
-        return FileResponse(file_path)
+        # Имя по содержимому (ab/cd/<sha256>) меняется вместе с файлом — кэшируем без срока
+        headers = {"Cache-Control": "public, max-age=31536000, immutable"} if "/" in filename else None
+        return FileResponse(file_path, headers=headers)
     else:
         return JSONResponse(status_code=404, content={"error": "File not found"})
 
@@ -369,48 +954,155 @@ async def get_uploaded_image(filename: str):
 async def get_payment_config():
     """Возвращает конфигурацию для способов оплаты"""
     return {
-        "shop_address": SHOP_ADDRESS,
-        "shop_phone": SHOP_PHONE,
-        "shop_phones": SHOP_PHONES,
-        "shop_hours": SHOP_HOURS,
-        "shop_delivery": SHOP_DELIVERY,
+        "shop_address": shop().address,
+        "shop_phone": shop().phone,
+        "shop_phones": shop().phones,
+        "shop_hours": shop().hours,
+        "shop_delivery": shop().delivery,
         "methods": {
             "cash": {"name": "Наличными", "available": True}
         }
     }
 
 
+class DuplicateOrder(Exception):
+    """Заказ с этим ключом идемпотентности уже оформлен другой транзакцией"""
+
+    def __init__(self, order_number: int):
+        super().__init__(f"Заказ уже оформлен: {order_number}")
+        self.order_number = order_number
+
+
+def _duplicate_order_response(order_number: int) -> dict:
+    """Ответ на повтор уже оформленного заказа: без записи в БД и сообщения в чат"""
+    return {"status": "ok", "message": "Заказ уже оформлен", "order_number": order_number, "duplicate": True}
+
+
 # НОВЫЙ МЕТОД: Принимает заказ напрямую через HTTP
 @app.post("/api/order")
-async def create_order(order: OrderRequest):
+async def create_order(order: OrderRequest, request: Request):
+    current = shop()
+    storage, order_keys = current.storage, current.order_keys
+    # user_id берём только из проверенной initData: присланному клиентом ID верить нельзя
+    tg_user = request.state.tg_user
+    if tg_user is not None:
+        order.user_id = tg_user["id"]
+        order.username = tg_user.get("username") or order.username
+        order.full_name = order.full_name or " ".join(
+            filter(None, (tg_user.get("first_name"), tg_user.get("last_name"))))
+    elif order.user_id is not None:
+        logger.info("Заказ без подтверждённой initData: user_id=%s от клиента не сохраняется", order.user_id)
+        order.user_id = None
     if not order.phone or not str(order.phone).strip():
         return JSONResponse(
             status_code=400,
             content={"status": "error", "message": "Укажите номер телефона для обратной связи"},
         )
-    # 1. Сохраняем в БД и получаем порядковый номер заказа
-    payload_json = order.model_dump_json()
+    # Повтор той же попытки оформления (тот же Idempotency-Key) возвращает уже созданный заказ
+    idempotency_key = request.headers.get("Idempotency-Key")
+    if idempotency_key is not None:
+        if not valid_idempotency_key(idempotency_key):
+            return JSONResponse(
+                status_code=400,
+                content={"status": "error", "message": "Некорректный Idempotency-Key"},
+            )
+        # Ключи разных покупателей не пересекаются
+        idempotency_key = f"{order.user_id or 0}:{idempotency_key}"
+        order_number = order_keys.get(idempotency_key)
+        if order_number is not None:
+            order_keys.stats["memory_hits"] += 1
+            return _duplicate_order_response(order_number)
+
+    # 1. Пересчитываем корзину по ценам из БД, резервируем остатки и сохраняем заказ —
+    # всё одной транзакцией: цены и наличие проверяются на тот же момент, что и запись
     payment_method = order.payment_method or "cash"
-    order_number = None
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "INSERT INTO orders(user_id, payload, payment_method) VALUES(?,?,?)",
-            (order.user_id, payload_json, payment_method),
-        )
-        order_number = cur.lastrowid
-        await db.commit()
+
+    async def op(db):
+        if idempotency_key is not None:
+            order_number = await storage.orders.order_for_key(db, idempotency_key, IDEMPOTENCY_TTL_HOURS)
+            if order_number is not None:
+                return order_number, None
+        quote = price_cart(order.items, await load_cart_catalog(db, order.items))
+        if quote["unavailable"]:
+            names = ", ".join(item["name"] or f"#{item['id']}" for item in quote["unavailable"])
+            raise CartRejected(f"Товары больше не продаются: {names}. Уберите их из корзины", quote)
+        if quote["price_changed"]:
+            changes = ", ".join(f"{c['name']}: {c['old_price']} → {c['price']} ₽" for c in quote["price_changed"])
+            raise CartRejected(f"Цены изменились: {changes}. Проверьте корзину", quote)
+        stock_changes = await reserve_stock(db, order.items, order.branch_id)
+        # В заказ и в чат менеджеров идут названия и суммы из каталога, а не от клиента
+        order.items = [OrderItem(id=line["id"], name=line["name"], price=line["price"], qty=line["qty"])
+                       for line in quote["items"]]
+        order.total = quote["total"]
+        order_number = await storage.orders.create(db, order.user_id, order.model_dump_json(), payment_method)
+        if idempotency_key is not None:
+            # Другой процесс мог оформить заказ с этим ключом параллельно — тогда откатываем свой
+            owner = await storage.orders.claim_key(db, idempotency_key, order_number, IDEMPOTENCY_TTL_HOURS)
+            if owner is not None:
+                raise DuplicateOrder(owner)
+        return order_number, stock_changes
+
+    async with (order_keys.lock(idempotency_key) if idempotency_key is not None else nullcontext()):
+        # Пока ждали свою очередь, запрос с тем же ключом мог оформить заказ
+        if idempotency_key is not None and (order_number := order_keys.get(idempotency_key)) is not None:
+            order_keys.stats["memory_hits"] += 1
+            return _duplicate_order_response(order_number)
+        try:
+            order_number, stock_changes = await storage.write(op)
+        except DuplicateOrder as e:
+            order_number, stock_changes = e.order_number, None
+        except CartRejected as e:
+            return JSONResponse(
+                status_code=409,
+                content={"status": "error", "message": str(e), "quote": e.quote},
+            )
+        except OutOfStock as e:
+            names = {item.id: item.name for item in order.items}
+            details = ", ".join(f"{names[s['id']]} (в наличии {s['available']} шт.)" for s in e.shortages)
+            return JSONResponse(
+                status_code=409,
+                content={
+                    "status": "error",
+                    "message": f"Недостаточно товара в выбранном филиале: {details}",
+                    "shortages": e.shortages,
+                },
+            )
+        if idempotency_key is not None:
+            order_keys.remember(idempotency_key, order_number)
+    if stock_changes is None:
+        # Ключ нашёлся в БД: заказ оформлен до перезапуска или другим процессом
+        order_keys.stats["db_hits"] += 1
+        return _duplicate_order_response(order_number)
+    apply_stock_changes(stock_changes)
+    # Лента администраторов получает заказ сразу, не дожидаясь ответа Telegram
+    current.events.publish("order", {"order": {
+        "number": order_number,
+        "total": order.total,
+        "items": [item.model_dump() for item in order.items],
+        "full_name": order.full_name,
+        "username": order.username,
+        "phone": order.phone,
+        "delivery_type": order.delivery_type or "pickup",
+        "branch_id": order.branch_id,
+        "payment_method": payment_method,
+        "comment": order.comment,
+    }})
 
     # 2. Формируем текст сообщения
     lines = [f"🧾 <b>Новый заказ №{order_number}</b>"]
-    if order.full_name:
-        user_link = f"<a href='tg://user?id={order.user_id}'>{order.full_name}</a>"
+    if order.full_name and order.user_id:
+        user_link = f"<a href='tg://user?id={order.user_id}'>{html_escape(order.full_name)}</a>"
         lines.append(f"👤 Клиент: {user_link} (ID: {order.user_id})")
+    elif order.full_name:
+        lines.append(f"👤 Клиент: {html_escape(order.full_name)}")
     if order.username:
         lines.append(f"👤 Username: @{order.username}")
     if order.phone:
         lines.append(f"📞 Телефон для связи: {order.phone}")
     # Способ получения: доставка по городу или самовывоз
     delivery_type = (order.delivery_type or "pickup").lower()
+    if order.branch_id is not None:
+        lines.append(f"🏬 Филиал: №{order.branch_id}")
     if delivery_type == "delivery":
         lines.append("🚚 Доставка: по городу")
     else:
@@ -443,13 +1135,97 @@ async def create_order(order: OrderRequest):
 
     # 3. Отправляем в чат заказов
     try:
-        await bot.send_message(ORDERS_CHAT, text, parse_mode="HTML")
+        await current.bot.send_message(current.orders_chat, text, parse_mode="HTML")
         return {"status": "ok", "message": "Заказ отправлен", "order_number": order_number}
+    except (TelegramNetworkError, TelegramServerError) as e:
+        # Telegram недоступен, но заказ уже сохранён: покупателю — успех, менеджерам — позже
+        logger.warning("Заказ %s сохранён, уведомление отложено: %s", order_number, e)
+        spawn_background(notify_orders_chat_later(order_number, text))
+        return {"status": "ok", "message": "Заказ принят", "order_number": order_number}
     except Exception as e:
-        print(f"Ошибка отправки в Telegram: {e}")
+        logger.error("Ошибка отправки заказа %s в Telegram: %s", order_number, e)
         return {"status": "error", "message": str(e)}
 
 
+ORDER_NOTIFY_ATTEMPTS = 5
+
+
+async def notify_orders_chat_later(order_number: int, text: str):
+    """Повторяет уведомление о заказе, пока Telegram не ответит (цепь снова замкнута)"""
+    current = shop()
+    for attempt in range(1, ORDER_NOTIFY_ATTEMPTS + 1):
+        # Паузы растут, чтобы отложенные уведомления не били в Telegram одной волной
+        await asyncio.sleep(TELEGRAM_BREAKER_COOLDOWN * attempt)
+        try:
+            await current.bot.send_message(current.orders_chat, text, parse_mode="HTML")
+            logger.info("📨 Отложенное уведомление о заказе %s отправлено", order_number)
+            return
+        except (TelegramNetworkError, TelegramServerError) as e:
+            logger.warning("Уведомление о заказе %s снова не отправлено: %s", order_number, e)
+    logger.error("❌ Уведомление о заказе %s не отправлено за %s попыток", order_number, ORDER_NOTIFY_ATTEMPTS)
+
+
+def _encode_orders_cursor(created_at: str, order_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{order_id}".encode()).decode().rstrip("=")
+
+
+def _decode_orders_cursor(cursor: str):
+    try:
+        created_at, order_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().rsplit("|", 1)
+        return created_at, int(order_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+
+
+@app.post("/api/cart/quote")
+async def cart_quote(cart: CartQuoteRequest):
+    """Актуальный расчёт корзины: цены и названия из каталога в памяти, без запросов к БД.
+
+    Снятые с продажи товары — в unavailable, изменившиеся цены — в price_changed
+    (если клиент прислал цены). С branch_id для учитываемых товаров добавляется available.
+    """
+    catalog = {}
+    for item in cart.items:
+        product = shop().search_index.get(item.id)
+        if product is not None:
+            catalog[item.id] = product
+    quote = price_cart(cart.items, catalog)
+    if cart.branch_id is not None:
+        for line in quote["items"]:
+            branches = shop().stock.get(line["id"])
+            if branches:
+                line["available"] = branches.get(cart.branch_id, 0)
+    return quote
+
+
+@app.get("/api/my-orders")
+async def api_my_orders(
+    user: dict = Depends(require_webapp_user),
+    limit: int = 20,
+    cursor: Optional[str] = None,
+):
+    """История заказов покупателя, новые первыми. Постранично по ключу (created_at, id):
+    следующую страницу запрашивают с cursor=next_cursor из предыдущего ответа."""
+    limit = max(1, min(limit, 50))
+    before = _decode_orders_cursor(cursor) if cursor else None
+    # Вместе с заказами, перенесёнными в архив (ORDERS_ARCHIVE_DAYS)
+    rows = await shop().storage.order_history(user["id"], limit + 1, before)
+
+    orders = []
+    for order_id, payload, payment_method, created_at in rows[:limit]:
+        data = json.loads(payload)
+        orders.append({
+            "order_number": order_id,
+            "created_at": created_at,
+            "items": data.get("items", []),
+            "total": data.get("total"),
+            "payment_method": payment_method,
+            "delivery_type": data.get("delivery_type"),
+        })
+    next_cursor = _encode_orders_cursor(rows[limit - 1][3], rows[limit - 1][0]) if len(rows) > limit else None
+    return {"orders": orders, "next_cursor": next_cursor}
+
+
 @app.post("/api/set-webhook")
 async def set_webhook(webhook_url: str = None):
     """Устанавливает webhook для Telegram бота (для Tuna)"""
@@ -457,17 +1233,17 @@ async def set_webhook(webhook_url: str = None):
         # Если URL не передан, пытаемся использовать WEBAPP_URL
         if not webhook_url:
             if WEBAPP_URL:
-                webhook_url = f"{WEBAPP_URL}/api/webhook"
+                webhook_url = shop_webhook_url(shop())
             else:
                 return {"status": "error",
                         "message": "Webhook URL не указан. Установите WEBAPP_URL или передайте webhook_url"}
 
         # Устанавливаем webhook и удаляем pending updates
-        await bot.set_webhook(webhook_url, drop_pending_updates=True)
-        logger.info(f"✅ Webhook установлен: {webhook_url}")
+        await shop().bot.set_webhook(webhook_url, drop_pending_updates=True)
+        logger.info("✅ Webhook установлен: %s", webhook_url)
         return {"status": "ok", "message": f"Webhook установлен: {webhook_url}"}
     except Exception as e:
-        logger.error(f"❌ Ошибка установки webhook: {e}")
+        logger.error("❌ Ошибка установки webhook: %s", e)
         return {"status": "error", "message": str(e)}
 
 
@@ -475,7 +1251,7 @@ async def set_webhook(webhook_url: str = None):
 async def get_webhook_info():
     """Получает информацию о текущем webhook"""
     try:
-        webhook_info = await bot.get_webhook_info()
+        webhook_info = await shop().bot.get_webhook_info()
         return {
             "status": "ok",
             "url": webhook_info.url,
@@ -486,42 +1262,203 @@ async def get_webhook_info():
         return {"status": "error", "message": str(e)}
 
 
+@app.post("/api/admin/profile/start", dependencies=[Depends(require_admin)])
+async def admin_profile_start(interval_ms: float = 5):
+    """Запускает сэмплирующий CPU-профайлер потока event loop"""
+    try:
+        profiler.start(interval=max(interval_ms, 1) / 1000)
+    except RuntimeError as e:
+        return JSONResponse(status_code=409, content={"status": "error", "message": str(e)})
+    return {"status": "ok", **profiler.status()}
+
+
+@app.post("/api/admin/profile/stop", dependencies=[Depends(require_admin)])
+async def admin_profile_stop():
+    """Останавливает профайлер и отдаёт стеки в формате collapsed (flamegraph.pl, speedscope)"""
+    try:
+        folded = profiler.stop()
+    except RuntimeError as e:
+        return JSONResponse(status_code=409, content={"status": "error", "message": str(e)})
+    file_name = f"profile-{int(time.time())}.folded"
+    return PlainTextResponse(folded, headers={"Content-Disposition": f'attachment; filename="{file_name}"'})
+
+
+@app.get("/api/admin/profile/status", dependencies=[Depends(require_admin)])
+async def admin_profile_status():
+    return profiler.status()
+
+
+@app.get("/api/admin/loop-lag", dependencies=[Depends(require_admin)])
+async def admin_loop_lag():
+    """Задержка event loop (p50/p99/max) и стеки последних медленных колбэков"""
+    return loop_lag_monitor.report()
+
+
+@app.post("/api/admin/heap-snapshot", dependencies=[Depends(require_admin)])
+async def admin_heap_snapshot(top: int = 25):
+    """Снимок кучи tracemalloc: первый вызов включает трассировку, следующие возвращают разницу"""
+    return await asyncio.to_thread(heap_snapshots.snapshot, top)
+
+
+@app.delete("/api/admin/heap-snapshot", dependencies=[Depends(require_admin)])
+async def admin_heap_snapshot_stop():
+    """Выключает tracemalloc"""
+    return heap_snapshots.stop()
+
+
+@app.get("/api/admin/maintenance", dependencies=[Depends(require_admin)])
+async def admin_maintenance_status():
+    """Статус задач обслуживания БД: время, длительность и результат последнего запуска"""
+    return shop().maintenance.report()
+
+
+@app.get("/api/admin/db-writer", dependencies=[Depends(require_admin)])
+async def admin_db_writer():
+    """Статистика записи в БД: для SQLite — групповой коммит (пачки, операции, средний
+    размер пачки), для PostgreSQL — транзакции и заполнение пула соединений"""
+    return shop().storage.report()
+
+
+@app.get("/api/admin/admission", dependencies=[Depends(require_admin)])
+async def admin_admission():
+    """Лимиты запросов: пропущено, отклонено (429/503), выполняется сейчас; состояние цепи Telegram"""
+    return {**admission.report(), "telegram": telegram_breaker.report()}
+
+
+@app.get("/api/admin/events", dependencies=[Depends(require_admin)])
+async def admin_events(request: Request, last_event_id: Optional[str] = None, backlog: int = Query(0, ge=0, le=100)):
+    """Лента событий администраторов (text/event-stream): новые заказы и изменения каталога.
+
+    Переподключение с заголовком Last-Event-ID (или ?last_event_id=) догоняет пропущенное;
+    backlog — сколько последних событий прислать новому подключению.
+    """
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    return StreamingResponse(
+        shop().events.stream(last_event_id, backlog),
+        media_type="text/event-stream",
+        # X-Accel-Buffering: прокси (nginx) не должен копить кадры
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/admin/events/stats", dependencies=[Depends(require_admin)])
+async def admin_events_stats():
+    """Лента событий: подписчики, опубликовано и доставлено, переподключения, переполнения буфера"""
+    return shop().events.report()
+
+
+@app.get("/api/admin/catalog/export", dependencies=[Depends(require_admin)])
+async def admin_catalog_export():
+    """Весь каталог в CSV (отдаётся потоком, страницами из БД)"""
+    filename = f"catalog-{time.strftime('%Y%m%d')}.csv"
+    return StreamingResponse(
+        iter_catalog_csv(),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get("/api/admin/orders/export", dependencies=[Depends(require_admin)])
+async def admin_orders_export(date_from: str, date_to: Optional[str] = None,
+                              fmt: str = Query("csv", alias="format")):
+    """Заказы за период в CSV или NDJSON, потоком (включая архив).
+
+    date_from/date_to — ГГГГ-ММ-ДД или ГГГГ-ММ, включительно; без date_to — один день или месяц.
+    """
+    if fmt not in ORDER_EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format: csv или ndjson")
+    try:
+        start, end = parse_period(date_from, date_to)
+    except ExportPeriodError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = f"orders-{date_from}" + (f"_{date_to}" if date_to else "") + f".{fmt}"
+    return StreamingResponse(
+        iter_export_text(shop().storage.iter_order_rows(start, end, EXPORT_CHUNK), fmt),
+        media_type="text/csv; charset=utf-8" if fmt == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.post("/api/admin/catalog/import", dependencies=[Depends(require_admin)])
+async def admin_catalog_import(file: UploadFile = File(...)):
+    """Импорт каталога из CSV: новые артикулы добавляются, известные — обновляются"""
+    try:
+        return await import_catalog(file.file)
+    except CatalogFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def collect_uploads_garbage(dry_run: bool = True) -> dict:
+    """Сборка мусора в uploads/: помечаются фото активных товаров и скрытых товаров без
+    file_id (их нельзя скачать заново); каталог общий у всех магазинов процесса"""
+    referenced = set()
+    for s in shops:
+        async with s.storage.read() as db:
+            for row in await s.storage.products.uploaded_images(db):
+                # Фото скрытого товара из бота восстановится по file_id, если товар вернут
+                if row["active"] or not row["image_file_id"]:
+                    referenced.add(row["image"])
+    return await asyncio.to_thread(collect_garbage, upload_store, referenced, dry_run)
+
+
+async def uploads_gc_job() -> str:
+    return format_gc_report(await collect_uploads_garbage(dry_run=False))
+
+
+# Задача обслуживания процесса, а не магазина — в планировщике первого магазина
+shops.default.maintenance.add("uploads_gc", 24 * 3600, uploads_gc_job, initial_delay=600)
+
+
+@app.post("/api/admin/uploads/gc", dependencies=[Depends(require_admin)])
+async def admin_uploads_gc(dry_run: bool = True):
+    """Сборка мусора в uploads/: по умолчанию только отчёт (dry_run), dry_run=false — удалить"""
+    report = await collect_uploads_garbage(dry_run)
+    logger.info("🧹 uploads_gc%s: %s", " (dry-run)" if dry_run else "", format_gc_report(report))
+    return {**report, "store": upload_store.report()}
+
+
+@app.post("/api/admin/maintenance/{job_name}", dependencies=[Depends(require_admin)])
+async def admin_maintenance_run(job_name: str):
+    """Запускает задачу обслуживания вне расписания"""
+    if job_name not in shop().maintenance.jobs:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Задача не найдена"})
+    return await shop().maintenance.run_job(job_name)
+
+
 @app.post("/api/webhook")
+@app.post("/api/webhook/{tenant}")
 async def webhook_handler(request: Request):
-    """Обработчик webhook от Telegram"""
+    """Обработчик webhook от Telegram. У каждого магазина свой адрес (/api/webhook/<магазин>),
+    магазин запроса выбирает TenantMiddleware"""
     try:
         # Получаем тело запроса
         body = await request.body()
-        logger.info(f"📥 Получен запрос на /api/webhook, размер: {len(body)} байт")
 
         # Парсим JSON
         try:
-            update_data = await request.json()
+            update_data = json.loads(body)
         except Exception as json_error:
             # Если не JSON, пытаемся прочитать как строку
-            logger.error(f"Ошибка парсинга JSON: {json_error}, body: {body[:500]}")
+            logger.error("Ошибка парсинга JSON: %s, body: %r", json_error, body[:500])
             return JSONResponse(
                 status_code=200,
                 content={"status": "error", "message": "Invalid JSON"}
             )
 
-        logger.info(
-            f"📨 Обновление получено: update_id={update_data.get('update_id', 'unknown')}, type={list(update_data.keys())[1] if len(update_data) > 1 else 'unknown'}")
-
         from aiogram.types import Update
         update = Update(**update_data)
 
         # Обрабатываем обновление асинхронно, чтобы быстро вернуть ответ Telegram
-        # Telegram требует ответ в течение 60 секунд
-        asyncio.create_task(dp.feed_update(bot, update))
-        logger.info(f"🔄 Обновление {update.update_id} поставлено в очередь обработки")
+        # Telegram требует ответ в течение 60 секунд. Задача наследует trace_id запроса
+        spawn_background(dp.feed_update(shop().bot, update))
+        # Сообщение пишется на каждое обновление — сэмплируем
+        logger.info("📨 Обновление %s (%s байт) поставлено в очередь обработки",
+                    update.update_id, len(body), extra=sampled())
 
         # Сразу возвращаем успешный ответ Telegram
         return JSONResponse(status_code=200, content={"status": "ok"})
     except Exception as e:
-        logger.error(f"❌ Ошибка обработки webhook: {e}", exc_info=True)
-        import traceback
-        logger.error(traceback.format_exc())
+        logger.error("❌ Ошибка обработки webhook: %s", e, exc_info=True)
         # Всегда возвращаем 200, чтобы Telegram не считал запрос неудачным
         return JSONResponse(
             status_code=200,
@@ -531,11 +1468,29 @@ async def webhook_handler(request: Request):
 
 # --- BOT HANDLERS ---
 
+@dp.update.outer_middleware()
+async def record_update_middleware(handler, event, data):
+    """Пишет обновление в журнал (webhook и polling проходят через Dispatcher одинаково)"""
+    if update_recorder is not None:
+        update_recorder.record(event.model_dump(mode="json", exclude_none=True, by_alias=True), shop().slug)
+    return await handler(event, data)
+
+
+@dp.update.outer_middleware()
+async def trace_update_middleware(handler, event, data):
+    """Проставляет trace_id для обработки обновления (webhook передаёт trace_id запроса)"""
+    token = trace_id_var.set(trace_id_var.get() or f"upd-{event.update_id}")
+    try:
+        return await handler(event, data)
+    finally:
+        trace_id_var.reset(token)
+
+
 @dp.message(Command("start"))
 async def start(message: Message):
-    logger.info(f"🎯 Получена команда /start от пользователя {message.from_user.id} (@{message.from_user.username})")
+    logger.info("🎯 Получена команда /start от пользователя %s (@%s)", message.from_user.id, message.from_user.username)
     # Получаем URL WebApp
-    webapp_url = WEBAPP_URL if WEBAPP_URL else ""  # URL от Tuna туннеля
+    webapp_url = shop().webapp_url  # URL от Tuna туннеля (у магазинов из TENANTS_FILE — с /t/<магазин>)
 
     # WebApp кнопки можно использовать только в приватных чатах
     # Проверяем тип чата (в aiogram 3.x это строка: "private", "group", "supergroup", "channel")
@@ -545,7 +1500,7 @@ async def start(message: Message):
             # Добавляем параметр версии к URL для предотвращения кэширования старого приложения
             # Это гарантирует, что всегда открывается актуальная версия
             separator = "&" if "?" in webapp_url else "?"
-            webapp_url_with_version = f"{webapp_url}{separator}v={int(__import__('time').time())}"
+            webapp_url_with_version = f"{webapp_url}{separator}v={int(time.time())}"
             kb = ReplyKeyboardMarkup(
                 keyboard=[[KeyboardButton(text="🛞 Открыть магазин", web_app=WebAppInfo(url=webapp_url_with_version))]],
                 resize_keyboard=True
@@ -575,22 +1530,18 @@ async def start(message: Message):
 @dp.message(Command("setadmin"))
 async def cmd_setadmin(message: Message):
     """Добавляет пользователя в список администраторов"""
+    storage = shop().storage
     user_id = message.from_user.id
     username = message.from_user.username or "без username"
 
     try:
         # Добавляем в память
-        ADMIN_IDS.add(user_id)
+        shop().admin_ids.add(user_id)
 
         # Сохраняем в БД
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute(
-                "INSERT OR REPLACE INTO admins (user_id, username) VALUES (?, ?)",
-                (user_id, username)
-            )
-            await db.commit()
+        await storage.write(lambda db: storage.admins.add(db, user_id, username))
 
-        logger.info(f"✅ Добавлен администратор: user_id={user_id}, username=@{username}")
+        logger.info("✅ Добавлен администратор: user_id=%s, username=@%s", user_id, username)
         await message.answer(
             f"✅ <b>Готово!</b>\n\n"
             f"Добавлен администратор:\n"
@@ -600,7 +1551,7 @@ async def cmd_setadmin(message: Message):
             parse_mode="HTML"
         )
     except Exception as e:
-        logger.error(f"Ошибка добавления админа: {e}", exc_info=True)
+        logger.error("Ошибка добавления админа: %s", e, exc_info=True)
         await message.answer(f"❌ Ошибка при добавлении администратора: {e}")
 
 
@@ -611,7 +1562,7 @@ async def cmd_webhook(message: Message):
         return await message.answer("❌ У вас нет прав администратора")
 
     try:
-        webhook_info = await bot.get_webhook_info()
+        webhook_info = await shop().bot.get_webhook_info()
         if webhook_info.url and webhook_info.url != "":
             await message.answer(
                 f"📡 <b>Webhook активен</b>\n\n"
@@ -638,7 +1589,7 @@ async def cmd_delete_webhook(message: Message):
         return await message.answer("❌ У вас нет прав администратора")
 
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
+        await shop().bot.delete_webhook(drop_pending_updates=True)
         await message.answer(
             "✅ <b>Webhook удален</b>\n\n"
             "Теперь можно использовать polling. Перезапустите приложение.",
@@ -648,12 +1599,182 @@ async def cmd_delete_webhook(message: Message):
         await message.answer(f"❌ Ошибка при удалении webhook: {e}")
 
 
+@dp.message(Command("profile"))
+async def cmd_profile(message: Message):
+    """Диагностика процесса (только для админов):
+    /profile start [интервал_мс] | stop | lag | heap | heapstop"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ У вас нет прав администратора")
+
+    parts = (message.text or "").split()
+    action = parts[1].lower() if len(parts) > 1 else ""
+
+    if action == "start":
+        interval_ms = float(parts[2]) if len(parts) > 2 and parts[2].replace(".", "", 1).isdigit() else 5
+        try:
+            profiler.start(interval=max(interval_ms, 1) / 1000)
+        except RuntimeError as e:
+            return await message.answer(f"❌ {e}")
+        await message.answer(f"🔬 Профилирование запущено (интервал {interval_ms:g} мс). Остановить: /profile stop")
+    elif action == "stop":
+        try:
+            folded = profiler.stop()
+        except RuntimeError as e:
+            return await message.answer(f"❌ {e}")
+        from aiogram.types import BufferedInputFile
+        await message.answer_document(
+            BufferedInputFile(folded.encode(), filename=f"profile-{int(time.time())}.folded"),
+            caption="🔥 Профиль в формате collapsed — откройте в speedscope.app или flamegraph.pl"
+        )
+    elif action == "lag":
+        report = loop_lag_monitor.report()
+        lag = report["lag"]
+        lines = ["⏱️ <b>Задержка event loop</b>"]
+        if lag["samples"]:
+            lines.append(f"p50: {lag['p50_ms']} мс, p99: {lag['p99_ms']} мс, max: {lag['max_ms']} мс")
+        else:
+            lines.append("Нет данных")
+        lines.append(f"Медленных колбэков (>{report['threshold_ms']:g} мс): {len(report['slow_callbacks'])}")
+        for slow in report["slow_callbacks"][-3:]:
+            last_frames = slow["stack"].strip().splitlines()[-2:]
+            lines.append(f"\n• {slow['blocked_ms']} мс\n<code>{html_escape(chr(10).join(last_frames))}</code>")
+        await message.answer("\n".join(lines), parse_mode="HTML")
+    elif action == "heap":
+        report = await asyncio.to_thread(heap_snapshots.snapshot, 10)
+        if report["status"] != "ok":
+            return await message.answer(f"🧠 {report['message']}")
+        lines = [f"🧠 <b>Куча</b>: {report['traced_kb']} КБ (пик {report['peak_kb']} КБ)", "Рост с прошлого снимка:"]
+        for stat in report["top"]:
+            lines.append(f"{stat['size_diff_kb']:+} КБ <code>{html_escape(stat['where'])}</code>")
+        await message.answer("\n".join(lines), parse_mode="HTML")
+    elif action == "heapstop":
+        heap_snapshots.stop()
+        await message.answer("🧠 tracemalloc выключен")
+    else:
+        await message.answer(
+            "🔬 <b>Диагностика</b>\n\n"
+            "/profile start [мс] — запустить CPU-профайлер\n"
+            "/profile stop — остановить и получить профиль\n"
+            "/profile lag — задержка event loop и медленные колбэки\n"
+            "/profile heap — снимок кучи (разница с прошлым)\n"
+            "/profile heapstop — выключить tracemalloc",
+            parse_mode="HTML"
+        )
+
+
+@dp.message(Command("maintenance"))
+async def cmd_maintenance(message: Message):
+    """Статус обслуживания БД или запуск задачи: /maintenance [run <задача>]"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ У вас нет прав администратора")
+
+    parts = (message.text or "").split()
+    if len(parts) >= 3 and parts[1].lower() == "run":
+        if parts[2] not in shop().maintenance.jobs:
+            return await message.answer(f"❌ Нет такой задачи. Доступны: {', '.join(shop().maintenance.jobs)}")
+        await message.answer(f"🧹 Запускаю {parts[2]}...")
+        await shop().maintenance.run_job(parts[2])
+
+    lines = ["🧹 <b>Обслуживание БД</b>\n"]
+    for name, job in shop().maintenance.report().items():
+        status = {"ok": "✅", "error": "❌"}.get(job["last_status"], "⏳")
+        details = job["last_error"] or job["last_result"] or "ещё не запускалась"
+        duration = f", {job['last_duration_ms']} мс" if job["last_duration_ms"] is not None else ""
+        lines.append(f"{status} <b>{name}</b>{duration}\n{html_escape(details)}")
+    lines.append("\nЗапуск вне расписания: /maintenance run &lt;задача&gt;")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: Message):
+    """Рассылка прошлым покупателям (только для админов):
+    /broadcast <текст> или ответом на сообщение; /broadcast status; /broadcast cancel <id>"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ У вас нет прав администратора")
+
+    parts = (message.text or "").split(maxsplit=1)
+    args = parts[1].strip() if len(parts) > 1 else ""
+    action = args.split()[0].lower() if args else ""
+
+    if action == "status" and not message.reply_to_message:
+        items = await shop().broadcasts.latest()
+        if not items:
+            return await message.answer("📣 Рассылок ещё не было")
+        return await message.answer("📣 <b>Последние рассылки</b>\n\n" + "\n".join(summary_lines(items)), parse_mode="HTML")
+
+    if action == "cancel" and not message.reply_to_message:
+        broadcast_id = args.split()[1] if len(args.split()) > 1 else ""
+        if not broadcast_id.isdigit():
+            return await message.answer("❌ Укажите номер рассылки: /broadcast cancel <id>")
+        if await shop().broadcasts.cancel(int(broadcast_id)):
+            return await message.answer(f"⛔ Рассылка #{broadcast_id} остановлена")
+        return await message.answer(f"❌ Рассылка #{broadcast_id} не найдена или уже завершена")
+
+    # Ответ на сообщение копируется как есть (с фото и форматированием), иначе — текст после команды
+    source = message.reply_to_message
+    if not source and not args:
+        return await message.answer(
+            "📣 <b>Рассылка покупателям</b>\n\n"
+            "/broadcast &lt;текст&gt; — разослать текст всем, кто оформлял заказы\n"
+            "Ответьте командой /broadcast на сообщение, чтобы разослать его копию (с фото)\n"
+            "/broadcast status — последние рассылки\n"
+            "/broadcast cancel &lt;id&gt; — остановить рассылку",
+            parse_mode="HTML"
+        )
+
+    b = await shop().broadcasts.create(
+        message.chat.id,
+        text="" if source else args,
+        source_chat_id=source.chat.id if source else None,
+        source_message_id=source.message_id if source else None,
+    )
+    if not b["total"]:
+        await shop().broadcasts.cancel(b["id"])
+        return await message.answer("📣 Некому отправлять: в заказах нет покупателей с Telegram ID")
+
+    preview = "копия сообщения, на которое вы ответили" if source else html_escape(args[:300])
+    kb = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Отправить", callback_data=f"broadcast_start_{b['id']}"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data=f"broadcast_cancel_{b['id']}"),
+    ]])
+    await message.answer(
+        f"📣 <b>Рассылка #{b['id']}</b>\n\n"
+        f"Получателей: {b['total']}\n"
+        f"Сообщение: {preview}\n\n"
+        f"Отправить?",
+        parse_mode="HTML",
+        reply_markup=kb
+    )
+
+
+@dp.callback_query(F.data.startswith("broadcast_start_"))
+async def broadcast_start(callback: CallbackQuery):
+    """Ставит рассылку в очередь; это сообщение становится статусом рассылки"""
+    if not is_admin(callback.from_user.id):
+        return await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+    broadcast_id = int(callback.data.rsplit("_", 1)[1])
+    if not await shop().broadcasts.enqueue(broadcast_id, callback.message.message_id):
+        return await callback.answer("Рассылка уже запущена или отменена", show_alert=True)
+    await callback.answer("Рассылка запущена")
+    b = await shop().broadcasts.get(broadcast_id)
+    await callback.message.edit_text(format_progress(b), parse_mode="HTML", reply_markup=cancel_keyboard(broadcast_id))
+
+
+@dp.callback_query(F.data.startswith("broadcast_cancel_"))
+async def broadcast_cancel(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        return await callback.answer("❌ У вас нет прав администратора", show_alert=True)
+    broadcast_id = int(callback.data.rsplit("_", 1)[1])
+    if not await shop().broadcasts.cancel(broadcast_id):
+        return await callback.answer("Рассылка уже завершена", show_alert=True)
+    await callback.answer("Рассылка остановлена")
+    b = await shop().broadcasts.get(broadcast_id)
+    await callback.message.edit_text(format_progress(b), parse_mode="HTML")
+
+
 async def _build_products_list_message():
     """Формирует текст и клавиатуру для списка товаров (для /products и обновления после toggle)."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT * FROM products ORDER BY id DESC LIMIT 20")
-        rows = await cur.fetchall()
+    rows = await _read(shop().storage.products.recent, 20)
 
     if not rows:
         return "📦 Товаров пока нет. Используйте /add для добавления.", None
@@ -681,22 +1802,264 @@ async def cmd_products(message: Message):
     await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
 
 
+async def send_product_card(message: Message, product) -> None:
+    """Отправляет карточку товара. Фото отправляется по закэшированному file_id;
+    локальный файл загружается в Telegram только один раз, после чего его file_id сохраняется."""
+    storage = shop().storage
+    specs = json.loads(product["specs"] or "[]")
+    # Названия и описания приходят и из CSV поставщика: «&» или «<» без экранирования —
+    # Telegram отклоняет подпись (can't parse entities)
+    head = f"🛞 <b>{html_escape(product['name'])}</b>\n💰 {product['price']} ₽\n"
+    tail = (
+        (f"🏷️ {html_escape(', '.join(specs))}\n" if specs else "")
+        + ("" if product["active"] else "\n❌ Товар скрыт из магазина")
+    )
+    # Описание укорачиваем до сборки подписи: срез готовой подписи мог бы разрезать тег или &amp;
+    room = PHOTO_CAPTION_LIMIT - len(head) - len(tail) - len("📄 \n")
+    description = (product["description"] or "")[:max(room, 0)]
+    while len(html_escape(description)) > room:
+        # Экранированный символ — до 6 знаков (&#x27;)
+        description = description[:-max(1, (len(html_escape(description)) - room) // 6)]
+    caption = (
+        head + (f"📄 {html_escape(description)}\n" if description else "") + tail
+    )[:PHOTO_CAPTION_LIMIT]
+
+    if product["image_file_id"]:
+        await message.answer_photo(product["image_file_id"], caption=caption, parse_mode="HTML")
+        return
+
+    image = product["image"] or ""
+    local_path = None
+    if image.startswith("/api/uploads/"):
+        local_path = upload_store.path_for(image)
+    if not local_path or not os.path.exists(local_path):
+        await message.answer(f"{html_escape(image or '🛞')} {caption}", parse_mode="HTML")
+        return
+
+    sent = await message.answer_photo(FSInputFile(local_path), caption=caption, parse_mode="HTML")
+    photo = sent.photo[-1]
+
+    async def op(db):
+        await storage.products.set_photo(db, product["id"], photo.file_id, photo.file_unique_id)
+        return await product_change(db, product["id"])
+
+    apply_product_change(await storage.write(op))
+
+
+@dp.message(Command("product"))
+async def cmd_product(message: Message):
+    """Показывает карточку товара по ID: /product 12"""
+    parts = (message.text or "").split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        return await message.answer("Использование: /product <ID товара>")
+
+    product = await _read(shop().storage.products.get, int(parts[1]))
+    if product is None or (not product["active"] and not is_admin(message.from_user.id)):
+        return await message.answer("❌ Товар не найден")
+    await send_product_card(message, product)
+
+
+@dp.message(Command("stock"))
+async def cmd_stock(message: Message):
+    """Остатки товара по филиалам (только для админов):
+    /stock <ID товара> — показать, /stock <ID товара> <филиал> <количество> — установить"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ У вас нет прав администратора")
+
+    parts = (message.text or "").split()
+    if len(parts) not in (2, 4) or not all(p.isdigit() for p in parts[1:]):
+        return await message.answer(
+            "Использование:\n/stock <ID товара> — остатки по филиалам\n"
+            "/stock <ID товара> <филиал> <количество> — установить остаток"
+        )
+    product_id = int(parts[1])
+    if len(parts) == 4:
+        await set_stock(product_id, int(parts[2]), int(parts[3]))
+
+    branches = shop().stock.get(product_id)
+    if not branches:
+        return await message.answer(f"📦 Товар #{product_id}: остатки не учитываются (продаётся без ограничений)")
+    lines = [f"📦 <b>Остатки товара #{product_id}</b>"]
+    for branch_id, qty in sorted(branches.items()):
+        lines.append(f"Филиал №{branch_id}: {qty} шт.")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+
+# Telegram отдаёт ботам файлы не больше 20 МБ
+CATALOG_MAX_FILE_SIZE = 20 * 1024 * 1024
+CATALOG_PROGRESS_INTERVAL = 3.0
+
+
+def _catalog_report_text(report: dict, done: bool, error: Optional[str] = None) -> str:
+    if error is not None:
+        # Записанные пачки остаются в каталоге: показываем, сколько успело импортироваться
+        title = f"❌ <b>Импорт прерван:</b> {html_escape(error)}"
+    else:
+        title = "✅ <b>Импорт каталога завершён</b>" if done else "📥 <b>Импорт каталога...</b>"
+    lines = [
+        title,
+        f"Строк{' прочитано' if error is not None else ''}: {report['rows']}",
+        f"Добавлено: {report['created']}, обновлено: {report['updated']}, ошибок: {report['errors']}",
+    ]
+    if done and report["error_samples"]:
+        lines.append("")
+        lines.extend(html_escape(line) for line in iter_error_lines(report["error_samples"], report["errors"]))
+    if done and report["ignored_columns"]:
+        lines.append(f"\nПропущены колонки: {html_escape(', '.join(report['ignored_columns']))}")
+    return "\n".join(lines)
+
+
+@dp.message(Command("import"))
+async def cmd_import(message: Message):
+    """Подсказка по импорту каталога (только для админов)"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ У вас нет прав администратора")
+    await message.answer(
+        "📥 <b>Импорт каталога</b>\n\n"
+        "Отправьте боту файл <b>.csv</b> (в Excel: «Сохранить как» → CSV).\n"
+        "Первая строка — заголовок: <code>sku;name;price;image;description;specs;active</code> "
+        "(можно по-русски: артикул, название, цена, фото, описание, характеристики, активен).\n\n"
+        "Товар с известным артикулом обновляется, с новым — добавляется. Колонки, которых нет "
+        "в файле, не меняются: файл <code>sku;price</code> обновит только цены.\n"
+        "Текущий каталог в том же формате — /export",
+        parse_mode="HTML"
+    )
+
+
+@dp.message(Command("export"))
+async def cmd_export(message: Message):
+    """Выгружает весь каталог CSV-файлом (только для админов)"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ У вас нет прав администратора")
+
+    # Пишем на диск постранично и отправляем файлом — каталог целиком в памяти не держим
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            async for chunk in iter_catalog_csv():
+                f.write(chunk)
+        await message.answer_document(FSInputFile(path, filename=f"catalog-{time.strftime('%Y%m%d')}.csv"))
+    finally:
+        os.remove(path)
+
+
+# Telegram принимает от ботов документы до 50 МБ
+ORDERS_EXPORT_MAX_FILE_SIZE = 50 * 1024 * 1024
+
+
+@dp.message(Command("orders"))
+async def cmd_orders(message: Message):
+    """Выгрузка заказов за период файлом (только для админов):
+    /orders 2026-09 — за месяц, /orders 2026-09-01 2026-09-15 — за период, в конце можно json"""
+    if not is_admin(message.from_user.id):
+        return await message.answer("❌ У вас нет прав администратора")
+
+    parts = (message.text or "").split()[1:]
+    fmt = "csv"
+    if parts and parts[-1].lower() in ("csv", "json", "ndjson"):
+        fmt = "csv" if parts.pop().lower() == "csv" else "ndjson"
+    if len(parts) not in (1, 2):
+        return await message.answer(
+            "Использование:\n/orders 2026-09 — заказы за месяц\n"
+            "/orders 2026-09-01 2026-09-15 — за период (даты включительно, UTC)\n"
+            "Добавьте json в конце, чтобы получить NDJSON вместо CSV"
+        )
+    try:
+        start, end = parse_period(*parts)
+    except ExportPeriodError as e:
+        return await message.answer(f"❌ {e}")
+
+    # Пишем на диск порциями и отправляем файлом — заказы целиком в памяти не держим
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    try:
+        chunks = 0
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            async for chunk in iter_export_text(shop().storage.iter_order_rows(start, end, EXPORT_CHUNK), fmt):
+                f.write(chunk)
+                chunks += 1
+        # У CSV первый фрагмент — заголовок
+        if chunks <= (1 if fmt == "csv" else 0):
+            return await message.answer("📭 Заказов за этот период нет")
+        if os.path.getsize(path) > ORDERS_EXPORT_MAX_FILE_SIZE:
+            return await message.answer("❌ Выгрузка больше 50 МБ — Telegram не примет такой файл. "
+                                        "Возьмите период короче или выгрузите через API: /api/admin/orders/export")
+        period = "_".join(parts)
+        await message.answer_document(
+            FSInputFile(path, filename=f"orders-{period}.{fmt}"),
+            caption=f"🧾 Заказы: {' — '.join(parts)}"
+        )
+    finally:
+        os.remove(path)
+
+
+@dp.message(F.document, StateFilter(None))
+async def handle_catalog_document(message: Message):
+    """CSV-файл от админа — импорт каталога"""
+    if not is_admin(message.from_user.id):
+        return
+    document = message.document
+    file_name = (document.file_name or "").lower()
+    if file_name.endswith((".xlsx", ".xls")):
+        return await message.answer("📄 Сохраните таблицу в формате CSV (Excel: «Сохранить как» → CSV) и отправьте ещё раз")
+    if not file_name.endswith((".csv", ".txt")):
+        return
+    if document.file_size and document.file_size > CATALOG_MAX_FILE_SIZE:
+        return await message.answer("❌ Файл больше 20 МБ — Telegram не отдаёт ботам такие файлы. "
+                                    "Разбейте его на части или загрузите через API")
+
+    status = await message.answer("📥 Загружаю файл...")
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    last_progress = time.monotonic()
+    # Отчёт import_catalog (обновляется после каждой записанной пачки) — для сообщения об обрыве
+    imported = {"rows": 0, "created": 0, "updated": 0, "errors": 0}
+
+    async def progress(report):
+        nonlocal last_progress, imported
+        imported = report
+        if time.monotonic() - last_progress < CATALOG_PROGRESS_INTERVAL:
+            return
+        last_progress = time.monotonic()
+        try:
+            await status.edit_text(_catalog_report_text(report, done=False), parse_mode="HTML")
+        except Exception as e:
+            logger.debug("Не удалось обновить прогресс импорта: %s", e)
+
+    try:
+        await shop().bot.download(document, destination=path)
+        with open(path, "rb") as f:
+            report = await import_catalog(f, progress)
+    except CatalogFormatError as e:
+        return await status.edit_text(f"❌ Файл не импортирован: {html_escape(str(e))}", parse_mode="HTML")
+    except Exception as e:
+        # Не скачался файл (сеть, размер), сбой записи в БД — иначе статус так и висел бы на «Загружаю файл»
+        logger.error("❌ Импорт каталога прерван: %s", e, exc_info=True)
+        return await status.edit_text(_catalog_report_text(imported, done=False, error=str(e) or type(e).__name__),
+                                      parse_mode="HTML")
+    finally:
+        os.remove(path)
+    await status.edit_text(_catalog_report_text(report, done=True), parse_mode="HTML")
+
+
 @dp.callback_query(F.data.startswith("toggle_product_"))
 async def toggle_product(callback: CallbackQuery):
     """Переключает статус товара (активный/неактивный)"""
+    storage = shop().storage
     product_id = int(callback.data.replace("toggle_product_", ""))
 
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Получаем текущий статус
-        cur = await db.execute("SELECT active FROM products WHERE id=?", (product_id,))
-        row = await cur.fetchone()
-        if not row:
-            await callback.answer("❌ Товар не найден", show_alert=True)
-            return
+    async def op(db):
+        # Статус читается и меняется одним UPDATE
+        new_status = await storage.products.toggle_active(db, product_id)
+        if new_status is None:
+            return None
+        return new_status, await product_change(db, product_id)
 
-        new_status = 0 if row[0] else 1
-        await db.execute("UPDATE products SET active=? WHERE id=?", (new_status, product_id))
-        await db.commit()
+    result = await storage.write(op)
+    if result is None:
+        await callback.answer("❌ Товар не найден", show_alert=True)
+        return
+    new_status, change = result
+    apply_product_change(change, event="hidden" if new_status == 0 else "restored")
 
     action = "удален" if new_status == 0 else "восстановлен"
     await callback.answer(f"✅ Товар {action}")
@@ -709,7 +2072,7 @@ async def toggle_product(callback: CallbackQuery):
         else:
             await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
     except Exception as e:
-        logger.warning(f"Не удалось отредактировать сообщение со списком товаров: {e}")
+        logger.warning("Не удалось отредактировать сообщение со списком товаров: %s", e)
         # Fallback: отправить новое сообщение
         if keyboard is None:
             await callback.message.answer(text, parse_mode="HTML")
@@ -717,6 +2080,61 @@ async def toggle_product(callback: CallbackQuery):
             await callback.message.answer(text, reply_markup=keyboard, parse_mode="HTML")
 
 
+@dp.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    """Inline-поиск по каталогу: @bot 205/55 R16. Отвечает из in-memory индекса."""
+    try:
+        offset = max(int(inline_query.offset or 0), 0)
+    except ValueError:
+        offset = 0
+    current = shop()
+    hits, next_offset = current.search_index.search(inline_query.query, offset=offset, limit=INLINE_PAGE_SIZE)
+
+    shop_button = None
+    if current.webapp_url:
+        shop_button = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🛞 Открыть магазин", url=current.webapp_url)]
+        ])
+
+    results = []
+    for p in hits:
+        # Названия из CSV поставщика могут содержать «&» и «<» — без экранирования Telegram отклонит разметку
+        text = f"🛞 <b>{html_escape(p['name'])}</b>\n💰 {p['price']} ₽"
+        if p["specs"]:
+            text += f"\n🏷️ {html_escape(', '.join(p['specs']))}"
+        description = f"{p['price']} ₽" + (f" · {', '.join(p['specs'])}" if p["specs"] else "")
+        if p["image_file_id"]:
+            # Фото отправляется по file_id — без повторной загрузки
+            results.append(InlineQueryResultCachedPhoto(
+                id=str(p["id"]),
+                photo_file_id=p["image_file_id"],
+                title=p["name"],
+                description=description,
+                caption=text[:PHOTO_CAPTION_LIMIT],
+                parse_mode="HTML",
+                reply_markup=shop_button,
+            ))
+        else:
+            thumbnail_url = None
+            if current.webapp_url and (p["image"] or "").startswith("/api/uploads/"):
+                thumbnail_url = f"{current.webapp_url}{p['image']}"
+            results.append(InlineQueryResultArticle(
+                id=str(p["id"]),
+                title=p["name"],
+                description=description,
+                thumbnail_url=thumbnail_url,
+                input_message_content=InputTextMessageContent(message_text=text, parse_mode="HTML"),
+                reply_markup=shop_button,
+            ))
+
+    await inline_query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=str(next_offset) if next_offset is not None else "",
+    )
+
+
 @dp.message(Command("cancel"))
 async def cmd_cancel(message: Message, state: FSMContext):
     """Отменяет текущую операцию"""
@@ -811,6 +2229,46 @@ async def process_price(message: Message, state: FSMContext):
     )
 
 
+async def _download_product_photo(file_id: str, file_name: str):
+    """Скачивает фото товара из Telegram в uploads/file_name (ссылка товара уже известна) и уменьшает его"""
+    local_path = upload_store.path_for(file_name)
+    try:
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        file_info = await shop().bot.get_file(file_id)
+        await shop().bot.download_file(file_info.file_path, local_path)
+        # Приводим к оптимальному размеру для карточки товара (не блокируя event loop)
+        await asyncio.to_thread(resize_image_to_optimal, local_path)
+        logger.info("Фото товара сохранено: %s", file_name)
+    except Exception as e:
+        logger.error("Не удалось скачать фото товара %s: %s", file_name, e)
+    finally:
+        _pending_downloads.pop(file_name, None)
+
+
+async def store_product_photo(file_id: str) -> str:
+    """Скачивает фото товара из Telegram в хранилище по содержимому; возвращает /api/uploads/..."""
+    temp_path = upload_store.temp_path(".jpg")
+    try:
+        file_info = await shop().bot.get_file(file_id)
+        await shop().bot.download_file(file_info.file_path, temp_path)
+        # Уменьшается только новое содержимое; повтор того же фото — без работы
+        image, created = await asyncio.to_thread(upload_store.put, temp_path, ".jpg", resize_image_to_optimal)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    logger.info("Фото товара %s: %s", "сохранено" if created else "уже есть в хранилище", image)
+    return image
+
+
+def ensure_product_photo(file_id: str, file_name: str) -> asyncio.Task:
+    """Запускает (или возвращает уже идущее) фоновое скачивание фото товара"""
+    task = _pending_downloads.get(file_name)
+    if task is None:
+        task = spawn_background(_download_product_photo(file_id, file_name))
+        _pending_downloads[file_name] = task
+    return task
+
+
 @dp.message(AddProduct.waiting_image)
 async def process_image(message: Message, state: FSMContext):
     """Обрабатывает изображение товара (фото или эмодзи)"""
@@ -823,28 +2281,18 @@ async def process_image(message: Message, state: FSMContext):
 
     # Если отправлено фото
     if message.photo:
-        # Берем самое большое фото
+        # Берем самое большое фото. Скачивание идёт в фоне, пока заполняются остальные
+        # шаги; имя файла (хэш содержимого) станет известно к сохранению товара
         photo = message.photo[-1]
-        file_info = await bot.get_file(photo.file_id)
-        file_path = file_info.file_path
-
-        # Сохраняем фото локально
-        upload_dir = os.path.join(os.path.dirname(__file__), "uploads")
-        os.makedirs(upload_dir, exist_ok=True)
-
-        file_ext = os.path.splitext(file_path)[1] or ".jpg"
-        file_name = f"{uuid.uuid4()}{file_ext}"
-        local_path = os.path.join(upload_dir, file_name)
-
-        # Скачиваем файл
-        await bot.download_file(file_path, local_path)
-
-        # Приводим к оптимальному размеру для карточки товара
-        resize_image_to_optimal(local_path)
-
-        # Сохраняем путь к изображению
-        image = f"/api/uploads/{file_name}"
-        await state.update_data(image=image)
+        _wizard_photos[message.from_user.id] = (
+            photo.file_unique_id, spawn_background(store_product_photo(photo.file_id)))
+
+        # Сохраняем file_id для повторной отправки ботом; путь к файлу — при сохранении
+        await state.update_data(
+            image=None,
+            image_file_id=photo.file_id,
+            image_file_unique_id=photo.file_unique_id
+        )
         await state.set_state(AddProduct.waiting_description)
         await message.answer(
             f"✅ <b>Фото успешно загружено!</b>\n\n"
@@ -864,7 +2312,7 @@ async def process_image(message: Message, state: FSMContext):
             # Иначе используем как эмодзи
             image = text[:1] if len(text) > 0 else "🛞"
 
-        await state.update_data(image=image)
+        await state.update_data(image=image, image_file_id=None, image_file_unique_id=None)
         await state.set_state(AddProduct.waiting_description)
         await message.answer(
             f"✅ Изображение: <b>{image}</b>\n\n"
@@ -881,7 +2329,7 @@ async def process_image_emoji(callback: CallbackQuery, state: FSMContext):
     if image == "skip":
         image = "🛞"  # Значение по умолчанию
 
-    await state.update_data(image=image)
+    await state.update_data(image=image, image_file_id=None, image_file_unique_id=None)
     await state.set_state(AddProduct.waiting_description)
     await callback.message.edit_text(
         f"✅ Эмодзи: <b>{image}</b>\n\n"
@@ -938,7 +2386,7 @@ async def process_specs(message: Message, state: FSMContext):
         "📋 <b>Превью товара:</b>\n\n"
         f"📝 <b>Название:</b> {data['name']}\n"
         f"💰 <b>Цена:</b> {data['price']} ₽\n"
-        f"🖼️ <b>Эмодзи:</b> {data['image']}\n"
+        f"🖼️ <b>Изображение:</b> {'фото' if data.get('image_file_id') else data['image']}\n"
         f"📄 <b>Описание:</b> {data.get('description', 'не указано') or 'не указано'}\n"
         f"🏷️ <b>Характеристики:</b> {', '.join(specs) if specs else 'не указано'}\n\n"
         "✅ Сохранить товар?"
@@ -951,51 +2399,81 @@ async def process_specs(message: Message, state: FSMContext):
         ]
     ])
 
-    await message.answer(preview, reply_markup=keyboard, parse_mode="HTML")
+    # Фото показываем по file_id — Telegram не загружает файл повторно
+    if data.get('image_file_id') and len(preview) <= PHOTO_CAPTION_LIMIT:
+        await message.answer_photo(data['image_file_id'], caption=preview, reply_markup=keyboard, parse_mode="HTML")
+    else:
+        await message.answer(preview, reply_markup=keyboard, parse_mode="HTML")
+
+
+async def wizard_photo_path(user_id: int, file_id: str, file_unique_id: str) -> str:
+    """Путь к фото из мастера /add: результат фонового скачивания или повторное скачивание"""
+    pending = _wizard_photos.pop(user_id, None)
+    if pending is not None and pending[0] == file_unique_id:
+        try:
+            return await pending[1]
+        except Exception as e:
+            logger.warning("Фоновое скачивание фото не удалось, повторяем: %s", e)
+    return await store_product_photo(file_id)
+
+
+async def edit_product_message(message: Message, text: str, **kwargs):
+    """Редактирует сообщение с товаром: подпись у фото или текст у обычного сообщения"""
+    if message.photo:
+        return await message.edit_caption(caption=text, **kwargs)
+    return await message.edit_text(text, **kwargs)
 
 
 @dp.callback_query(F.data == "confirm_yes")
 async def confirm_add(callback: CallbackQuery, state: FSMContext):
     """Сохраняет товар в базу данных"""
+    storage = shop().storage
     try:
         data = await state.get_data()
-        logger.info(f"Получены данные для сохранения: {data}")
+        logger.debug("Получены данные для сохранения: %s", data)
 
         # Проверяем наличие необходимых данных
         if not data or 'name' not in data or 'price' not in data:
-            logger.warning(f"Недостаточно данных для сохранения: {data}")
+            logger.warning("Недостаточно данных для сохранения, поля: %s", sorted(data or {}))
             await callback.answer("❌ Ошибка: данные не найдены. Начните добавление товара заново.", show_alert=True)
             await state.clear()
             return
 
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute(
-                "INSERT INTO products(name, price, image, description, specs) VALUES(?,?,?,?,?)",
-                (
-                    data['name'],
-                    data['price'],
-                    data['image'],
-                    data.get('description', ''),
-                    json.dumps(data.get('specs', []), ensure_ascii=False)
-                ),
+        image = data['image']
+        if image is None:
+            image = await wizard_photo_path(callback.from_user.id, data['image_file_id'], data['image_file_unique_id'])
+
+        async def op(db):
+            product_id = await storage.products.create(
+                db,
+                data['name'],
+                data['price'],
+                image,
+                data.get('description', ''),
+                json.dumps(data.get('specs', []), ensure_ascii=False),
+                data.get('image_file_id'),
+                data.get('image_file_unique_id'),
             )
-            await db.commit()
-            logger.info(f"Товар сохранен в БД: {data['name']}")
+            return await product_change(db, product_id)
+
+        apply_product_change(await storage.write(op), event="added")
+        logger.info("Товар сохранен в БД: %s", data['name'])
 
         await callback.answer("Товар добавлен!")
-        await callback.message.edit_text(
+        await edit_product_message(
+            callback.message,
             f"✅ <b>Товар успешно добавлен!</b>\n\n"
             f"📝 {data['name']}\n"
             f"💰 {data['price']} ₽\n"
-            f"🖼️ {data['image']}",
+            f"🖼️ {image}",
             parse_mode="HTML"
         )
         await state.clear()
     except Exception as e:
-        logger.error(f"Ошибка при сохранении товара: {e}", exc_info=True)
+        logger.error("Ошибка при сохранении товара: %s", e, exc_info=True)
         await callback.answer("❌ Ошибка при сохранении товара", show_alert=True)
         try:
-            await callback.message.edit_text("❌ Произошла ошибка при сохранении товара. Попробуйте снова.")
+            await edit_product_message(callback.message, "❌ Произошла ошибка при сохранении товара. Попробуйте снова.")
         except:
             pass
 
@@ -1004,35 +2482,58 @@ async def confirm_add(callback: CallbackQuery, state: FSMContext):
 async def cancel_add(callback: CallbackQuery, state: FSMContext):
     """Отменяет добавление товара"""
     await callback.answer("Операция отменена")
-    await callback.message.edit_text("❌ Добавление товара отменено")
+    await edit_product_message(callback.message, "❌ Добавление товара отменено")
     await state.clear()
 
 
 # --- RUNNERS ---
 
 async def run_api():
+    import uvicorn
     port = int(os.environ.get("PORT", "7070"))
-    config = uvicorn.Config(app, host="0.0.0.0", port=port, log_level="info")
-    logger.info(f"🌐 API сервер запущен на порту {port}")
+    # log_config=None — uvicorn пишет через общий неблокирующий логгер (log_setup)
+    config = uvicorn.Config(app, host="0.0.0.0", port=port, log_level="info", log_config=None)
+    logger.info("🌐 API сервер запущен на порту %s", port)
     server = uvicorn.Server(config)
-    await server.serve()
+
+    async def notify_started():
+        # Сообщаем run_bot, что порт открыт и webhook можно регистрировать
+        while not server.started:
+            await asyncio.sleep(0.01)
+        api_started.set()
+        # Ленты событий бесконечны: при остановке закрываем их, иначе uvicorn ждёт их завершения
+        while not server.should_exit:
+            await asyncio.sleep(0.5)
+        for s in shops:
+            s.events.close()
+
+    watcher = asyncio.create_task(notify_started())
+    try:
+        await server.serve()
+    finally:
+        watcher.cancel()
 
 
 async def run_bot():
-    """Запускает бота с правильной обработкой webhook и ошибок"""
-    try:
-        # Проверяем текущий статус webhook
-        webhook_info = await bot.get_webhook_info()
-        has_active_webhook = webhook_info.url and webhook_info.url != ""
+    """Запускает бота с правильной обработкой webhook и ошибок.
 
+    Рукопожатие с Telegram сведено к одному запросу (set_webhook или delete_webhook)
+    и не задерживает API: оно идёт параллельно с запуском сервера.
+    """
+    try:
         # Проверяем, нужно ли использовать webhook или polling
         use_webhook = os.environ.get("USE_WEBHOOK", "false").lower() == "true"
 
         # Если USE_WEBHOOK=true и есть WEBAPP_URL, используем webhook
         if use_webhook and WEBAPP_URL:
-            webhook_url = f"{WEBAPP_URL}/api/webhook"
-            logger.info(f"Устанавливаем webhook: {webhook_url}")
-            await bot.set_webhook(webhook_url, drop_pending_updates=True)
+            # Регистрируем webhook, только когда API уже принимает запросы,
+            # иначе первые обновления от Telegram уйдут в закрытый порт
+            await api_started.wait()
+            # У бота каждого магазина свой адрес на общем endpoint: /api/webhook/<магазин>
+            for s in shops:
+                webhook_url = shop_webhook_url(s)
+                logger.info("Устанавливаем webhook магазина %s: %s", s.slug, webhook_url)
+                await s.bot.set_webhook(webhook_url, drop_pending_updates=True)
             logger.info("✅ Webhook установлен. Бот работает через Tuna туннель.")
             logger.info("📡 Обновления будут приходить через /api/webhook endpoint")
             # При использовании webhook бот обрабатывается через API endpoint
@@ -1040,49 +2541,63 @@ async def run_bot():
             while True:
                 await asyncio.sleep(3600)  # Ждем час, чтобы не завершать задачу
         else:
-            # Используем polling (по умолчанию)
-            if has_active_webhook:
-                logger.warning(f"⚠️  Обнаружен активный webhook: {webhook_info.url}")
-                logger.info("Удаляем webhook для использования polling...")
-
-            # ВСЕГДА отменяем webhook перед запуском polling
-            try:
-                await bot.delete_webhook(drop_pending_updates=True)
-                logger.info("✅ Webhook удален. Запускаем polling...")
-                await asyncio.sleep(2)  # Даем время для завершения операций
-            except Exception as webhook_error:
-                logger.warning(f"⚠️  Ошибка при удалении webhook: {webhook_error}")
-                # Пытаемся продолжить, возможно webhook уже удален
-
-            # Запускаем polling
+            # Используем polling (по умолчанию).
+            # ВСЕГДА отменяем webhook перед запуском polling: deleteWebhook идемпотентен,
+            # поэтому отдельная проверка getWebhookInfo и пауза не нужны
+            for s in shops:
+                try:
+                    await s.bot.delete_webhook(drop_pending_updates=True)
+                    logger.info("✅ Webhook магазина %s удален. Запускаем polling...", s.slug)
+                except Exception as webhook_error:
+                    logger.warning("⚠️  Ошибка при удалении webhook магазина %s: %s", s.slug, webhook_error)
+                    # Пытаемся продолжить, возможно webhook уже удален
+
+            # Запускаем polling: один Dispatcher опрашивает ботов всех магазинов
             logger.info("🔄 Запуск polling...")
             await dp.start_polling(
-                bot,
-                allowed_updates=dp.resolve_used_update_types(),
-                drop_pending_updates=True
+                *(s.bot for s in shops),
+                allowed_updates=dp.resolve_used_update_types()
             )
     except Exception as e:
-        logger.error(f"❌ Ошибка при запуске бота: {e}", exc_info=True)
+        logger.error("❌ Ошибка при запуске бота: %s", e, exc_info=True)
         raise
 
 
 async def shutdown_bot():
     """Корректно завершает работу бота"""
     logger.info("Завершение работы бота...")
-    await bot.session.close()
+    # Сессия общая для ботов всех магазинов
+    await telegram_session.close()
     logger.info("Бот остановлен")
 
 
 async def main():
     """Главная функция запуска приложения"""
     try:
-        logger.info("Инициализация базы данных...")
-        await init_db()
-        logger.info("База данных инициализирована")
-        logger.info(f"Загружено администраторов: {len(ADMIN_IDS)} - {ADMIN_IDS}")
+        for s in shops:
+            # Фоновые задачи магазина наследуют current_shop от момента запуска
+            token = current_shop.set(s)
+            try:
+                logger.info("Инициализация базы данных магазина %s...", s.slug)
+                await init_db()
+                s.initialized = True
+                logger.info("База данных инициализирована")
+                logger.info("Загружено администраторов: %s", len(s.admin_ids))
+
+                if os.environ.get("MAINTENANCE_ENABLED", "true").lower() == "true":
+                    s.maintenance.start()
+
+                # Обработчик рассылок; незавершённые до перезапуска рассылки продолжатся
+                s.broadcasts.start()
+            finally:
+                current_shop.reset(token)
 
         logger.info("Запуск API сервера и бота...")
 
+        # Монитор задержек event loop: тик раз в секунду, почти без накладных расходов
+        if os.environ.get("LOOP_LAG_MONITOR", "true").lower() == "true":
+            loop_lag_monitor.start()
+
         # Создаем задачи для параллельного запуска
         api_task = asyncio.create_task(run_api())
         bot_task = asyncio.create_task(run_bot())
@@ -1099,25 +2614,35 @@ async def main():
         for i, result in enumerate(results):
             if isinstance(result, Exception):
                 task_name = "API" if i == 0 else "Bot"
-                logger.error(f"Задача {task_name} завершилась с ошибкой: {result}", exc_info=True)
+                logger.error("Задача %s завершилась с ошибкой: %s", task_name, result, exc_info=True)
             else:
                 task_name = "API" if i == 0 else "Bot"
-                logger.info(f"Задача {task_name} завершена")
+                logger.info("Задача %s завершена", task_name)
 
     except KeyboardInterrupt:
         logger.info("Получен KeyboardInterrupt. Завершение работы...")
     except Exception as e:
-        logger.error(f"Критическая ошибка: {e}", exc_info=True)
+        logger.error("Критическая ошибка: %s", e, exc_info=True)
     finally:
         logger.info("Очистка ресурсов...")
+        loop_lag_monitor.stop()
+        for s in shops:
+            s.maintenance.stop()
+            await s.broadcasts.stop()
+            await s.storage.close()
+        if update_recorder is not None:
+            update_recorder.close()
         await shutdown_bot()
 
 
+STARTUP_REPORT["import_s"] = round(time.perf_counter() - _PROCESS_START, 3)
+
+
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Приложение остановлено пользователем")
     except Exception as e:
-        logger.error(f"Ошибка запуска: {e}", exc_info=True)
+        logger.error("Ошибка запуска: %s", e, exc_info=True)
         sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,383 @@
+"""
+Рассылка сообщений прошлым покупателям (получатели — уникальные user_id заказов
+основной и архивной БД или список из recipients(), если заказы хранятся в другой БД).
+
+Очередь хранится в БД (таблицы broadcasts и broadcast_recipients), поэтому после
+перезапуска рассылка продолжается с того же места. Один фоновый обработчик отправляет
+сообщения по очереди через TelegramRateLimiter: общий лимит бота, интервал между
+сообщениями в один чат и пауза по ответу 429 (retry_after). Заблокировавшие бота
+пользователи помечаются как blocked и больше не повторяются. Ход рассылки виден
+в одном статусном сообщении администратора, которое периодически редактируется.
+
+Результаты пишутся в БД пачками по FLUSH_EVERY; при аварийном завершении процесса
+последняя незаписанная пачка может быть отправлена повторно.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Optional, Set
+
+import aiosqlite
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from ratelimit import TelegramRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Сообщений в секунду на всю рассылку (лимит Telegram — около 30)
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+# Как часто обновлять статусное сообщение, секунд
+PROGRESS_INTERVAL = 3.0
+FLUSH_EVERY = 20
+BATCH_SIZE = 200
+# Попыток на получателя при сетевых ошибках и 5xx (ответы 429 не считаются)
+MAX_ATTEMPTS = 3
+MAX_RETRY_AFTER = 20
+
+STATUS_LABELS = {
+    "draft": "📝 черновик",
+    "queued": "🕐 в очереди",
+    "running": "⏳ идёт",
+    "done": "✅ завершена",
+    "cancelled": "⛔ остановлена",
+}
+
+
+def format_progress(b: dict) -> str:
+    """Текст статусного сообщения рассылки"""
+    processed = b["sent"] + b["blocked"] + b["failed"]
+    percent = processed * 100 // b["total"] if b["total"] else 100
+    return (
+        f"📣 <b>Рассылка #{b['id']}</b> — {STATUS_LABELS.get(b['status'], b['status'])}\n\n"
+        f"Обработано: {processed} из {b['total']} ({percent}%)\n"
+        f"✅ Доставлено: {b['sent']}\n"
+        f"🚫 Заблокировали бота: {b['blocked']}\n"
+        f"❌ Ошибок: {b['failed']}"
+    )
+
+
+def cancel_keyboard(broadcast_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="⛔ Остановить", callback_data=f"broadcast_cancel_{broadcast_id}")
+    ]])
+
+
+class BroadcastEngine:
+    """Персистентная очередь рассылок и её обработчик"""
+
+    def __init__(self, bot, db_path: str, limiter: Optional[TelegramRateLimiter] = None,
+                 recipients: Optional[Callable[[], Awaitable[List[int]]]] = None,
+                 archive_path: Optional[str] = None):
+        self.bot = bot
+        self.db_path = db_path
+        # Заказы старше ORDERS_ARCHIVE_DAYS перенесены сюда задачей archive_orders
+        self.archive_path = archive_path
+        self.limiter = limiter or TelegramRateLimiter(BROADCAST_RATE)
+        # Источник получателей, если заказы хранятся не в этом файле SQLite (см. storage)
+        self.recipients = recipients
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._cancelled: Set[int] = set()
+
+    async def init_schema(self):
+        """Создаёт таблицы очереди рассылок"""
+        async with aiosqlite.connect(self.db_path) as db:
+            # Рассылки: задание и список получателей с результатом доставки каждому
+            await db.execute("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                admin_chat_id INTEGER NOT NULL,
+                status_message_id INTEGER,
+                text TEXT DEFAULT '',
+                source_chat_id INTEGER,
+                source_message_id INTEGER,
+                status TEXT NOT NULL DEFAULT 'draft',
+                total INTEGER NOT NULL DEFAULT 0,
+                sent INTEGER NOT NULL DEFAULT 0,
+                blocked INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+            """)
+            await db.execute("""
+            CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                broadcast_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                PRIMARY KEY (broadcast_id, user_id)
+            ) WITHOUT ROWID
+            """)
+            await db.commit()
+
+    # --- Управление ---
+
+    async def create(self, admin_chat_id: int, text: str = "",
+                     source_chat_id: Optional[int] = None, source_message_id: Optional[int] = None) -> dict:
+        """Создаёт черновик рассылки и фиксирует список получателей"""
+        async with aiosqlite.connect(self.db_path) as db:
+            # ATTACH — до первой записи: внутри транзакции он не выполняется
+            tables = await self._attach_archive(db)
+            cur = await db.execute(
+                "INSERT INTO broadcasts(admin_chat_id, text, source_chat_id, source_message_id) VALUES(?,?,?,?)",
+                (admin_chat_id, text, source_chat_id, source_message_id)
+            )
+            broadcast_id = cur.lastrowid
+            if self.recipients is not None:
+                user_ids = await self.recipients()
+                await db.executemany(
+                    "INSERT OR IGNORE INTO broadcast_recipients(broadcast_id, user_id) VALUES(?,?)",
+                    [(broadcast_id, user_id) for user_id in user_ids]
+                )
+                total = len(set(user_ids))
+            else:
+                # Покупатели прошлых сезонов есть только в архиве
+                union = " UNION ".join(f"SELECT user_id FROM {table} WHERE user_id > 0" for table in tables)
+                cur = await db.execute(
+                    f"INSERT INTO broadcast_recipients(broadcast_id, user_id) SELECT DISTINCT ?, user_id FROM ({union})",
+                    (broadcast_id,)
+                )
+                total = cur.rowcount
+            await db.execute("UPDATE broadcasts SET total=? WHERE id=?", (total, broadcast_id))
+            await db.commit()
+        return await self.get(broadcast_id)
+
+    async def _attach_archive(self, db: aiosqlite.Connection) -> List[str]:
+        """Таблицы заказов для списка получателей: main.orders и archive.orders, если архив есть"""
+        tables = ["main.orders"]
+        if self.recipients is None and self.archive_path and os.path.exists(self.archive_path):
+            await db.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            cur = await db.execute("SELECT 1 FROM archive.sqlite_master WHERE type='table' AND name='orders'")
+            if await cur.fetchone():
+                tables.append("archive.orders")
+        return tables
+
+    async def enqueue(self, broadcast_id: int, status_message_id: int) -> bool:
+        """Ставит черновик в очередь; статусное сообщение будет обновляться по ходу рассылки"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cur = await db.execute(
+                "UPDATE broadcasts SET status='queued', status_message_id=? WHERE id=? AND status='draft'",
+                (status_message_id, broadcast_id)
+            )
+            await db.commit()
+        if cur.rowcount:
+            self._wakeup.set()
+        return bool(cur.rowcount)
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        async with aiosqlite.connect(self.db_path) as db:
+            cur = await db.execute(
+                "UPDATE broadcasts SET status='cancelled', finished_at=CURRENT_TIMESTAMP "
+                "WHERE id=? AND status IN ('draft', 'queued', 'running')",
+                (broadcast_id,)
+            )
+            await db.commit()
+        if cur.rowcount:
+            self._cancelled.add(broadcast_id)
+        return bool(cur.rowcount)
+
+    async def get(self, broadcast_id: int) -> Optional[dict]:
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            cur = await db.execute("SELECT * FROM broadcasts WHERE id=?", (broadcast_id,))
+            row = await cur.fetchone()
+        return dict(row) if row else None
+
+    async def latest(self, limit: int = 5) -> List[dict]:
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            cur = await db.execute("SELECT * FROM broadcasts ORDER BY id DESC LIMIT ?", (limit,))
+            return [dict(row) for row in await cur.fetchall()]
+
+    def start(self):
+        """Запускает обработчик; незавершённые рассылки продолжаются автоматически"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # --- Обработчик очереди ---
+
+    async def _next_broadcast(self) -> Optional[dict]:
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            cur = await db.execute(
+                "SELECT * FROM broadcasts WHERE status IN ('running', 'queued') "
+                "ORDER BY status='running' DESC, id LIMIT 1"
+            )
+            row = await cur.fetchone()
+        return dict(row) if row else None
+
+    async def _run_forever(self):
+        while True:
+            # Сбрасываем флаг до запроса, чтобы не пропустить enqueue() во время выборки
+            self._wakeup.clear()
+            try:
+                b = await self._next_broadcast()
+                if b is None:
+                    await self._wakeup.wait()
+                    continue
+                await self._process(b)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("📣 Ошибка обработчика рассылок: %s", e, exc_info=True)
+                await asyncio.sleep(5)
+
+    async def _process(self, b: dict):
+        broadcast_id = b["id"]
+        if b["status"] == "queued":
+            logger.info("📣 Рассылка #%s запущена: %s получателей", broadcast_id, b["total"])
+        else:
+            logger.info("📣 Рассылка #%s продолжена после перезапуска", broadcast_id)
+        b["status"] = "running"
+        results: List[tuple] = []
+        last_progress = 0.0
+
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE broadcasts SET status='running', started_at=COALESCE(started_at, CURRENT_TIMESTAMP) "
+                "WHERE id=? AND status IN ('queued', 'running')",
+                (broadcast_id,)
+            )
+            await db.commit()
+
+            async def flush():
+                if results:
+                    await db.executemany(
+                        "UPDATE broadcast_recipients SET status=?, error=?, attempts=attempts+? "
+                        "WHERE broadcast_id=? AND user_id=?",
+                        results
+                    )
+                    results.clear()
+                await db.execute(
+                    "UPDATE broadcasts SET sent=?, blocked=?, failed=? WHERE id=?",
+                    (b["sent"], b["blocked"], b["failed"], broadcast_id)
+                )
+                await db.commit()
+
+            try:
+                last_user_id = 0
+                while broadcast_id not in self._cancelled:
+                    cur = await db.execute(
+                        "SELECT user_id FROM broadcast_recipients "
+                        "WHERE broadcast_id=? AND status='pending' AND user_id>? ORDER BY user_id LIMIT ?",
+                        (broadcast_id, last_user_id, BATCH_SIZE)
+                    )
+                    user_ids = [row[0] for row in await cur.fetchall()]
+                    if not user_ids:
+                        break
+                    for user_id in user_ids:
+                        if broadcast_id in self._cancelled:
+                            break
+                        status, error, attempts = await self._deliver(b, user_id)
+                        b[status] += 1
+                        results.append((status, error, attempts, broadcast_id, user_id))
+                        last_user_id = user_id
+                        if len(results) >= FLUSH_EVERY:
+                            await flush()
+                        if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                            last_progress = time.monotonic()
+                            await self._report_progress(b)
+            finally:
+                # Сохраняем результаты и при остановке процесса, чтобы не отправить их повторно
+                await flush()
+
+            if broadcast_id in self._cancelled:
+                self._cancelled.discard(broadcast_id)
+                b["status"] = "cancelled"
+            else:
+                await db.execute(
+                    "UPDATE broadcasts SET status='done', finished_at=CURRENT_TIMESTAMP "
+                    "WHERE id=? AND status='running'",
+                    (broadcast_id,)
+                )
+                await db.commit()
+                b["status"] = "done"
+
+        logger.info("📣 Рассылка #%s: %s, доставлено %s, заблокировали %s, ошибок %s",
+                    broadcast_id, b["status"], b["sent"], b["blocked"], b["failed"])
+        await self._report_progress(b)
+
+    async def _deliver(self, b: dict, user_id: int):
+        """Отправляет сообщение одному получателю. Возвращает (статус, ошибка, попыток)"""
+        attempts = 0
+        retry_afters = 0
+        error = None
+        while attempts < MAX_ATTEMPTS:
+            await self.limiter.wait(user_id)
+            attempts += 1
+            try:
+                if b["source_message_id"]:
+                    await self.bot.copy_message(user_id, b["source_chat_id"], b["source_message_id"])
+                else:
+                    await self.bot.send_message(user_id, b["text"])
+                return "sent", None, attempts
+            except TelegramRetryAfter as e:
+                # Превышен лимит: ждут все отправки, попытка не засчитывается
+                logger.warning("📣 Telegram просит подождать %s с", e.retry_after)
+                self.limiter.pause(e.retry_after)
+                attempts -= 1
+                retry_afters += 1
+                error = str(e)
+                if retry_afters >= MAX_RETRY_AFTER:
+                    break
+            except TelegramForbiddenError as e:
+                # Пользователь заблокировал бота или удалил аккаунт
+                return "blocked", str(e), attempts
+            except TelegramBadRequest as e:
+                # chat not found и т.п. — повтор не поможет
+                return "failed", str(e), attempts
+            except (TelegramNetworkError, TelegramServerError) as e:
+                error = str(e)
+                await asyncio.sleep(2 ** attempts)
+        return "failed", error, attempts
+
+    async def _report_progress(self, b: dict):
+        if not b.get("status_message_id"):
+            return
+        keyboard = cancel_keyboard(b["id"]) if b["status"] == "running" else None
+        await self.limiter.wait(b["admin_chat_id"])
+        try:
+            await self.bot.edit_message_text(
+                format_progress(b),
+                chat_id=b["admin_chat_id"],
+                message_id=b["status_message_id"],
+                parse_mode="HTML",
+                reply_markup=keyboard,
+            )
+        except TelegramRetryAfter as e:
+            self.limiter.pause(e.retry_after)
+        except TelegramBadRequest as e:
+            # "message is not modified" — ничего не изменилось с прошлого обновления
+            if "not modified" not in str(e):
+                logger.warning("📣 Не удалось обновить статус рассылки #%s: %s", b["id"], e)
+        except Exception as e:
+            logger.warning("📣 Не удалось обновить статус рассылки #%s: %s", b["id"], e)
+
+
+def summary_lines(broadcasts: List[dict]) -> List[str]:
+    """Краткий список рассылок для /broadcast status"""
+    return [
+        f"#{b['id']} {STATUS_LABELS.get(b['status'], b['status'])}: "
+        f"{b['sent']}/{b['total']} доставлено, {b['blocked']} заблок., {b['failed']} ошибок"
+        for b in broadcasts
+    ]
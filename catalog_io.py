@@ -0,0 +1,210 @@
+"""
+Импорт и экспорт каталога в CSV.
+
+Файл читается потоково: строки разбираются по одной и отдаются пачками, поэтому прайс
+поставщика на десятки тысяч строк не загружается в память целиком. Кодировка (UTF-8 или
+Windows-1251, в которой сохраняет CSV русский Excel) и разделитель (";", "," или табуляция)
+определяются автоматически.
+
+Колонки (первая строка — заголовок, регистр не важен, можно по-русски):
+    sku / артикул           — ключ товара: строка с известным артикулом обновляет товар,
+                              с новым — добавляет
+    id                      — номер товара в боте (для товаров без артикула)
+    name / название         — обязательно для новых товаров
+    price / цена            — обязательно для новых товаров, целые рубли
+    image / фото            — эмодзи или имя файла в uploads/
+    description / описание
+    specs / характеристики  — через ";" (или через запятую, если ";" нет)
+    active / активен        — 1/0, да/нет; пусто — 1
+
+Колонки, которых нет в файле, у существующих товаров не меняются: файл "sku;price"
+обновляет только цены.
+"""
+import codecs
+import csv
+import io
+import json
+import re
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Колонки экспорта (в этом же виде файл принимается обратно)
+EXPORT_COLUMNS = ("id", "sku", "name", "price", "image", "description", "specs", "active")
+EXPORT_DELIMITER = ";"
+
+# Сколько строк уходит в БД одной операцией записи
+IMPORT_CHUNK = 500
+# Сколько ошибок по строкам возвращается в отчёте (считаются все)
+MAX_REPORTED_ERRORS = 20
+
+_ALIASES = {
+    "id": "id",
+    "sku": "sku", "артикул": "sku",
+    "name": "name", "название": "name", "наименование": "name",
+    "price": "price", "цена": "price",
+    "image": "image", "фото": "image", "изображение": "image",
+    "description": "description", "описание": "description",
+    "specs": "specs", "характеристики": "specs",
+    "active": "active", "активен": "active", "активный": "active",
+}
+# Колонки, которые пишутся в products как есть (id и sku — ключи)
+PRODUCT_COLUMNS = ("name", "price", "image", "description", "specs", "active")
+
+_PRICE_JUNK_RE = re.compile(r"[^\d,.\-]")
+_TRUE = {"1", "да", "yes", "true", "y", "+"}
+_FALSE = {"0", "нет", "no", "false", "n", "-"}
+
+
+class CatalogFormatError(ValueError):
+    """Файл нельзя прочитать как каталог (кодировка, заголовок)"""
+
+
+def _detect_encoding(binary: BinaryIO) -> str:
+    sample = binary.read(64 * 1024)
+    binary.seek(0)
+    try:
+        # Неполный многобайтовый символ на границе образца — не ошибка
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp1251"
+
+
+def _parse_price(value: str) -> int:
+    # "5 000 ₽", "5000,00 руб." -> 5000
+    cleaned = _PRICE_JUNK_RE.sub("", value).replace(",", ".").rstrip(".")
+    price = round(float(cleaned))
+    if price <= 0:
+        raise ValueError
+    return price
+
+
+def _parse_active(value: str) -> int:
+    value = value.strip().lower()
+    if not value or value in _TRUE:
+        return 1
+    if value in _FALSE:
+        return 0
+    raise ValueError
+
+
+def _parse_specs(value: str) -> str:
+    separator = ";" if ";" in value else ","
+    return json.dumps([s.strip() for s in value.split(separator) if s.strip()], ensure_ascii=False)
+
+
+class CatalogReader:
+    """Потоковое чтение CSV-каталога из бинарного файла"""
+
+    def __init__(self, binary: BinaryIO):
+        encoding = _detect_encoding(binary)
+        self._text = io.TextIOWrapper(binary, encoding=encoding, newline="")
+        try:
+            header_line = self._text.readline()
+        except UnicodeDecodeError:
+            raise CatalogFormatError("Не удалось определить кодировку файла")
+        if not header_line.strip():
+            raise CatalogFormatError("Файл пустой")
+        self.delimiter = max((";", ",", "\t"), key=header_line.count)
+        header = next(csv.reader([header_line], delimiter=self.delimiter))
+
+        # Канонические колонки -> индекс в строке файла
+        self.columns: Dict[str, int] = {}
+        self.ignored_columns: List[str] = []
+        for index, title in enumerate(header):
+            column = _ALIASES.get(title.strip().lower())
+            if column is None or column in self.columns:
+                if title.strip():
+                    self.ignored_columns.append(title.strip())
+                continue
+            self.columns[column] = index
+        if "sku" not in self.columns and "id" not in self.columns:
+            raise CatalogFormatError("Нужна колонка sku (артикул) или id")
+        self.product_columns = tuple(c for c in PRODUCT_COLUMNS if c in self.columns)
+        self.can_create = "sku" in self.columns and "name" in self.columns and "price" in self.columns
+        self._rows = csv.reader(self._text, delimiter=self.delimiter)
+        self.line = 1
+
+    def _parse(self, values: List[str]) -> dict:
+        def cell(column):
+            index = self.columns.get(column)
+            return values[index].strip() if index is not None and index < len(values) else ""
+
+        row = {"sku": cell("sku") or None, "id": None}
+        if "id" in self.columns and cell("id"):
+            try:
+                row["id"] = int(cell("id"))
+            except ValueError:
+                raise ValueError(f"id «{cell('id')}» — не число")
+        if row["sku"] is None and row["id"] is None:
+            raise ValueError("нет ни артикула, ни id")
+        if "name" in self.columns:
+            row["name"] = cell("name")
+            if not row["name"]:
+                raise ValueError("пустое название")
+        if "price" in self.columns:
+            try:
+                row["price"] = _parse_price(cell("price"))
+            except ValueError:
+                raise ValueError(f"цена «{cell('price')}» — не положительное число")
+        if "image" in self.columns:
+            row["image"] = cell("image") or "🛞"
+        if "description" in self.columns:
+            row["description"] = cell("description")
+        if "specs" in self.columns:
+            row["specs"] = _parse_specs(cell("specs"))
+        if "active" in self.columns:
+            try:
+                row["active"] = _parse_active(cell("active"))
+            except ValueError:
+                raise ValueError(f"active «{cell('active')}» — ожидается 1/0 или да/нет")
+        return row
+
+    def read_chunk(self, size: int = IMPORT_CHUNK) -> Tuple[List[dict], List[Tuple[int, str]]]:
+        """Следующие size непустых строк: (разобранные строки, [(номер строки, ошибка)]).
+
+        Пустой список строк и ошибок — файл закончился. У каждой строки есть ключ "line".
+        """
+        rows, errors = [], []
+        try:
+            while len(rows) + len(errors) < size:
+                values = next(self._rows, None)
+                if values is None:
+                    break
+                # Заголовок прочитан отдельно, поэтому +1
+                self.line = self._rows.line_num + 1
+                if not any(v.strip() for v in values):
+                    continue
+                try:
+                    row = self._parse(values)
+                except ValueError as e:
+                    errors.append((self.line, str(e)))
+                    continue
+                row["line"] = self.line
+                rows.append(row)
+        except UnicodeDecodeError:
+            raise CatalogFormatError(f"Строка {self.line + 1}: файл не в кодировке {self._text.encoding}")
+        except csv.Error as e:
+            raise CatalogFormatError(f"Строка {self.line + 1}: {e}")
+        return rows, errors
+
+
+def format_export_rows(rows: Iterable[tuple], header: bool = False) -> str:
+    """CSV-фрагмент для строк products (id, sku, name, price, image, description, specs, active)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=EXPORT_DELIMITER, lineterminator="\r\n")
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    for product_id, sku, name, price, image, description, specs, active in rows:
+        writer.writerow((
+            product_id, sku or "", name, price, image or "", description or "",
+            "; ".join(json.loads(specs or "[]")), 1 if active else 0,
+        ))
+    return buffer.getvalue()
+
+
+def iter_error_lines(errors: List[Tuple[int, str]], total: Optional[int] = None) -> Iterator[str]:
+    """Строки отчёта об ошибках для сообщения в боте"""
+    for line, message in errors[:MAX_REPORTED_ERRORS]:
+        yield f"строка {line}: {message}"
+    if total is not None and total > MAX_REPORTED_ERRORS:
+        yield f"… и ещё {total - MAX_REPORTED_ERRORS}"
@@ -0,0 +1,159 @@
+"""
+Единственный писатель SQLite с групповым коммитом.
+
+Вместо того чтобы каждая корутина открывала своё соединение и коммитила отдельно
+(и боролась с остальными за блокировку записи), операции записи ставятся в очередь.
+Фоновая задача забирает всё, что накопилось к очередному такту, и выполняет пачку
+в одной транзакции на одном соединении:
+
+    BEGIN IMMEDIATE
+      SAVEPOINT op; <операция 1>; RELEASE op
+      SAVEPOINT op; <операция 2>; ROLLBACK TO op   -- ошибка откатывает только её
+      ...
+    COMMIT                                          -- один fsync на всю пачку
+
+Каждый вызывающий получает результат или исключение своей операции, причём только
+после COMMIT: всё, что делается после await submit(), видит уже сохранённые данные.
+
+Операция — async-функция, принимающая соединение aiosqlite. Внутри неё нельзя
+делать ничего, кроме запросов к БД (никаких обращений к Telegram): пока она
+выполняется, ждёт вся пачка.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+WriteOp = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+# Сколько операций максимум в одной транзакции
+MAX_BATCH = 256
+# Ожидание блокировки, если пишет другой процесс (бэкап, обслуживание), секунд
+BUSY_TIMEOUT = 5.0
+
+
+class DatabaseWriter:
+    """Очередь операций записи и задача-писатель"""
+
+    def __init__(self, db_path: str, max_batch: int = MAX_BATCH):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"batches": 0, "ops": 0, "errors": 0, "max_batch": 0, "commit_ms_total": 0.0}
+
+    async def submit(self, op: WriteOp) -> Any:
+        """Выполняет операцию в ближайшей групповой транзакции и возвращает её результат"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, future))
+        return await future
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дожидается записи уже поставленных операций и закрывает соединение"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        try:
+            await self._task
+        finally:
+            self._task = None
+
+    async def _run(self):
+        batch: List[Tuple[WriteOp, asyncio.Future]] = []
+        error: BaseException = RuntimeError("Запись в БД остановлена")
+        try:
+            async with aiosqlite.connect(self.db_path, timeout=BUSY_TIMEOUT, isolation_level=None) as db:
+                while True:
+                    first = await self._queue.get()
+                    if first is None:
+                        return
+                    batch = [first]
+                    # Всё, что накопилось, пока выполнялась предыдущая пачка, — в ту же транзакцию
+                    while len(batch) < self.max_batch and not self._queue.empty():
+                        item = self._queue.get_nowait()
+                        if item is None:
+                            await self._execute(db, batch)
+                            return
+                        batch.append(item)
+                    await self._execute(db, batch)
+        except Exception as e:
+            # Соединение сломалось (ошибка диска, закрытый файл) или не прошёл ROLLBACK.
+            # Ошибку получат ожидающие — задачу не роняем, её исключение никто не заберёт
+            logger.error("💾 Писатель БД остановился: %s", e)
+            error = e
+        finally:
+            # Никто из ожидающих не должен висеть: текущая пачка и всё, что осталось в очереди,
+            # получают ошибку. Следующий submit() запустит писателя с новым соединением
+            self._fail_pending(batch, error)
+
+    def _fail_pending(self, batch: List[Tuple[WriteOp, asyncio.Future]], error: BaseException):
+        pending = [future for _, future in batch]
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                pending.append(item[1])
+        for future in pending:
+            if not future.done():
+                self.stats["errors"] += 1
+                future.set_exception(error)
+
+    async def _execute(self, db: aiosqlite.Connection, batch: List[Tuple[WriteOp, asyncio.Future]]):
+        outcomes: List[Tuple[bool, Any]] = []
+        start = time.perf_counter()
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            for op, future in batch:
+                if future.cancelled():
+                    outcomes.append((False, asyncio.CancelledError()))
+                    continue
+                await db.execute("SAVEPOINT op")
+                try:
+                    result = await op(db)
+                except Exception as e:
+                    await db.execute("ROLLBACK TO op")
+                    await db.execute("RELEASE op")
+                    outcomes.append((False, e))
+                else:
+                    await db.execute("RELEASE op")
+                    outcomes.append((True, result))
+            await db.execute("COMMIT")
+        except Exception as e:
+            # Не удалось начать или зафиксировать транзакцию — ошибка у всей пачки
+            logger.error("💾 Групповая транзакция (%s операций) не записана: %s", len(batch), e)
+            if db.in_transaction:
+                await db.execute("ROLLBACK")
+            outcomes = [(False, e)] * len(batch)
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.stats["batches"] += 1
+        self.stats["ops"] += len(batch)
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+        self.stats["commit_ms_total"] += elapsed_ms
+        for (_, future), (ok, value) in zip(batch, outcomes):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                self.stats["errors"] += 1
+                future.set_exception(value)
+
+    def report(self) -> dict:
+        batches = self.stats["batches"] or 1
+        return {
+            **self.stats,
+            "commit_ms_total": round(self.stats["commit_ms_total"], 1),
+            "avg_batch": round(self.stats["ops"] / batches, 2),
+            "avg_batch_ms": round(self.stats["commit_ms_total"] / batches, 2),
+            "queued": self._queue.qsize() if self._queue else 0,
+        }
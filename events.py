@@ -0,0 +1,194 @@
+"""
+Лента событий для администраторов (Server-Sent Events): новые заказы и изменения каталога.
+
+EventHub — pub/sub в памяти процесса, один на магазин. publish() вызывается после
+коммита записи (create_order, toggle_product, confirm_add, DELETE /api/products) и
+синхронно раскладывает событие по буферам подписчиков: кадр SSE кодируется один раз
+на событие, а не на подписчика, и никто никого не ждёт — доставка занимает
+миллисекунды даже при сотнях открытых лент.
+
+Каждое событие получает ID вида <запуск>-<номер>. Последние EVENTS_HISTORY событий
+хранятся в кольцевом буфере: клиент, переподключившийся с заголовком Last-Event-ID,
+получает всё пропущенное. Если пропущенного в буфере уже нет (или процесс перезапущен —
+другой <запуск>), первым приходит событие reset: клиенту нужно перечитать состояние.
+
+Буфер подписчика ограничен EVENTS_SUBSCRIBER_BUFFER кадрами. Медленный клиент,
+не успевающий забирать события, не копит память: при переполнении его поток
+завершается, и он переподключается с Last-Event-ID (догоняет из истории).
+Пока событий нет, раз в EVENTS_HEARTBEAT_SECONDS уходит комментарий-пинг: прокси
+и туннели не рвут соединение по простою, а клиент видит, что лента жива.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Optional
+
+# Сколько последних событий помнить для переподключения с Last-Event-ID
+EVENTS_HISTORY = int(os.environ.get("EVENTS_HISTORY", "1000"))
+# Сколько кадров может ждать отправки у одного подписчика
+EVENTS_SUBSCRIBER_BUFFER = int(os.environ.get("EVENTS_SUBSCRIBER_BUFFER", "256"))
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("EVENTS_HEARTBEAT_SECONDS", "15"))
+# Пауза перед переподключением, которую EventSource берёт из поля retry (мс)
+EVENTS_RETRY_MS = 3000
+
+HEARTBEAT_FRAME = b": ping\n\n"
+
+
+class Event:
+    """Событие ленты и его готовый кадр SSE"""
+
+    __slots__ = ("seq", "id", "type", "frame")
+
+    def __init__(self, seq: int, event_id: str, event_type: str, data: dict):
+        self.seq = seq
+        self.id = event_id
+        self.type = event_type
+        payload = json.dumps({"id": event_id, "type": event_type, "ts": round(time.time(), 3), **data},
+                             ensure_ascii=False, default=str)
+        self.frame = f"id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n".encode()
+
+
+class Subscriber:
+    """Ограниченный буфер кадров одного клиента"""
+
+    __slots__ = ("buffer", "limit", "wakeup", "overflowed", "closed", "idle")
+
+    def __init__(self, limit: int):
+        self.buffer = deque()
+        self.limit = limit
+        self.wakeup = asyncio.Event()
+        self.overflowed = False
+        self.closed = False
+        # Ничего не отправлялось с прошлого тика пинга
+        self.idle = True
+
+    def push(self, frame: bytes) -> bool:
+        """False — буфер переполнен, подписчика нужно отключить"""
+        if len(self.buffer) >= self.limit:
+            self.overflowed = True
+            self.wakeup.set()
+            return False
+        self.buffer.append(frame)
+        self.wakeup.set()
+        return True
+
+    def drain(self) -> bytes:
+        chunk = b"".join(self.buffer)
+        self.buffer.clear()
+        self.wakeup.clear()
+        self.idle = False
+        return chunk
+
+
+class EventHub:
+    """Pub/sub событий магазина с историей для Last-Event-ID"""
+
+    def __init__(self, history: int = EVENTS_HISTORY, buffer: int = EVENTS_SUBSCRIBER_BUFFER,
+                 heartbeat: float = EVENTS_HEARTBEAT_SECONDS):
+        # ID событий разных запусков процесса не путаются: номер начинается заново
+        self.boot = format(int(time.time() * 1000), "x")
+        self.buffer = buffer
+        self.heartbeat = heartbeat
+        self._seq = 0
+        self._history: "deque[Event]" = deque(maxlen=history)
+        self._subscribers = set()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        self.stats = {"published": 0, "delivered": 0, "connected": 0, "resumed": 0, "reset": 0,
+                      "overflowed": 0, "peak_subscribers": 0}
+
+    def publish(self, event_type: str, data: dict) -> Event:
+        """Добавляет событие в историю и в буферы подписчиков (вызывать после коммита)"""
+        self._seq += 1
+        event = Event(self._seq, f"{self.boot}-{self._seq}", event_type, data)
+        self._history.append(event)
+        self.stats["published"] += 1
+        for subscriber in self._subscribers:
+            if not subscriber.overflowed and subscriber.push(event.frame):
+                self.stats["delivered"] += 1
+        return event
+
+    def _missed(self, last_event_id: str):
+        """События после last_event_id или None, если их уже не восстановить"""
+        boot, _, seq = last_event_id.partition("-")
+        if boot != self.boot or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if seq > self._seq:
+            return None
+        oldest = self._history[0].seq if self._history else self._seq + 1
+        if seq + 1 < oldest:
+            return None
+        return [event for event in self._history if event.seq > seq]
+
+    def _backlog(self, count: int):
+        return list(self._history)[-count:] if count > 0 else []
+
+    async def _heartbeat_loop(self):
+        """Один таймер на все ленты: будит тех, кому за интервал нечего было отправить.
+
+        Отдельный wait_for с таймаутом в каждой ленте создавал бы задачу и таймер на каждое
+        событие у каждого подписчика — лишний мусор при сотнях лент.
+        """
+        while self._subscribers:
+            await asyncio.sleep(self.heartbeat)
+            for subscriber in self._subscribers:
+                if subscriber.idle:
+                    subscriber.wakeup.set()
+                subscriber.idle = True
+        self._heartbeat_task = None
+
+    async def stream(self, last_event_id: Optional[str] = None, backlog: int = 0) -> AsyncIterator[bytes]:
+        """Кадры SSE для одного клиента: пропущенное (или backlog последних), затем новые события.
+
+        Завершается при переполнении буфера клиента и при close(); отключение клиента
+        отменяет генератор, подписка снимается в finally.
+        """
+        subscriber = Subscriber(self.buffer)
+        # Подписка и чтение истории — без await между ними: событие не потеряется и не задвоится
+        self._subscribers.add(subscriber)
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        self.stats["connected"] += 1
+        self.stats["peak_subscribers"] = max(self.stats["peak_subscribers"], len(self._subscribers))
+        if last_event_id:
+            missed = self._missed(last_event_id)
+            if missed is None:
+                self.stats["reset"] += 1
+                missed = [Event(self._seq, f"{self.boot}-{self._seq}", "reset", {})]
+            else:
+                self.stats["resumed"] += 1
+        else:
+            missed = self._backlog(backlog)
+        try:
+            # Первый кадр — текущий ID: клиент, не получивший ни одного события, тоже сможет догнать
+            head = f"retry: {EVENTS_RETRY_MS}\nid: {self.boot}-{self._seq}\n\n".encode()
+            yield head + b"".join(event.frame for event in missed)
+            while True:
+                await subscriber.wakeup.wait()
+                if subscriber.closed:
+                    return
+                chunk = subscriber.drain()
+                # Пусто — разбудил таймер пинга
+                yield chunk or HEARTBEAT_FRAME
+                if subscriber.overflowed:
+                    # Клиент переподключится с Last-Event-ID и догонит из истории
+                    self.stats["overflowed"] += 1
+                    return
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def close(self):
+        """Завершает все открытые потоки (остановка сервера)"""
+        for subscriber in self._subscribers:
+            subscriber.closed = True
+            subscriber.wakeup.set()
+
+    def report(self) -> dict:
+        return {
+            **self.stats,
+            "subscribers": len(self._subscribers),
+            "history": len(self._history),
+            "last_event_id": f"{self.boot}-{self._seq}" if self._seq else None,
+        }
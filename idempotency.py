@@ -0,0 +1,84 @@
+"""
+Идемпотентность оформления заказа.
+
+WebApp присылает с заказом заголовок Idempotency-Key — случайный ключ, один на попытку
+оформления: повторные нажатия «Оформить» и повторы после обрыва связи идут с тем же
+ключом. Ключ сохраняется в таблицу order_idempotency (PRIMARY KEY по ключу) в той же
+транзакции, что и заказ, поэтому «заказ записан, а ключ — нет» не бывает.
+
+Перед БД стоит LRU уже оформленных ключей: повтор получает номер заказа без обращения
+к БД и без второго сообщения в чат заказов. Одновременные запросы с одним ключом
+выстраиваются в очередь на блокировке ключа: второй ждёт, пока первый запишет заказ,
+и получает его номер. Между процессами (и после перезапуска, когда LRU пуст) повтор
+ловит проверка по таблице внутри той же транзакции записи.
+
+Ключи старше IDEMPOTENCY_TTL_HOURS удаляет задача обслуживания expire_idempotency_keys.
+"""
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+# Сколько часов повтор с тем же ключом возвращает тот же заказ
+IDEMPOTENCY_TTL_HOURS = float(os.environ.get("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_CACHE_SIZE = 10000
+
+_KEY_RE = re.compile(r"^[A-Za-z0-9_-]{8,128}$")
+
+
+def valid_key(key: str) -> bool:
+    return bool(_KEY_RE.match(key))
+
+
+class IdempotencyStore:
+    """LRU оформленных ключей и блокировки ключей, которые сейчас в работе"""
+
+    def __init__(self, cache_size: int = IDEMPOTENCY_CACHE_SIZE, ttl_hours: float = IDEMPOTENCY_TTL_HOURS):
+        self.cache_size = cache_size
+        self.ttl = ttl_hours * 3600
+        # ключ -> (номер заказа, время записи)
+        self._done: "OrderedDict[str, tuple]" = OrderedDict()
+        # ключ -> [блокировка, сколько запросов её держат или ждут]
+        self._locks: Dict[str, List] = {}
+        self.stats = {"memory_hits": 0, "db_hits": 0, "waited": 0}
+
+    def get(self, key: str) -> Optional[int]:
+        """Номер заказа, уже оформленного с этим ключом (None — ключ не встречался или устарел)"""
+        entry = self._done.get(key)
+        if entry is None:
+            return None
+        order_number, stored_at = entry
+        if time.time() - stored_at > self.ttl:
+            del self._done[key]
+            return None
+        self._done.move_to_end(key)
+        return order_number
+
+    def remember(self, key: str, order_number: int):
+        self._done[key] = (order_number, time.time())
+        self._done.move_to_end(key)
+        if len(self._done) > self.cache_size:
+            self._done.popitem(last=False)
+
+    @asynccontextmanager
+    async def lock(self, key: str):
+        """Один запрос с данным ключом за раз; остальные ждут и затем видят его результат"""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        elif entry[0].locked():
+            self.stats["waited"] += 1
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def report(self) -> dict:
+        return {**self.stats, "cached": len(self._done), "in_flight": len(self._locks)}
@@ -0,0 +1,93 @@
+"""
+Обработка загруженных изображений товаров.
+
+Большие JPEG не декодируются целиком: draft() заставляет декодер сразу выдать картинку,
+уменьшенную в 2/4/8 раз (DCT-масштабирование), затем reduce() быстро ужимает её целым
+коэффициентом, и только последний шаг делается качественным LANCZOS. Фото с телефона
+на 48 Мп так обрабатывается за доли секунды и ~10 МБ памяти вместо ~200 МБ.
+
+Заодно применяется EXIF-ориентация, удаляются метаданные (EXIF с геопозицией, XMP,
+комментарии) и отклоняются изображения с подозрительно большим числом пикселей.
+"""
+import os
+import warnings
+
+from PIL import Image, ImageOps
+
+# Оптимальный размер изображений товаров (по длинной стороне)
+IMAGE_MAX_SIZE = 800
+IMAGE_JPEG_QUALITY = 85
+# Ограничение на размер исходника в пикселях (защита от "бомб" распаковки)
+IMAGE_MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", str(64_000_000)))
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+
+# Pillow сам откажется открывать файлы больше 2 * MAX_IMAGE_PIXELS; предупреждение
+# между 1x и 2x не нужно — такие файлы отклоняются ниже с ImageTooLarge
+Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+
+_EXIF_ORIENTATION = 0x0112
+
+
+class ImageTooLarge(ValueError):
+    """Изображение превышает IMAGE_MAX_PIXELS"""
+
+
+def _target_size(w: int, h: int, max_size: int):
+    if w <= max_size and h <= max_size:
+        return w, h
+    if w > h:
+        return max_size, max(1, int(h * max_size / w))
+    return max(1, int(w * max_size / h)), max_size
+
+
+def resize_image_to_optimal(file_path: str, max_size: int = IMAGE_MAX_SIZE) -> bool:
+    """Уменьшает изображение до оптимального размера для карточки товара.
+
+    Возвращает True, если файл был перезаписан. Бросает ImageTooLarge для
+    слишком больших изображений и исключения Pillow для повреждённых файлов.
+    """
+    with Image.open(file_path) as img:
+        # Размер известен из заголовка, пиксели ещё не декодированы
+        w, h = img.size
+        if w * h > IMAGE_MAX_PIXELS:
+            raise ImageTooLarge(f"{w}x{h} больше допустимых {IMAGE_MAX_PIXELS} пикселей")
+
+        exif = img.getexif()
+        orientation = exif.get(_EXIF_ORIENTATION, 1)
+        has_metadata = bool(exif) or any(key in img.info for key in ("exif", "xmp", "XML:com.adobe.xmp", "comment"))
+        if w <= max_size and h <= max_size and not has_metadata:
+            return False
+
+        # Поворот на 90/270 градусов меняет местами стороны
+        swapped = orientation in (5, 6, 7, 8)
+        target_w, target_h = _target_size(h if swapped else w, w if swapped else h, max_size)
+        source_target = (target_h, target_w) if swapped else (target_w, target_h)
+
+        if img.format == "JPEG":
+            # Декодер сам уменьшит картинку в 2/4/8 раз, но не меньше запрошенного размера
+            img.draft("RGB", source_target)
+        img.load()
+        icc_profile = img.info.get("icc_profile")
+
+        # Дальше работаем с копией без метаданных
+        result = ImageOps.exif_transpose(img)
+
+    # Целочисленное уменьшение (box-фильтр) до ~2x от цели, затем качественный LANCZOS
+    factor = min(result.width // target_w, result.height // target_h) // 2
+    if factor >= 2:
+        result = result.reduce(factor)
+    if result.size != (target_w, target_h):
+        result = result.resize((target_w, target_h), Image.Resampling.LANCZOS)
+
+    ext = os.path.splitext(file_path)[1].lower()
+    save_kwargs = {"icc_profile": icc_profile} if icc_profile else {}
+    tmp_path = f"{file_path}.tmp"
+    if ext == ".png":
+        result.save(tmp_path, "PNG", optimize=True, **save_kwargs)
+    else:
+        if result.mode != "RGB":
+            result = result.convert("RGB")
+        result.save(tmp_path, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, **save_kwargs)
+    os.replace(tmp_path, file_path)
+    return True
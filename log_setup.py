@@ -0,0 +1,136 @@
+"""
+Неблокирующее логирование: записи кладутся в очередь, а форматирование и вывод
+выполняет фоновый поток (QueueListener). Поддерживается JSON-вывод, сквозной
+trace_id (ContextVar) для HTTP-запросов и обновлений Telegram и сэмплирование
+высокочастотных сообщений.
+
+Использование:
+    setup_logging()                                   # один раз при старте
+    logger.info("Заказ %s создан", order_id)          # форматирование — в фоне
+    logger.info("Обновление %s", update_id, extra=sampled())   # пишется лишь часть
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+# Идентификатор запроса/обновления, к которому относится запись лога
+trace_id_var: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+
+# Доля высокочастотных сообщений, которая попадает в лог (LOG_SAMPLE_RATE=0.1 — каждое десятое)
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.1"))
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def sampled(rate: Optional[float] = None) -> dict:
+    """extra для высокочастотных сообщений: в лог попадает только доля rate"""
+    return {"sample_rate": LOG_SAMPLE_RATE if rate is None else rate}
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не форматирует запись в потоке event loop.
+
+    Стандартный prepare() склеивает msg и args сразу при вызове logger.*; здесь
+    запись только дополняется trace_id, а форматирование выполняет поток-слушатель.
+    Очередь внутрипроцессная, поэтому сериализовать args не требуется.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.trace_id = trace_id_var.get()
+        return record
+
+
+class _SamplingFilter(logging.Filter):
+    """Отбрасывает часть записей, помеченных extra=sampled(); ошибки не сэмплируются"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample_rate", None)
+        if rate is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение, trace_id"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "trace_id"):
+            record.trace_id = None
+        record.trace = f" [{record.trace_id}]" if record.trace_id else ""
+        return super().format(record)
+
+
+def setup_logging(level: Optional[str] = None, fmt: Optional[str] = None):
+    """Настраивает корневой логгер на запись через очередь и фоновый поток.
+
+    LOG_LEVEL — уровень (по умолчанию INFO), LOG_FORMAT — json или text (по умолчанию json).
+    """
+    global _listener
+    level = (level or os.environ.get("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.environ.get("LOG_FORMAT", "json")).lower()
+
+    stream_handler = logging.StreamHandler()
+    if fmt == "text":
+        stream_handler.setFormatter(_TextFormatter('%(asctime)s - %(name)s - %(levelname)s%(trace)s - %(message)s'))
+    else:
+        stream_handler.setFormatter(JsonFormatter())
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = _ContextQueueHandler(log_queue)
+    queue_handler.addFilter(_SamplingFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    # uvicorn настраивает собственные обработчики — направляем его логи в общий поток
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Дописывает оставшиеся в очереди записи и останавливает фоновый поток"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
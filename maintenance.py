@@ -0,0 +1,299 @@
+"""
+Фоновое обслуживание SQLite: периодический планировщик задач внутри процесса.
+
+Задачи выполняются по одной в отдельном потоке (stdlib sqlite3), чтобы не блокировать
+event loop и не конкурировать друг с другом за блокировку БД:
+
+- wal_checkpoint      — PRAGMA wal_checkpoint(PASSIVE), не ждёт писателей;
+- optimize            — PRAGMA optimize (ANALYZE по необходимости);
+- incremental_vacuum  — возврат свободных страниц (если включён auto_vacuum=INCREMENTAL);
+- backup              — онлайн-копия через backup API небольшими шагами;
+- archive_orders      — перенос старых заказов в архивную БД порциями;
+- expire_idempotency_keys — удаление устаревших ключей идемпотентности заказов.
+
+Для каждой задачи хранится время последнего запуска, длительность, статус и ошибка.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+from idempotency import IDEMPOTENCY_TTL_HOURS
+
+logger = logging.getLogger(__name__)
+
+# Сколько страниц копировать за шаг онлайн-бэкапа и пауза между шагами:
+# между шагами писатели успевают закоммитить свои транзакции
+BACKUP_PAGES_PER_STEP = int(os.environ.get("BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP = float(os.environ.get("BACKUP_STEP_SLEEP", "0.005"))
+BACKUP_DIR = os.environ.get("BACKUP_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "backups"))
+BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", "7"))
+# Заказы старше стольких дней переносятся в архив (0 — не архивировать)
+ORDERS_ARCHIVE_DAYS = int(os.environ.get("ORDERS_ARCHIVE_DAYS", "365"))
+ARCHIVE_DB_PATH = os.environ.get("ARCHIVE_DB_PATH", "db_archive.sqlite3")
+ARCHIVE_CHUNK = 500
+INCREMENTAL_VACUUM_PAGES = 1000
+# Ожидание блокировки БД для служебных соединений, секунд
+BUSY_TIMEOUT = 5.0
+
+
+class Job:
+    """Периодическая задача и статистика её запусков"""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable[str]], initial_delay: float):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = time.monotonic() + initial_delay
+        self.runs = 0
+        self.last_started: Optional[str] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_status: Optional[str] = None
+        self.last_result: Optional[str] = None
+        self.last_error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "interval_s": self.interval,
+            "next_run_in_s": max(0, round(self.next_run - time.monotonic())),
+            "runs": self.runs,
+            "last_started": self.last_started,
+            "last_duration_ms": self.last_duration_ms,
+            "last_status": self.last_status,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+class MaintenanceScheduler:
+    """Простой планировщик: одна корутина, задачи выполняются последовательно"""
+
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def add(self, name: str, interval: float, func: Callable[[], Awaitable[str]], initial_delay: Optional[float] = None):
+        self.jobs[name] = Job(name, interval, func, interval if initial_delay is None else initial_delay)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_forever())
+            logger.info("🧹 Планировщик обслуживания запущен: %s", ", ".join(self.jobs))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run_forever(self):
+        while True:
+            now = time.monotonic()
+            due = [job for job in self.jobs.values() if job.next_run <= now]
+            for job in due:
+                await self.run_job(job.name)
+            upcoming = min((job.next_run for job in self.jobs.values()), default=now + 60)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(0.0, upcoming - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_job(self, name: str) -> dict:
+        """Выполняет задачу немедленно (вне расписания — тоже по одной за раз)"""
+        job = self.jobs[name]
+        async with self._lock:
+            job.last_started = datetime.now().isoformat(timespec="seconds")
+            start = time.perf_counter()
+            try:
+                job.last_result = await job.func()
+                job.last_status = "ok"
+                job.last_error = None
+            except Exception as e:
+                job.last_status = "error"
+                job.last_error = f"{type(e).__name__}: {e}"
+                logger.error("🧹 Задача обслуживания %s завершилась с ошибкой: %s", name, e, exc_info=True)
+            finally:
+                job.runs += 1
+                job.last_duration_ms = round((time.perf_counter() - start) * 1000, 1)
+                job.next_run = time.monotonic() + job.interval
+            if job.last_status == "ok":
+                logger.info("🧹 %s: %s (%.1f мс)", name, job.last_result, job.last_duration_ms)
+        return job.to_dict()
+
+    def report(self) -> dict:
+        return {name: job.to_dict() for name, job in self.jobs.items()}
+
+
+# --- ЗАДАЧИ ---
+
+@contextmanager
+def _connect(db_path: str):
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def wal_checkpoint(db_path: str) -> str:
+    with _connect(db_path) as conn:
+        busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+    return f"страниц в WAL: {log_pages}, перенесено: {checkpointed}, busy={busy}"
+
+
+def optimize(db_path: str) -> str:
+    with _connect(db_path) as conn:
+        # analysis_limit ограничивает ANALYZE выборкой строк — на больших таблицах это миллисекунды
+        conn.execute("PRAGMA analysis_limit=1000")
+        conn.execute("PRAGMA optimize")
+    return "PRAGMA optimize выполнен"
+
+
+def incremental_vacuum(db_path: str) -> str:
+    with _connect(db_path) as conn:
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if mode != 2:
+            return "пропущено: auto_vacuum не INCREMENTAL (для существующей БД включается однократным VACUUM)"
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute(f"PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES})").fetchall()
+        free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return f"освобождено страниц: {free_before - free_after}, осталось свободных: {free_after}"
+
+
+def backup(db_path: str, backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> str:
+    """Онлайн-копия БД. Backup API копирует по BACKUP_PAGES_PER_STEP страниц и отпускает
+    блокировку между шагами, поэтому запись в основную БД не останавливается."""
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    target = os.path.join(backup_dir, f"db-{stamp}.sqlite3")
+    tmp_target = target + ".tmp"
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+
+    with _connect(db_path) as src:
+        dst = sqlite3.connect(tmp_target)
+        try:
+            src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=progress, sleep=BACKUP_STEP_SLEEP)
+        finally:
+            dst.close()
+    os.replace(tmp_target, target)
+
+    backups = sorted(f for f in os.listdir(backup_dir) if f.startswith("db-") and f.endswith(".sqlite3"))
+    for old in backups[:-keep] if keep > 0 else []:
+        os.remove(os.path.join(backup_dir, old))
+    size_kb = os.path.getsize(target) // 1024
+    return f"{os.path.basename(target)}: {size_kb} КБ за {steps} шагов"
+
+
+def archive_orders(db_path: str, archive_path: str = ARCHIVE_DB_PATH, days: int = ORDERS_ARCHIVE_DAYS) -> str:
+    """Переносит заказы старше days дней в архивную БД порциями по ARCHIVE_CHUNK строк.
+    Каждая порция — отдельная короткая транзакция, чтобы не держать блокировку записи."""
+    if days <= 0:
+        return "пропущено: ORDERS_ARCHIVE_DAYS=0"
+    moved = 0
+    with _connect(db_path) as conn:
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        conn.execute("CREATE TABLE IF NOT EXISTS archive.orders AS SELECT * FROM main.orders WHERE 0")
+        # Новые колонки основной таблицы добавляем и в архив
+        main_columns = [row[1] for row in conn.execute("PRAGMA main.table_info(orders)")]
+        archive_columns = {row[1] for row in conn.execute("PRAGMA archive.table_info(orders)")}
+        for column in main_columns:
+            if column not in archive_columns:
+                conn.execute(f'ALTER TABLE archive.orders ADD COLUMN "{column}"')
+        columns = ", ".join(f'"{c}"' for c in main_columns)
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_id ON orders(id)")
+        # История заказов покупателя (/api/my-orders) читает и архив
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archive_orders_user_created ON orders(user_id, created_at)")
+
+        cutoff = f"-{days} days"
+        while True:
+            ids = [row[0] for row in conn.execute(
+                "SELECT id FROM main.orders WHERE created_at < datetime('now', ?) ORDER BY id LIMIT ?",
+                (cutoff, ARCHIVE_CHUNK)
+            )]
+            if not ids:
+                break
+            placeholders = ",".join("?" * len(ids))
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    f"INSERT INTO archive.orders({columns}) SELECT {columns} FROM main.orders "
+                    f"WHERE id IN ({placeholders}) AND id NOT IN (SELECT id FROM archive.orders WHERE id IN ({placeholders}))",
+                    (*ids, *ids)
+                )
+                conn.execute(f"DELETE FROM main.orders WHERE id IN ({placeholders})", ids)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            moved += len(ids)
+        conn.execute("DETACH DATABASE archive")
+    return f"перенесено в архив заказов: {moved} (старше {days} дн.)"
+
+
+def expire_idempotency_keys(db_path: str, hours: float = IDEMPOTENCY_TTL_HOURS) -> str:
+    """Удаляет ключи идемпотентности заказов старше hours часов порциями по ARCHIVE_CHUNK"""
+    deleted = 0
+    cutoff = f"-{hours} hours"
+    with _connect(db_path) as conn:
+        while True:
+            cur = conn.execute(
+                "DELETE FROM order_idempotency WHERE key IN ("
+                "SELECT key FROM order_idempotency WHERE created_at < datetime('now', ?) LIMIT ?)",
+                (cutoff, ARCHIVE_CHUNK)
+            )
+            if cur.rowcount <= 0:
+                break
+            deleted += cur.rowcount
+    return f"удалено ключей идемпотентности: {deleted} (старше {hours:g} ч)"
+
+
+async def expire_storage_keys(storage, hours: float = IDEMPOTENCY_TTL_HOURS) -> str:
+    """expire_idempotency_keys для внешнего бэкенда хранения (storage, PostgreSQL)"""
+    deleted = 0
+    while True:
+        count = await storage.write(lambda db: storage.orders.expire_keys(db, hours, ARCHIVE_CHUNK))
+        if count <= 0:
+            break
+        deleted += count
+    return f"удалено ключей идемпотентности: {deleted} (старше {hours:g} ч)"
+
+
+def create_scheduler(db_path: str, storage=None, archive_path: str = ARCHIVE_DB_PATH,
+                     backup_dir: str = BACKUP_DIR) -> MaintenanceScheduler:
+    """Планировщик со стандартным набором задач обслуживания БД.
+
+    storage — бэкенд хранения не на SQLite: заказы и ключи идемпотентности лежат в нём,
+    поэтому бэкап и архив заказов не запускаются, а ключи чистятся через storage.
+    Файл db_path (рассылки) обслуживается в любом случае.
+    """
+    scheduler = MaintenanceScheduler()
+
+    def threaded(func, *args):
+        async def run():
+            return await asyncio.to_thread(func, *args)
+        return run
+
+    hour = 3600
+    scheduler.add("wal_checkpoint", 5 * 60, threaded(wal_checkpoint, db_path))
+    scheduler.add("optimize", 6 * hour, threaded(optimize, db_path), initial_delay=60)
+    scheduler.add("incremental_vacuum", hour, threaded(incremental_vacuum, db_path), initial_delay=120)
+    if storage is not None:
+        async def expire_keys():
+            return await expire_storage_keys(storage)
+        scheduler.add("expire_idempotency_keys", hour, expire_keys, initial_delay=300)
+        return scheduler
+    scheduler.add("backup", float(os.environ.get("BACKUP_INTERVAL_HOURS", "24")) * hour,
+                  threaded(backup, db_path, backup_dir), initial_delay=180)
+    scheduler.add("archive_orders", 24 * hour, threaded(archive_orders, db_path, archive_path), initial_delay=240)
+    scheduler.add("expire_idempotency_keys", hour, threaded(expire_idempotency_keys, db_path), initial_delay=300)
+    return scheduler
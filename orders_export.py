@@ -0,0 +1,160 @@
+"""
+Выгрузка заказов за период для бухгалтерии: CSV или NDJSON.
+
+Заказы читаются одним курсором порциями (fetchmany), payload разбирается на лету, и
+наружу отдаются готовые текстовые фрагменты — в памяти не больше одной порции, сколько
+бы заказов ни было за период. Старые заказы, которые задача archive_orders перенесла
+в архивную БД, тоже попадают в выгрузку: сначала читается архив, затем основная БД.
+Снимки обеих БД берутся в начале выгрузки в одной транзакции чтения, поэтому порция,
+перенесённая в архив во время выгрузки, не пропадёт и не задвоится.
+
+Даты — в UTC, как created_at в БД.
+"""
+import csv
+import io
+import json
+import os
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+import aiosqlite
+
+# Сколько заказов читается из БД за раз
+EXPORT_CHUNK = 1000
+FORMATS = ("csv", "ndjson")
+CSV_DELIMITER = ";"
+
+CSV_COLUMNS = (
+    "id", "created_at", "user_id", "username", "full_name", "phone", "branch_id",
+    "delivery_type", "payment_method", "items_qty", "items", "total", "comment",
+)
+
+# Порядок, который даёт индекс без сортировки: в основной БД — idx_orders_created
+# (created_at, id), в архиве — индекс по id (заказы переносятся туда по возрастанию id)
+_SELECTS = {
+    "archive.orders": "SELECT id, created_at, user_id, payment_method, payload FROM archive.orders "
+                      "WHERE created_at >= ? AND created_at < ? ORDER BY id",
+    "main.orders": "SELECT id, created_at, user_id, payment_method, payload FROM main.orders "
+                   "WHERE created_at >= ? AND created_at < ? ORDER BY created_at, id",
+}
+
+
+class ExportPeriodError(ValueError):
+    """Период выгрузки задан неверно"""
+
+
+def _parse_day(value: str, end: bool) -> date:
+    """"2026-09-15" — день; "2026-09" — месяц (для конца периода — последний день месяца)"""
+    value = value.strip()
+    try:
+        if len(value) == 7:
+            month = datetime.strptime(value, "%Y-%m").date()
+            if not end:
+                return month
+            next_month = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+            return next_month - timedelta(days=1)
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise ExportPeriodError(f"Дата «{value}» — ожидается ГГГГ-ММ-ДД или ГГГГ-ММ")
+
+
+def parse_period(date_from: str, date_to: Optional[str] = None) -> Tuple[str, str]:
+    """Границы периода для WHERE created_at >= ? AND created_at < ? (обе даты включительно).
+
+    Без date_to период — один день или месяц из date_from.
+    """
+    start = _parse_day(date_from, end=False)
+    last_day = _parse_day(date_to or date_from, end=True)
+    if last_day < start:
+        raise ExportPeriodError("Конец периода раньше начала")
+    end = last_day + timedelta(days=1)
+    return f"{start.isoformat()} 00:00:00", f"{end.isoformat()} 00:00:00"
+
+
+def _order_record(row) -> dict:
+    order_id, created_at, user_id, payment_method, payload = row
+    try:
+        data = json.loads(payload)
+    except ValueError:
+        data = {}
+    return {
+        "id": order_id,
+        "created_at": created_at,
+        "user_id": user_id if user_id is not None else data.get("user_id"),
+        "username": data.get("username"),
+        "full_name": data.get("full_name"),
+        "phone": data.get("phone"),
+        "branch_id": data.get("branch_id"),
+        "delivery_type": data.get("delivery_type") or "pickup",
+        "payment_method": payment_method or data.get("payment_method") or "cash",
+        "items": data.get("items") or [],
+        "total": data.get("total"),
+        "comment": data.get("comment") or "",
+    }
+
+
+def format_csv(rows: Iterable[tuple], header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=CSV_DELIMITER, lineterminator="\r\n")
+    if header:
+        writer.writerow(CSV_COLUMNS)
+    for row in rows:
+        order = _order_record(row)
+        items = order["items"]
+        order["items_qty"] = sum(item.get("qty", 0) for item in items)
+        order["items"] = "; ".join(
+            f"{item.get('name')} ×{item.get('qty')} = {item.get('price', 0) * item.get('qty', 0)}" for item in items
+        )
+        writer.writerow(["" if order[column] is None else order[column] for column in CSV_COLUMNS])
+    return buffer.getvalue()
+
+
+def format_ndjson(rows: Iterable[tuple]) -> str:
+    return "".join(json.dumps(_order_record(row), ensure_ascii=False) + "\n" for row in rows)
+
+
+async def iter_sqlite_order_rows(db_path: str, archive_path: Optional[str], start: str, end: str,
+                                 chunk: int = EXPORT_CHUNK) -> AsyncIterator[List[tuple]]:
+    """Порции строк (id, created_at, user_id, payment_method, payload) заказов SQLite
+    с created_at в [start, end): сначала из архива, затем из основной БД"""
+    async with aiosqlite.connect(db_path) as db:
+        tables = ["main.orders"]
+        if archive_path and os.path.exists(archive_path):
+            await db.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+            cur = await db.execute("SELECT 1 FROM archive.sqlite_master WHERE type='table' AND name='orders'")
+            if await cur.fetchone():
+                tables.insert(0, "archive.orders")
+        # Один снимок на обе БД на всё время выгрузки (WAL: писателей это не блокирует).
+        # Снимок каждой БД фиксируется при первом чтении из неё — читаем обе сразу
+        await db.execute("BEGIN")
+        for table in tables:
+            async with db.execute(f"SELECT 1 FROM {table} LIMIT 1") as cur:
+                await cur.fetchone()
+        try:
+            for table in tables:
+                cur = await db.execute(_SELECTS[table], (start, end))
+                while True:
+                    rows = await cur.fetchmany(chunk)
+                    if not rows:
+                        break
+                    yield rows
+                await cur.close()
+        finally:
+            await db.rollback()
+
+
+async def iter_export_text(chunks: AsyncIterator[List[tuple]], fmt: str = "csv") -> AsyncIterator[str]:
+    """Текстовые фрагменты выгрузки из порций строк заказов (см. iter_sqlite_order_rows)"""
+    if fmt not in FORMATS:
+        raise ExportPeriodError(f"Формат «{fmt}» — ожидается csv или ndjson")
+    if fmt == "csv":
+        # BOM — чтобы Excel открыл файл в UTF-8
+        yield "\ufeff" + format_csv((), header=True)
+    async for rows in chunks:
+        yield format_csv(rows) if fmt == "csv" else format_ndjson(rows)
+
+
+def iter_orders_export(db_path: str, archive_path: Optional[str], start: str, end: str,
+                       fmt: str = "csv", chunk: int = EXPORT_CHUNK) -> AsyncIterator[str]:
+    """Текстовые фрагменты выгрузки заказов SQLite с created_at в [start, end)"""
+    return iter_export_text(iter_sqlite_order_rows(db_path, archive_path, start, end, chunk), fmt)
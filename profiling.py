@@ -0,0 +1,203 @@
+"""
+Инструменты диагностики работающего процесса (только для админов):
+
+- SamplingProfiler — сэмплирующий CPU-профайлер: фоновый поток раз в N мс снимает стек
+  потока event loop и копит "свёрнутые" стеки (формат collapsed/folded, который понимают
+  flamegraph.pl, speedscope и inferno);
+- LoopLagMonitor — измеряет задержку event loop и запоминает стеки медленных колбэков;
+- HeapSnapshots — снимки tracemalloc и разница между ними.
+
+В простое ничего не работает: профайлер и tracemalloc включаются по команде, а монитор
+задержек просыпается раз в секунду.
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter, deque
+from typing import Optional
+
+
+def _frame_stack(frame) -> str:
+    """Стек кадра в формате collapsed: "модуль:функция;модуль:функция" (от корня к листу)"""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        module = frame.f_globals.get("__name__", "?")
+        parts.append(f"{module}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+class SamplingProfiler:
+    """Сэмплирующий профайлер потока event loop"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._samples: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target_thread_id: Optional[int] = None
+        self.started_at: Optional[float] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, thread_id: Optional[int] = None, interval: Optional[float] = None):
+        if self.running:
+            raise RuntimeError("Профилирование уже запущено")
+        if interval:
+            self.interval = interval
+        self._samples.clear()
+        self._stop.clear()
+        self._target_thread_id = thread_id or threading.get_ident()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is not None:
+                self._samples[_frame_stack(frame)] += 1
+
+    def stop(self) -> str:
+        """Останавливает профилирование и возвращает стеки в формате collapsed"""
+        if not self.running:
+            raise RuntimeError("Профилирование не запущено")
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return "\n".join(f"{stack} {count}" for stack, count in self._samples.most_common()) + "\n"
+
+    def status(self) -> dict:
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "samples": sum(self._samples.values()),
+            "started_at": self.started_at,
+        }
+
+
+class LoopLagMonitor:
+    """Монитор задержки event loop.
+
+    Корутина внутри loop раз в interval обновляет отметку времени; сторожевой поток,
+    заметив, что отметка не обновлялась дольше threshold, снимает стек потока loop —
+    это и есть медленный колбэк, который блокирует обработку запросов.
+    """
+
+    def __init__(self, interval: float = 1.0, threshold: float = 0.1, keep: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=300)
+        self.slow_callbacks = deque(maxlen=keep)
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stop.set()
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.monotonic() - expected))
+
+    def _watch(self):
+        reported_heartbeat = None
+        while not self._stop.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled > self.threshold and heartbeat != reported_heartbeat:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    reported_heartbeat = heartbeat
+                    self.slow_callbacks.append({
+                        "at": time.time(),
+                        "blocked_ms": round(stalled * 1000, 1),
+                        "stack": "".join(traceback.format_stack(frame)),
+                    })
+
+    def report(self) -> dict:
+        lags = sorted(self.lags)
+        if lags:
+            summary = {
+                "samples": len(lags),
+                "p50_ms": round(lags[len(lags) // 2] * 1000, 2),
+                "p99_ms": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2),
+                "max_ms": round(lags[-1] * 1000, 2),
+            }
+        else:
+            summary = {"samples": 0}
+        return {
+            "running": self._task is not None,
+            "threshold_ms": self.threshold * 1000,
+            "lag": summary,
+            "slow_callbacks": list(self.slow_callbacks),
+        }
+
+
+class HeapSnapshots:
+    """Снимки кучи через tracemalloc: первый вызов включает трассировку, следующие
+    возвращают разницу с предыдущим снимком"""
+
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self._previous: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def snapshot(self, top: int = 25) -> dict:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._previous = tracemalloc.take_snapshot()
+            return {"status": "started", "message": "tracemalloc включён, следующий снимок покажет разницу"}
+
+        current = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        stats = current.compare_to(self._previous, "lineno")
+        self._previous = current
+        size, peak = tracemalloc.get_traced_memory()
+        return {
+            "status": "ok",
+            "traced_kb": size // 1024,
+            "peak_kb": peak // 1024,
+            "top": [
+                {
+                    "where": str(stat.traceback[0]) if stat.traceback else "?",
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "size_kb": round(stat.size / 1024, 1),
+                    "count_diff": stat.count_diff,
+                }
+                for stat in stats[:top]
+            ],
+        }
+
+    def stop(self) -> dict:
+        tracemalloc.stop()
+        self._previous = None
+        return {"status": "stopped"}
@@ -0,0 +1,81 @@
+"""
+Ограничители частоты для исходящих запросов к Telegram.
+
+- TokenBucket — "ведро токенов": не больше rate запросов в секунду в среднем
+  и не больше capacity подряд;
+- TelegramRateLimiter — общий лимит бота (Telegram допускает ~30 сообщений в секунду)
+  плюс минимальный интервал между сообщениями в один чат; по ответу 429 (retry_after)
+  все отправки приостанавливаются на указанное время.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class TokenBucket:
+    """Ведро токенов для asyncio: acquire() ждёт, пока токен не появится"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Забирает токен без ожидания; False, если ведро пусто"""
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def wait_time(self, tokens: float = 1.0) -> float:
+        """Через сколько секунд в ведре наберётся tokens токенов"""
+        self._refill()
+        return max(0.0, (tokens - self._tokens) / self.rate)
+
+    async def acquire(self, tokens: float = 1.0):
+        # Lock сохраняет очерёдность ожидающих: никто не обгонит того, кто ждёт дольше
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class TelegramRateLimiter:
+    """Общий и початовый лимиты отправки сообщений ботом"""
+
+    def __init__(self, global_rate: float = 25.0, per_chat_interval: float = 1.0, max_chats: int = 10_000):
+        self.bucket = TokenBucket(global_rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_chats = max_chats
+        # chat_id -> время последней отправки (monotonic); старые чаты вытесняются
+        self._last_sent: "OrderedDict[int, float]" = OrderedDict()
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        """Приостанавливает все отправки (Telegram ответил 429 с retry_after)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def wait(self, chat_id: int):
+        """Ждёт, пока отправка в chat_id не уложится во все лимиты"""
+        while True:
+            now = time.monotonic()
+            delay = self._paused_until - now
+            last = self._last_sent.get(chat_id)
+            if last is not None:
+                delay = max(delay, last + self.per_chat_interval - now)
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        await self.bucket.acquire()
+        self._last_sent[chat_id] = time.monotonic()
+        self._last_sent.move_to_end(chat_id)
+        while len(self._last_sent) > self.max_chats:
+            self._last_sent.popitem(last=False)
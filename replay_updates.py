@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Воспроизведение журнала обновлений Telegram (UPDATE_LOG_PATH, см. update_log.py).
+
+Обновления из NDJSON-файла подаются в dp.feed_update бота с заглушкой вместо Bot API:
+вызовы Telegram не уходят в сеть, а получают правдоподобный ответ (сообщение, файл,
+True). Темп — как в записи (1x), в N раз быстрее или без пауз (max). Обновления одного
+чата обрабатываются строго по очереди, как у живого бота, разные чаты — параллельно.
+
+Бот работает на временной копии БД: пустой или скопированной из --db (исходный файл
+не меняется). Фото, скачанные обработчиками, пишутся во временный UPLOAD_DIR, а не в uploads/.
+
+Отчёт: задержка обработки по видам обновлений (команда, состояние FSM, callback_data
+без чисел) — p50/p95/p99/максимум, ошибки обработчиков, вызовы Bot API, отставание от
+темпа записи. --json сохраняет отчёт для сравнения прогонов; при ошибках код выхода 1.
+
+Запуск: python replay_updates.py updates.ndjson [--speed 1|10|max] [--db db.sqlite3]
+        [--shop магазин] [--as-admin] [--api-latency-ms 50] [--json report.json]
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import traceback
+from collections import Counter, defaultdict
+
+from update_log import read_updates
+
+REPLAY_TOKEN = "123456:REPLAY-TOKEN-NOT-VALID"
+# Сколько трассировок каждой ошибки показывать
+MAX_TRACEBACKS = 3
+
+
+def _fake_photo() -> bytes:
+    """Небольшой JPEG — содержимое «скачанных» из Telegram файлов"""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (320, 240), (90, 120, 150)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+def make_stub_session(latency: float = 0.0):
+    """Сессия Bot API без сети: ответ собирается из параметров запроса и проходит
+    ту же проверку, что ответ Telegram (BaseSession.check_response)"""
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import File, Message, User, WebhookInfo
+
+    class StubSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.calls = Counter()
+            self.photo = _fake_photo()
+            self._message_id = 0
+
+        def _message(self, method) -> dict:
+            self._message_id += 1
+            chat_id = getattr(method, "chat_id", None)
+            chat = ({"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}
+                    if isinstance(chat_id, int) else {"id": -1000000000001, "type": "channel"})
+            message = {"message_id": getattr(method, "message_id", None) or self._message_id,
+                       "date": int(time.time()), "chat": chat}
+            text = getattr(method, "text", None) or getattr(method, "caption", None)
+            if text:
+                message["text" if hasattr(method, "text") else "caption"] = text
+            if getattr(method, "photo", None) is not None:
+                message["photo"] = [{"file_id": f"replay-photo-{self._message_id}",
+                                     "file_unique_id": f"replay-{self._message_id}", "width": 320, "height": 240}]
+            if getattr(method, "document", None) is not None:
+                message["document"] = {"file_id": f"replay-doc-{self._message_id}",
+                                       "file_unique_id": f"replay-doc-{self._message_id}"}
+            return message
+
+        def _result(self, bot, method):
+            returning = method.__returning__
+            kinds = getattr(returning, "__args__", (returning,))
+            if Message in kinds:
+                return self._message(method)
+            if File in kinds:
+                return {"file_id": method.file_id, "file_unique_id": f"replay-{method.file_id[-16:]}",
+                        "file_size": len(self.photo), "file_path": f"photos/{method.file_id[-16:]}.jpg"}
+            if User in kinds:
+                return {"id": bot.id, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+            if WebhookInfo in kinds:
+                return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+            if getattr(returning, "__origin__", None) is list:
+                return []
+            return True
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls[type(method).__name__] += 1
+            if latency:
+                await asyncio.sleep(latency)
+            content = self.json_dumps({"ok": True, "result": self._result(bot, method)})
+            return self.check_response(bot=bot, method=method, status_code=200, content=content).result
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            self.calls["download"] += 1
+            yield self.photo
+
+        async def close(self):
+            pass
+
+    return StubSession()
+
+
+def _chat_key(update: dict):
+    """Чат, в котором обновления обрабатываются по очереди"""
+    for kind in ("message", "edited_message", "callback_query", "inline_query", "my_chat_member"):
+        event = update.get(kind)
+        if event is None:
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat") or {}
+        return chat.get("id") or (event.get("from") or {}).get("id")
+    return None
+
+
+def _ids(update: dict):
+    """(chat_id, user_id) для чтения состояния FSM"""
+    for kind in ("message", "edited_message", "callback_query"):
+        event = update.get(kind)
+        if event is not None:
+            user_id = (event.get("from") or {}).get("id")
+            chat_id = ((event.get("chat") or (event.get("message") or {}).get("chat") or {}).get("id")
+                       or user_id)
+            return chat_id, user_id
+    return None, None
+
+
+def classify(update: dict, state) -> str:
+    """Вид обновления для отчёта: команда, callback_data без чисел, содержимое сообщения и состояние FSM"""
+    if "callback_query" in update:
+        return "callback " + re.sub(r"\d+", "N", update["callback_query"].get("data") or "")
+    if "inline_query" in update:
+        return "inline_query"
+    message = update.get("message") or update.get("edited_message")
+    if message is None:
+        kinds = [key for key in update if key != "update_id"]
+        return kinds[0] if kinds else "empty"
+    text = message.get("text") or ""
+    if text.startswith("/"):
+        kind = "message " + text.split()[0].split("@")[0]
+    elif "photo" in message:
+        kind = "message photo"
+    elif "document" in message:
+        kind = "message document"
+    elif text:
+        kind = "message text"
+    else:
+        kind = "message other"
+    return f"{kind} [{state}]" if state else kind
+
+
+def _ms(values, q: float) -> float:
+    if len(values) == 1:
+        return values[0] * 1000
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1] * 1000
+
+
+async def replay(records, speed: float, as_admin: bool, api_latency: float) -> dict:
+    import bot
+    from aiogram.types import Update
+    from tenants import current_shop
+
+    shop = bot.shops.default
+    current_shop.set(shop)
+    session = make_stub_session(api_latency)
+    shop.bot.session = session
+    await bot.init_db()
+    shop.initialized = True
+    if as_admin:
+        shop.admin_ids.update(
+            user_id for r in records if (user_id := _ids(r["update"])[1]) is not None)
+
+    latencies = defaultdict(list)
+    errors = Counter()
+    tracebacks = defaultdict(list)
+    lags = []
+    last_in_chat = {}
+    first_ts = records[0]["ts"] if records else 0
+    start = time.perf_counter()
+
+    async def process(update: dict, previous):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        chat_id, user_id = _ids(update)
+        state = None
+        if user_id is not None:
+            state = await bot.dp.fsm.get_context(shop.bot, chat_id=chat_id, user_id=user_id).get_state()
+        kind = classify(update, state)
+        started = time.perf_counter()
+        try:
+            await bot.dp.feed_update(shop.bot, Update.model_validate(update, context={"bot": shop.bot}))
+        except Exception as e:
+            error = f"{kind}: {type(e).__name__}"
+            errors[error] += 1
+            if len(tracebacks[error]) < MAX_TRACEBACKS:
+                tracebacks[error].append(traceback.format_exc())
+        latencies[kind].append(time.perf_counter() - started)
+
+    tasks = []
+    for record in records:
+        if speed > 0:
+            target = (record["ts"] - first_ts) / speed
+            delay = target - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            lags.append(max(0.0, time.perf_counter() - start - target))
+        update = record["update"]
+        chat = _chat_key(update)
+        task = asyncio.create_task(process(update, last_in_chat.get(chat)))
+        if chat is not None:
+            last_in_chat[chat] = task
+        tasks.append(task)
+    await asyncio.gather(*tasks)
+    # Фоновые задачи обработчиков (скачивание фото, отложенные уведомления)
+    await asyncio.gather(*list(bot._background_tasks), return_exceptions=True)
+    wall = time.perf_counter() - start
+
+    report = {
+        "updates": len(records),
+        "wall_s": round(wall, 3),
+        "updates_per_s": round(len(records) / wall, 1) if wall else None,
+        "errors": sum(errors.values()),
+        "handlers": {
+            kind: {"count": len(values), "p50_ms": round(_ms(values, 50), 2), "p95_ms": round(_ms(values, 95), 2),
+                   "p99_ms": round(_ms(values, 99), 2), "max_ms": round(max(values) * 1000, 2),
+                   "total_ms": round(sum(values) * 1000, 1)}
+            for kind, values in sorted(latencies.items(), key=lambda item: -sum(item[1]))
+        },
+        "error_kinds": dict(errors),
+        "api_calls": dict(session.calls.most_common()),
+    }
+    if lags:
+        report["schedule_lag_p95_ms"] = round(_ms(lags, 95), 2)
+    report["tracebacks"] = {error: items for error, items in tracebacks.items()}
+    await shop.storage.close()
+    return report
+
+
+def print_report(report: dict, speed_label: str):
+    print(f"Обновлений: {report['updates']} ({speed_label}), за {report['wall_s']} с, "
+          f"{report['updates_per_s']} обновлений/с, ошибок: {report['errors']}")
+    if "schedule_lag_p95_ms" in report:
+        print(f"Отставание от темпа записи (p95): {report['schedule_lag_p95_ms']} мс")
+    print(f"\n{'вид обновления':<48} {'кол-во':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'макс':>9}  (мс)")
+    for kind, h in report["handlers"].items():
+        print(f"{kind[:48]:<48} {h['count']:>7} {h['p50_ms']:>9.2f} {h['p95_ms']:>9.2f} "
+              f"{h['p99_ms']:>9.2f} {h['max_ms']:>9.2f}")
+    if report["api_calls"]:
+        print("\nВызовы Bot API: " + ", ".join(f"{name} {count}" for name, count in report["api_calls"].items()))
+    if report["error_kinds"]:
+        print("\n❌ Ошибки обработчиков:")
+        for error, count in report["error_kinds"].items():
+            print(f"  {error} — {count}")
+            for tb in report["tracebacks"].get(error, [])[:1]:
+                print("    " + tb.rstrip().replace("\n", "\n    "))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение журнала обновлений Telegram")
+    parser.add_argument("path", help="NDJSON-файл журнала (UPDATE_LOG_PATH)")
+    parser.add_argument("--speed", default="1", help="темп: 1 — как в записи, N — в N раз быстрее, max — без пауз")
+    parser.add_argument("--db", help="БД SQLite с каталогом; прогон идёт на её временной копии")
+    parser.add_argument("--shop", help="воспроизвести только обновления этого магазина")
+    parser.add_argument("--as-admin", action="store_true", help="считать всех пользователей журнала администраторами")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="задержка ответа заглушки Bot API")
+    parser.add_argument("--json", help="сохранить отчёт в JSON")
+    parser.add_argument("--verbose", action="store_true", help="логи бота уровня INFO")
+    args = parser.parse_args()
+    speed = 0.0 if args.speed == "max" else float(args.speed)
+
+    records = [r for r in read_updates(args.path) if args.shop is None or r.get("shop") == args.shop]
+    records.sort(key=lambda r: r["ts"])
+
+    # Окружение бота задаётся до импорта bot.py: временная БД, один магазин, без журнала
+    tmp_dir = tempfile.mkdtemp(prefix="replay_updates_")
+    db_path = os.path.join(tmp_dir, "replay.sqlite3")
+    if args.db:
+        shutil.copyfile(args.db, db_path)
+    os.environ.update(
+        DB_PATH=db_path, ARCHIVE_DB_PATH=os.path.join(tmp_dir, "replay_archive.sqlite3"),
+        UPLOAD_DIR=os.path.join(tmp_dir, "uploads"),
+        DATABASE_URL="", TENANTS_FILE="", UPDATE_LOG_PATH="", BOT_TOKEN=REPLAY_TOKEN,
+        LOG_LEVEL="INFO" if args.verbose else "WARNING",
+    )
+    try:
+        report = asyncio.run(replay(records, speed, args.as_admin, args.api_latency_ms / 1000))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print_report(report, "без пауз" if speed == 0 else f"{speed:g}x")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    sys.exit(1 if report["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+In-memory индекс для поиска товаров (inline-режим бота).
+
+Каждый активный товар разбивается на токены (бренд, модель, "205", "55", "r", "16", ...);
+для каждого токена хранится множество id товаров, а отсортированный список токенов
+позволяет искать по префиксу через bisect. Индекс обновляется инкрементально при
+изменении отдельных товаров, полная перестройка нужна только при старте.
+"""
+import re
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from tire_specs import brand_aliases, parse_tire_attrs
+
+_TOKEN_RE = re.compile(r"\d+(?:[.,]5)?|[^\W\d_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает строку на токены: '205/55 R16' -> ['205', '55', 'r', '16']"""
+    return [t.replace(",", ".") for t in _TOKEN_RE.findall((text or "").lower().replace("ё", "е"))]
+
+
+class ProductSearchIndex:
+    """Токенный индекс с поиском по префиксу и постраничной выдачей"""
+
+    def __init__(self):
+        self._docs: Dict[int, dict] = {}
+        self._doc_tokens: Dict[int, Set[str]] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._sorted_tokens: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def clear(self):
+        self._docs.clear()
+        self._doc_tokens.clear()
+        self._postings.clear()
+        self._sorted_tokens.clear()
+
+    @staticmethod
+    def _product_tokens(product: dict) -> Set[str]:
+        specs = product.get("specs") or []
+        tokens = set(tokenize(" ".join([product.get("name") or "", *specs])))
+        # Бренд добавляем во всех написаниях: "мишлен" находит Michelin и наоборот
+        brand = parse_tire_attrs(product.get("name") or "", specs)["brand"]
+        if brand:
+            tokens.update(tokenize(" ".join((brand, *brand_aliases(brand)))))
+        return tokens
+
+    def upsert(self, product: dict):
+        """Добавляет или обновляет товар (dict с id, name, price, specs, ...)"""
+        product_id = product["id"]
+        new_tokens = self._product_tokens(product)
+        old_tokens = self._doc_tokens.get(product_id, set())
+        for token in old_tokens - new_tokens:
+            self._unlink(token, product_id)
+        for token in new_tokens - old_tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                insort(self._sorted_tokens, token)
+            postings.add(product_id)
+        self._docs[product_id] = product
+        self._doc_tokens[product_id] = new_tokens
+
+    def get(self, product_id: int) -> Optional[dict]:
+        """Документ активного товара по id (None — товара нет или он скрыт)"""
+        return self._docs.get(product_id)
+
+    def remove(self, product_id: int):
+        for token in self._doc_tokens.pop(product_id, ()):
+            self._unlink(token, product_id)
+        self._docs.pop(product_id, None)
+
+    def _unlink(self, token: str, product_id: int):
+        postings = self._postings.get(token)
+        if postings is None:
+            return
+        postings.discard(product_id)
+        if not postings:
+            del self._postings[token]
+            i = bisect_left(self._sorted_tokens, token)
+            if i < len(self._sorted_tokens) and self._sorted_tokens[i] == token:
+                del self._sorted_tokens[i]
+
+    def _match(self, token: str, prefix: bool) -> Set[int]:
+        if not prefix:
+            return self._postings.get(token, set())
+        matched: Set[int] = set()
+        i = bisect_left(self._sorted_tokens, token)
+        while i < len(self._sorted_tokens) and self._sorted_tokens[i].startswith(token):
+            matched |= self._postings[self._sorted_tokens[i]]
+            i += 1
+        return matched
+
+    def search(self, query: str, offset: int = 0, limit: int = 20) -> Tuple[List[dict], Optional[int]]:
+        """Ищет товары, содержащие все слова запроса.
+
+        Слова ищутся по префиксу; числа — точно, кроме последнего (его ещё набирают).
+        Одиночные буквы ("R" в "R16") игнорируются. Возвращает (страница, next_offset).
+        """
+        tokens = [t for t in tokenize(query) if len(t) > 1 or t.isdigit()]
+        if not tokens:
+            ids: Iterable[int] = self._docs.keys()
+        else:
+            candidates = []
+            for i, token in enumerate(tokens):
+                prefix = not token[0].isdigit() or i == len(tokens) - 1
+                candidates.append(self._match(token, prefix))
+            candidates.sort(key=len)
+            ids = candidates[0].intersection(*candidates[1:])
+
+        # Новые товары первыми, как в каталоге WebApp
+        ordered = sorted(ids, reverse=True)
+        page = [self._docs[i] for i in ordered[offset:offset + limit]]
+        next_offset = offset + limit if offset + limit < len(ordered) else None
+        return page, next_offset
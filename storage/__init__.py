@@ -0,0 +1,36 @@
+"""
+Слой хранения данных магазина: товары, остатки, заказы, администраторы.
+
+Обработчики bot.py не пишут SQL сами, а вызывают репозитории storage.products,
+storage.stock, storage.orders, storage.admins внутри storage.write(op) (транзакция)
+или storage.read() (соединение для чтения) — подробнее в storage/base.py.
+
+Бэкенд выбирается переменной DATABASE_URL:
+- не задана — SQLite в файле DB_PATH, записи через одного писателя с групповым коммитом;
+- postgresql://пользователь:пароль@хост/база — PostgreSQL через пул asyncpg (DB_POOL_SIZE).
+
+Служебные данные процесса (рассылки, задачи обслуживания SQLite, архив заказов)
+остаются в файле SQLite при любом бэкенде.
+"""
+import os
+from typing import Optional
+
+from storage.base import Connection, IntegrityError, Storage
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "")
+
+__all__ = ["Connection", "DATABASE_URL", "IntegrityError", "Storage", "open_storage"]
+
+
+def open_storage(url: str, sqlite_path: str, archive_path: Optional[str] = None,
+                 schema: Optional[str] = None) -> Storage:
+    """PostgresStorage для postgresql://-адреса, иначе SQLiteStorage для файла sqlite_path.
+    schema — схема PostgreSQL для таблиц (у каждого магазина процесса своя)"""
+    if url:
+        if not url.startswith(("postgresql://", "postgres://")):
+            raise ValueError(f"DATABASE_URL: поддерживается только postgresql://, получено {url.split(':', 1)[0]}://")
+        # asyncpg нужен только для PostgreSQL
+        from storage.postgres import PostgresStorage
+        return PostgresStorage(url, schema=schema)
+    from storage.sqlite import SQLiteStorage
+    return SQLiteStorage(sqlite_path, archive_path)
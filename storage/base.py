@@ -0,0 +1,363 @@
+"""
+Общая часть слоя хранения: интерфейс соединения, исключения и репозитории.
+
+Репозитории не хранят состояния и не открывают соединений сами: каждый метод получает
+соединение db (Connection), а транзакцию вокруг вызовов задаёт Storage:
+
+    async def op(db):
+        quote = await storage.products.cart_catalog(db, ids)
+        return await storage.orders.create(db, user_id, payload, "cash")
+
+    order_id = await storage.write(op)          # одна транзакция
+    async with storage.read() as db:            # чтение без транзакции записи
+        product = await storage.products.get(db, product_id)
+
+SQL в репозиториях один на оба бэкенда: параметры — «?» (PostgreSQL-соединение
+переписывает их в $1, $2, ...), INSERT ... ON CONFLICT и RETURNING поддерживают обе
+СУБД. То немногое, что различается (текущее время, сравнение с NULL, тип метки
+времени в параметрах), даёт само соединение.
+
+Строки возвращаются словарями, метки времени — строками «ГГГГ-ММ-ДД ЧЧ:ММ:СС» (UTC),
+как их хранит SQLite.
+"""
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Колонки товара в порядке выгрузки каталога (catalog_io.EXPORT_COLUMNS)
+EXPORT_COLUMNS = "id, sku, name, price, image, description, specs, active"
+PRODUCT_COLUMNS = ("id, sku, name, price, image, description, specs, active, "
+                   "image_file_id, image_file_unique_id, created_at")
+ATTR_COLUMNS = "width, profile, rim, season, brand, active"
+
+
+class IntegrityError(Exception):
+    """Нарушено ограничение БД (уникальный артикул, остаток меньше нуля и т.п.)"""
+
+
+class Connection:
+    """Соединение, которое получают методы репозиториев"""
+
+    dialect = ""
+    # SQL-выражение «сейчас» в UTC
+    now = "CURRENT_TIMESTAMP"
+
+    async def fetch(self, sql: str, args: Sequence = ()) -> List[dict]:
+        raise NotImplementedError
+
+    async def fetchrow(self, sql: str, args: Sequence = ()) -> Optional[dict]:
+        rows = await self.fetch(sql, args)
+        return rows[0] if rows else None
+
+    async def fetchval(self, sql: str, args: Sequence = ()) -> Any:
+        row = await self.fetchrow(sql, args)
+        return next(iter(row.values())) if row else None
+
+    async def execute(self, sql: str, args: Sequence = ()) -> int:
+        """Выполняет запрос, возвращает число затронутых строк"""
+        raise NotImplementedError
+
+    async def executemany(self, sql: str, rows: Iterable[Sequence]):
+        raise NotImplementedError
+
+    def since(self, hours: float) -> str:
+        """SQL-выражение «hours часов назад» (UTC)"""
+        raise NotImplementedError
+
+    def same(self, column: str) -> str:
+        """Условие «column равна параметру», где NULL равен NULL"""
+        raise NotImplementedError
+
+    def timestamp(self, value: str) -> Any:
+        """Параметр запроса из метки времени «ГГГГ-ММ-ДД ЧЧ:ММ:СС»"""
+        return value
+
+
+WriteOp = Callable[[Connection], Awaitable[Any]]
+
+
+def _marks(values: Sequence) -> str:
+    return ",".join("?" * len(values))
+
+
+class ProductRepository:
+    """Товары и их разобранные характеристики (product_attrs)"""
+
+    async def get(self, db: Connection, product_id: int) -> Optional[dict]:
+        return await db.fetchrow(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id=?", (product_id,))
+
+    async def get_many(self, db: Connection, ids: Sequence[int]) -> Dict[int, dict]:
+        rows = await db.fetch(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id IN ({_marks(ids)})", ids)
+        return {row["id"]: row for row in rows}
+
+    async def recent(self, db: Connection, limit: int) -> List[dict]:
+        return await db.fetch(f"SELECT {PRODUCT_COLUMNS} FROM products ORDER BY id DESC LIMIT ?", (limit,))
+
+    async def active(self, db: Connection) -> List[dict]:
+        return await db.fetch(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE active=1")
+
+    async def list(self, db: Connection, filters: Dict[str, Any], include_inactive: bool = False,
+                   limit: Optional[int] = None, offset: int = 0) -> List[dict]:
+        """Каталог, новые первыми. filters — {колонка product_attrs: значение}"""
+        page = " LIMIT ? OFFSET ?" if limit is not None else ""
+        page_args = (limit, offset) if limit is not None else ()
+        columns = ", ".join(f"p.{column.strip()}" for column in PRODUCT_COLUMNS.split(","))
+        if filters:
+            conditions = [f"a.{field}=?" for field in filters]
+            if not include_inactive:
+                conditions.insert(0, "a.active=1")
+            return await db.fetch(
+                f"SELECT {columns} FROM product_attrs a JOIN products p ON p.id = a.product_id "
+                f"WHERE {' AND '.join(conditions)} ORDER BY a.product_id DESC{page}",
+                (*filters.values(), *page_args)
+            )
+        where = "" if include_inactive else " WHERE active=1"
+        return await db.fetch(f"SELECT {PRODUCT_COLUMNS} FROM products{where} ORDER BY id DESC{page}", page_args)
+
+    async def cart_catalog(self, db: Connection, ids: Sequence[int]) -> Dict[int, dict]:
+        """Цены и названия активных товаров из ids — одним запросом"""
+        rows = await db.fetch(f"SELECT id, name, price FROM products WHERE active=1 AND id IN ({_marks(ids)})", ids)
+        return {row["id"]: {"name": row["name"], "price": row["price"]} for row in rows}
+
+    async def create(self, db: Connection, name: str, price: int, image: str, description: str, specs: str,
+                     image_file_id: Optional[str] = None, image_file_unique_id: Optional[str] = None) -> int:
+        return await db.fetchval(
+            "INSERT INTO products(name, price, image, description, specs, image_file_id, image_file_unique_id) "
+            "VALUES(?,?,?,?,?,?,?) RETURNING id",
+            (name, price, image, description, specs, image_file_id, image_file_unique_id)
+        )
+
+    async def set_active(self, db: Connection, product_id: int, active: bool) -> bool:
+        return await db.execute("UPDATE products SET active=? WHERE id=?", (1 if active else 0, product_id)) > 0
+
+    async def toggle_active(self, db: Connection, product_id: int) -> Optional[int]:
+        """Скрывает активный товар или возвращает скрытый; новый статус или None, если товара нет"""
+        return await db.fetchval("UPDATE products SET active = 1 - active WHERE id=? RETURNING active", (product_id,))
+
+    async def set_photo(self, db: Connection, product_id: int, file_id: str, file_unique_id: str):
+        await db.execute("UPDATE products SET image_file_id=?, image_file_unique_id=? WHERE id=?",
+                         (file_id, file_unique_id, product_id))
+
+    async def uploaded_images(self, db: Connection) -> List[dict]:
+        """Ссылки товаров на загруженные фото (image, active, image_file_id) — для сборки мусора uploads/"""
+        return await db.fetch(
+            "SELECT image, active, image_file_id FROM products WHERE image LIKE '/api/uploads/%'")
+
+    async def file_id_for_image(self, db: Connection, image: str) -> Optional[str]:
+        return await db.fetchval(
+            "SELECT image_file_id FROM products WHERE image=? AND image_file_id IS NOT NULL LIMIT 1", (image,))
+
+    async def ids_by_sku(self, db: Connection, skus: Sequence[str]) -> Dict[str, int]:
+        rows = await db.fetch(f"SELECT sku, id FROM products WHERE sku IN ({_marks(skus)})", skus)
+        return {row["sku"]: row["id"] for row in rows}
+
+    async def existing_ids(self, db: Connection, ids: Sequence[int]) -> set:
+        rows = await db.fetch(f"SELECT id FROM products WHERE id IN ({_marks(ids)})", ids)
+        return {row["id"] for row in rows}
+
+    async def update_many(self, db: Connection, columns: Sequence[str], rows: List[tuple]):
+        """Обновление товаров пачкой. Строка — (sku или None, [image, image,] *значения columns, id):
+        артикул меняется, только если задан; кэш file_id сбрасывается, только если фото другое"""
+        assignments = ["sku = COALESCE(?, sku)"]
+        if "image" in columns:
+            assignments += [
+                f"image_file_id = CASE WHEN {db.same('image')} THEN image_file_id END",
+                f"image_file_unique_id = CASE WHEN {db.same('image')} THEN image_file_unique_id END",
+            ]
+        assignments += [f"{column} = ?" for column in columns]
+        await db.executemany(f"UPDATE products SET {', '.join(assignments)} WHERE id = ?", rows)
+
+    async def upsert_by_sku(self, db: Connection, columns: Sequence[str], rows: List[tuple]) -> List[int]:
+        """Добавление товаров пачкой; строка — (sku, *значения columns). Повтор артикула
+        обновляет уже существующий товар. Возвращает id товаров с этими артикулами"""
+        await db.executemany(
+            f"INSERT INTO products(sku, {', '.join(columns)}) VALUES(?{', ?' * len(columns)}) "
+            f"ON CONFLICT(sku) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns)}",
+            rows
+        )
+        skus = list({row[0] for row in rows})
+        return list((await self.ids_by_sku(db, skus)).values())
+
+    async def export_page(self, db: Connection, after_id: int, limit: int) -> List[tuple]:
+        """Страница выгрузки каталога по возрастанию id (keyset): кортежи EXPORT_COLUMNS"""
+        rows = await db.fetch(
+            f"SELECT {EXPORT_COLUMNS} FROM products WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit))
+        return [tuple(row.values()) for row in rows]
+
+    # --- product_attrs ---
+
+    async def attrs(self, db: Connection, ids: Sequence[int]) -> Dict[int, tuple]:
+        """{product_id: (width, profile, rim, season, brand, active)}"""
+        rows = await db.fetch(
+            f"SELECT product_id, {ATTR_COLUMNS} FROM product_attrs WHERE product_id IN ({_marks(ids)})", ids)
+        return {row.pop("product_id"): tuple(row.values()) for row in rows}
+
+    async def active_attrs(self, db: Connection) -> List[tuple]:
+        """(width, profile, rim, season, brand) всех активных товаров — для счётчиков фасетов"""
+        rows = await db.fetch("SELECT width, profile, rim, season, brand FROM product_attrs WHERE active=1")
+        return [tuple(row.values()) for row in rows]
+
+    async def save_attrs(self, db: Connection, attrs: Dict[int, tuple]):
+        if attrs:
+            await db.executemany(
+                f"INSERT INTO product_attrs(product_id, {ATTR_COLUMNS}) VALUES(?,?,?,?,?,?,?) "
+                "ON CONFLICT(product_id) DO UPDATE SET width = excluded.width, profile = excluded.profile, "
+                "rim = excluded.rim, season = excluded.season, brand = excluded.brand, active = excluded.active",
+                [(product_id, *values) for product_id, values in attrs.items()]
+            )
+
+    async def delete_attrs(self, db: Connection, ids: Sequence[int]):
+        if ids:
+            await db.execute(f"DELETE FROM product_attrs WHERE product_id IN ({_marks(ids)})", ids)
+
+    async def without_attrs(self, db: Connection) -> List[dict]:
+        """Товары, характеристики которых ещё не разобраны (id, name, specs, active)"""
+        return await db.fetch(
+            "SELECT p.id, p.name, p.specs, p.active FROM products p "
+            "LEFT JOIN product_attrs a ON a.product_id = p.id WHERE a.product_id IS NULL"
+        )
+
+
+class StockRepository:
+    """Остатки товаров по филиалам"""
+
+    async def all(self, db: Connection) -> List[Tuple[int, int, int]]:
+        rows = await db.fetch("SELECT product_id, branch_id, qty FROM stock")
+        return [(row["product_id"], row["branch_id"], row["qty"]) for row in rows]
+
+    async def set(self, db: Connection, product_id: int, branch_id: int, qty: int):
+        await db.execute(
+            "INSERT INTO stock(product_id, branch_id, qty) VALUES(?,?,?) "
+            f"ON CONFLICT(product_id, branch_id) DO UPDATE SET qty = excluded.qty, updated_at = {db.now}",
+            (product_id, branch_id, qty)
+        )
+
+    async def take(self, db: Connection, product_id: int, branch_id: Optional[int], qty: int) -> Optional[int]:
+        """Списывает qty, если в филиале хватает: проверка и списание — один UPDATE.
+        Возвращает новый остаток или None (не хватает или товар не учитывается на складе)"""
+        return await db.fetchval(
+            f"UPDATE stock SET qty = qty - ?, updated_at = {db.now} "
+            "WHERE product_id = ? AND branch_id = ? AND qty >= ? RETURNING qty",
+            (qty, product_id, branch_id, qty)
+        )
+
+    async def availability(self, db: Connection, product_id: int, branch_id: Optional[int]) -> Tuple[int, int]:
+        """(остаток в филиале, в скольких филиалах товар учитывается)"""
+        row = await db.fetchrow(
+            "SELECT COALESCE(SUM(CASE WHEN branch_id = ? THEN qty END), 0) AS available, COUNT(*) AS tracked "
+            "FROM stock WHERE product_id = ?",
+            (branch_id, product_id)
+        )
+        return row["available"], row["tracked"]
+
+
+class OrderRepository:
+    """Заказы и ключи идемпотентности их оформления"""
+
+    async def create(self, db: Connection, user_id: Optional[int], payload: str, payment_method: str) -> int:
+        return await db.fetchval(
+            "INSERT INTO orders(user_id, payload, payment_method) VALUES(?,?,?) RETURNING id",
+            (user_id, payload, payment_method)
+        )
+
+    async def for_user(self, db: Connection, user_id: int, limit: int,
+                       before: Optional[Tuple[str, int]] = None,
+                       tables: Sequence[str] = ("orders",)) -> List[tuple]:
+        """Заказы покупателя, новые первыми: (id, payload, payment_method, created_at).
+        before — (created_at, id) последнего заказа предыдущей страницы;
+        tables — таблицы заказов (основная и архивная), читаются как одна"""
+        where = "user_id = ?"
+        params: list = [user_id]
+        if before:
+            where += " AND (created_at, id) < (?, ?)"
+            params.extend((db.timestamp(before[0]), before[1]))
+        query = " UNION ALL ".join(
+            f"SELECT id, payload, payment_method, created_at FROM {table} WHERE {where}" for table in tables)
+        query += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        return [tuple(row.values()) for row in await db.fetch(query, params * len(tables) + [limit])]
+
+    async def customer_ids(self, db: Connection) -> List[int]:
+        """Покупатели с подтверждённым ID, оформлявшие заказы"""
+        rows = await db.fetch("SELECT DISTINCT user_id FROM orders WHERE user_id > 0")
+        return [row["user_id"] for row in rows]
+
+    async def order_for_key(self, db: Connection, key: str, ttl_hours: float) -> Optional[int]:
+        """Заказ, оформленный с этим ключом не раньше ttl_hours часов назад"""
+        return await db.fetchval(
+            f"SELECT order_id FROM order_idempotency WHERE key=? AND created_at >= {db.since(ttl_hours)}", (key,))
+
+    async def claim_key(self, db: Connection, key: str, order_id: int, ttl_hours: float) -> Optional[int]:
+        """Закрепляет ключ за заказом (устаревшая запись с тем же ключом перезаписывается).
+        None — ключ закреплён; иначе — номер заказа, который уже оформлен с этим ключом
+        (другой транзакцией): вызывающий откатывает свою"""
+        claimed = await db.fetchval(
+            "INSERT INTO order_idempotency(key, order_id) VALUES(?,?) "
+            f"ON CONFLICT(key) DO UPDATE SET order_id = excluded.order_id, created_at = {db.now} "
+            f"WHERE order_idempotency.created_at < {db.since(ttl_hours)} RETURNING order_id",
+            (key, order_id)
+        )
+        if claimed is not None:
+            return None
+        return await db.fetchval("SELECT order_id FROM order_idempotency WHERE key=?", (key,))
+
+    async def expire_keys(self, db: Connection, ttl_hours: float, chunk: int) -> int:
+        """Удаляет до chunk ключей старше ttl_hours часов, возвращает число удалённых"""
+        return await db.execute(
+            "DELETE FROM order_idempotency WHERE key IN ("
+            f"SELECT key FROM order_idempotency WHERE created_at < {db.since(ttl_hours)} LIMIT ?)",
+            (chunk,)
+        )
+
+
+class AdminRepository:
+    async def ids(self, db: Connection) -> List[int]:
+        return [row["user_id"] for row in await db.fetch("SELECT user_id FROM admins")]
+
+    async def add(self, db: Connection, user_id: int, username: Optional[str]):
+        await db.execute(
+            "INSERT INTO admins(user_id, username) VALUES(?,?) "
+            "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username",
+            (user_id, username)
+        )
+
+
+class Storage:
+    """Бэкенд хранения: схема, транзакции записи, соединения для чтения, репозитории"""
+
+    dialect = ""
+
+    def __init__(self):
+        self.products = ProductRepository()
+        self.stock = StockRepository()
+        self.orders = OrderRepository()
+        self.admins = AdminRepository()
+
+    async def init_schema(self):
+        """Создаёт таблицы и индексы, выполняет миграции"""
+        raise NotImplementedError
+
+    async def write(self, op: WriteOp) -> Any:
+        """Выполняет op(db) в транзакции и возвращает её результат (после COMMIT).
+        Исключение из op откатывает всё, что она сделала"""
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[Connection]:
+        raise NotImplementedError
+        yield
+
+    async def order_history(self, user_id: int, limit: int,
+                            before: Optional[Tuple[str, int]] = None) -> List[tuple]:
+        """История заказов покупателя (см. OrderRepository.for_user)"""
+        async with self.read() as db:
+            return await self.orders.for_user(db, user_id, limit, before)
+
+    def iter_order_rows(self, start: str, end: str, chunk: int) -> AsyncIterator[List[tuple]]:
+        """Заказы с created_at в [start, end) порциями по chunk:
+        (id, created_at, user_id, payment_method, payload), на одном снимке БД"""
+        raise NotImplementedError
+
+    def report(self) -> dict:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
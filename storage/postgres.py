@@ -0,0 +1,261 @@
+"""
+Бэкенд PostgreSQL: пул соединений asyncpg (DATABASE_URL=postgresql://...).
+
+Писателей может быть сколько угодно: каждая запись — своя транзакция на соединении
+из пула (READ COMMITTED). Списание остатков атомарно за счёт UPDATE ... WHERE qty >= ?,
+повтор заказа с тем же ключом идемпотентности отсекает уникальный ключ
+order_idempotency (см. OrderRepository.claim_key) — в том числе между процессами.
+
+Пул соединений один на адрес БД и размер пула: несколько магазинов процесса (tenants.py)
+делят его, а их таблицы разведены по схемам (schema) — search_path выставляется
+на время транзакции или соединения для чтения.
+
+Метки времени хранятся в TIMESTAMP(0) без часового пояса, в UTC, с точностью до секунды —
+как в SQLite (курсор истории заказов сравнивает их со строкой «ГГГГ-ММ-ДД ЧЧ:ММ:СС»).
+"""
+import asyncio
+import os
+import re
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import asyncpg
+
+from storage.base import Connection, IntegrityError, Storage, WriteOp
+
+# Соединений в пуле на процесс
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+
+_UTC_NOW = "(now() AT TIME ZONE 'utc')"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS products (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    image TEXT DEFAULT '🛞',
+    description TEXT DEFAULT '',
+    specs TEXT DEFAULT '[]',
+    active INTEGER DEFAULT 1,
+    created_at TIMESTAMP(0) DEFAULT {_UTC_NOW},
+    image_file_id TEXT,
+    image_file_unique_id TEXT,
+    sku TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products(sku);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    user_id BIGINT,
+    payload TEXT NOT NULL,
+    payment_method TEXT DEFAULT 'cash',
+    created_at TIMESTAMP(0) DEFAULT {_UTC_NOW}
+);
+CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at, id);
+
+CREATE TABLE IF NOT EXISTS admins (
+    user_id BIGINT PRIMARY KEY,
+    username TEXT,
+    added_at TIMESTAMP(0) DEFAULT {_UTC_NOW}
+);
+
+CREATE TABLE IF NOT EXISTS product_attrs (
+    product_id BIGINT PRIMARY KEY,
+    width INTEGER,
+    profile INTEGER,
+    rim DOUBLE PRECISION,
+    season TEXT,
+    brand TEXT,
+    active INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_attrs_size ON product_attrs(active, width, profile, rim);
+CREATE INDEX IF NOT EXISTS idx_attrs_rim ON product_attrs(active, rim);
+CREATE INDEX IF NOT EXISTS idx_attrs_season_brand ON product_attrs(active, season, brand);
+CREATE INDEX IF NOT EXISTS idx_attrs_brand ON product_attrs(active, brand);
+
+CREATE TABLE IF NOT EXISTS stock (
+    product_id BIGINT NOT NULL,
+    branch_id INTEGER NOT NULL,
+    qty INTEGER NOT NULL CHECK (qty >= 0),
+    updated_at TIMESTAMP(0) DEFAULT {_UTC_NOW},
+    PRIMARY KEY (product_id, branch_id)
+);
+
+CREATE TABLE IF NOT EXISTS order_idempotency (
+    key TEXT PRIMARY KEY,
+    order_id BIGINT NOT NULL,
+    created_at TIMESTAMP(0) DEFAULT {_UTC_NOW}
+);
+CREATE INDEX IF NOT EXISTS idx_order_idempotency_created ON order_idempotency(created_at);
+"""
+
+
+@lru_cache(maxsize=512)
+def _numbered(sql: str) -> str:
+    """«?» → $1, $2, ... (в SQL репозиториев «?» не встречается внутри строк)"""
+    counter = iter(range(1, sql.count("?") + 1))
+    return re.sub(r"\?", lambda _: f"${next(counter)}", sql)
+
+
+def _row(record) -> dict:
+    return {key: value.strftime("%Y-%m-%d %H:%M:%S") if isinstance(value, datetime) else value
+            for key, value in record.items()}
+
+
+class PostgresConnection(Connection):
+    dialect = "postgresql"
+    now = _UTC_NOW
+
+    def __init__(self, conn: asyncpg.Connection):
+        self.conn = conn
+
+    async def fetch(self, sql: str, args: Sequence = ()) -> List[dict]:
+        return [_row(record) for record in await self.conn.fetch(_numbered(sql), *args)]
+
+    async def execute(self, sql: str, args: Sequence = ()) -> int:
+        # Статус вида «UPDATE 3», «INSERT 0 1», «DELETE 5»
+        status = await self.conn.execute(_numbered(sql), *args)
+        count = status.rsplit(" ", 1)[-1]
+        return int(count) if count.isdigit() else 0
+
+    async def executemany(self, sql: str, rows: Iterable[Sequence]):
+        await self.conn.executemany(_numbered(sql), rows)
+
+    def since(self, hours: float) -> str:
+        return f"({_UTC_NOW} - interval '{float(hours)} hours')"
+
+    def same(self, column: str) -> str:
+        return f"{column} IS NOT DISTINCT FROM ?"
+
+    def timestamp(self, value: str) -> datetime:
+        return datetime.fromisoformat(value)
+
+
+class SharedPool:
+    """Пул asyncpg, общий для всех PostgresStorage процесса с тем же адресом и размером"""
+
+    _pools: Dict[Tuple[str, int], "SharedPool"] = {}
+
+    def __init__(self, url: str, size: int):
+        self.url = url
+        self.size = size
+        self.users = 0
+        self.pool: Optional[asyncpg.Pool] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @classmethod
+    def attach(cls, url: str, size: int) -> "SharedPool":
+        shared = cls._pools.get((url, size))
+        if shared is None:
+            shared = cls._pools[(url, size)] = cls(url, size)
+        shared.users += 1
+        return shared
+
+    async def get(self) -> asyncpg.Pool:
+        # Пул создаётся при первом обращении: при импорте модуля event loop ещё не запущен
+        if self.pool is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self.pool is None:
+                    self.pool = await asyncpg.create_pool(self.url, min_size=1, max_size=self.size)
+        return self.pool
+
+    async def detach(self):
+        """Закрывает пул, когда его отпустил последний пользователь"""
+        self.users -= 1
+        if self.users > 0:
+            return
+        self._pools.pop((self.url, self.size), None)
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+
+class PostgresStorage(Storage):
+    dialect = "postgresql"
+
+    def __init__(self, url: str, pool_size: int = DB_POOL_SIZE, schema: Optional[str] = None):
+        super().__init__()
+        self.url = url
+        self.pool_size = pool_size
+        self.schema = schema
+        self._shared: Optional[SharedPool] = SharedPool.attach(url, pool_size)
+        self.stats = {"transactions": 0, "errors": 0}
+
+    async def _get_pool(self) -> asyncpg.Pool:
+        return await self._shared.get()
+
+    async def _use_schema(self, conn: asyncpg.Connection, local: bool = True):
+        # SET LOCAL действует до конца транзакции; без LOCAL — до возврата соединения в пул
+        # (asyncpg выполняет RESET ALL при возврате)
+        if self.schema:
+            await conn.execute(f'SET {"LOCAL " if local else ""}search_path TO "{self.schema}"')
+
+    async def init_schema(self):
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            # Несколько процессов могут стартовать одновременно — схему создаёт один
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock(hashtext('wheel_tg_bot_schema'))")
+                if self.schema:
+                    await conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"')
+                await self._use_schema(conn)
+                await conn.execute(SCHEMA)
+
+    async def write(self, op: WriteOp):
+        pool = await self._get_pool()
+        self.stats["transactions"] += 1
+        try:
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    await self._use_schema(conn)
+                    return await op(PostgresConnection(conn))
+        except asyncpg.IntegrityConstraintViolationError as e:
+            self.stats["errors"] += 1
+            raise IntegrityError(str(e)) from e
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[PostgresConnection]:
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            await self._use_schema(conn, local=False)
+            yield PostgresConnection(conn)
+
+    async def iter_order_rows(self, start: str, end: str, chunk: int):
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            # Один снимок на всю выгрузку; серверный курсор — в памяти не больше порции
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                await self._use_schema(conn)
+                cursor = await conn.cursor(
+                    "SELECT id, created_at, user_id, payment_method, payload FROM orders "
+                    "WHERE created_at >= $1 AND created_at < $2 ORDER BY created_at, id",
+                    datetime.fromisoformat(start), datetime.fromisoformat(end)
+                )
+                while True:
+                    records = await cursor.fetch(chunk)
+                    if not records:
+                        return
+                    yield [tuple(_row(record).values()) for record in records]
+
+    def report(self) -> dict:
+        report = {"backend": self.dialect, **self.stats, "pool_max": self.pool_size}
+        if self.schema:
+            report["schema"] = self.schema
+        pool = self._shared.pool if self._shared is not None else None
+        if pool is not None:
+            report.update(pool_size=pool.get_size(), pool_idle=pool.get_idle_size(),
+                          pool_users=self._shared.users)
+        return report
+
+    async def close(self):
+        if self._shared is not None:
+            shared, self._shared = self._shared, None
+            await shared.detach()
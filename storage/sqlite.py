@@ -0,0 +1,197 @@
+"""
+Бэкенд SQLite: файл DB_PATH в режиме WAL.
+
+Все записи идут через DatabaseWriter — один писатель с групповым коммитом: операции
+из разных корутин выполняются пачкой в одной транзакции, каждая в своей точке
+сохранения. Чтение — отдельным соединением на запрос (WAL не блокирует его записью).
+"""
+import logging
+import os
+import sqlite3
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterable, List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+from db_writer import DatabaseWriter
+from orders_export import iter_sqlite_order_rows
+from storage.base import Connection, IntegrityError, Storage, WriteOp
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteConnection(Connection):
+    dialect = "sqlite"
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self.conn = conn
+
+    async def fetch(self, sql: str, args: Sequence = ()) -> List[dict]:
+        async with self.conn.execute(sql, args) as cur:
+            rows = await cur.fetchall()
+            names = [column[0] for column in cur.description or ()]
+        return [dict(zip(names, row)) for row in rows]
+
+    async def execute(self, sql: str, args: Sequence = ()) -> int:
+        async with self.conn.execute(sql, args) as cur:
+            return cur.rowcount
+
+    async def executemany(self, sql: str, rows: Iterable[Sequence]):
+        await self.conn.executemany(sql, rows)
+
+    def since(self, hours: float) -> str:
+        return f"datetime('now', '-{float(hours)} hours')"
+
+    def same(self, column: str) -> str:
+        return f"{column} IS ?"
+
+
+class SQLiteStorage(Storage):
+    dialect = "sqlite"
+
+    def __init__(self, path: str, archive_path: Optional[str] = None):
+        super().__init__()
+        self.path = path
+        self.archive_path = archive_path
+        self.writer = DatabaseWriter(path)
+
+    async def init_schema(self):
+        async with aiosqlite.connect(self.path) as db:
+            # auto_vacuum действует только для новой БД (до создания таблиц);
+            # WAL: читатели не блокируют писателя, а бэкап и checkpoint идут без остановки записи
+            await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute("""
+            CREATE TABLE IF NOT EXISTS products (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                price INTEGER NOT NULL,
+                image TEXT DEFAULT '🛞',
+                description TEXT DEFAULT '',
+                specs TEXT DEFAULT '[]',
+                active INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            await db.execute("""
+            CREATE TABLE IF NOT EXISTS orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                payload TEXT NOT NULL,
+                payment_method TEXT DEFAULT 'cash',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            await db.execute("""
+            CREATE TABLE IF NOT EXISTS admins (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            await db.execute("""
+            CREATE TABLE IF NOT EXISTS product_attrs (
+                product_id INTEGER PRIMARY KEY,
+                width INTEGER,
+                profile INTEGER,
+                rim REAL,
+                season TEXT,
+                brand TEXT,
+                active INTEGER NOT NULL DEFAULT 1
+            )
+            """)
+            # Составные индексы под типовые фильтры каталога (active всегда первый)
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_attrs_size ON product_attrs(active, width, profile, rim)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_attrs_rim ON product_attrs(active, rim)")
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_attrs_season_brand ON product_attrs(active, season, brand)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_attrs_brand ON product_attrs(active, brand)")
+            # Остатки товаров по филиалам; qty >= 0 гарантирует сама БД
+            await db.execute("""
+            CREATE TABLE IF NOT EXISTS stock (
+                product_id INTEGER NOT NULL,
+                branch_id INTEGER NOT NULL,
+                qty INTEGER NOT NULL CHECK (qty >= 0),
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (product_id, branch_id)
+            ) WITHOUT ROWID
+            """)
+            # История заказов покупателя (/api/my-orders): поиск и сортировка по индексу
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at)")
+            # Выгрузка заказов за период (/api/admin/orders/export)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders(created_at)")
+            # Ключи идемпотентности заказов: повтор «Оформить» возвращает уже созданный заказ
+            await db.execute("""
+            CREATE TABLE IF NOT EXISTS order_idempotency (
+                key TEXT PRIMARY KEY,
+                order_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) WITHOUT ROWID
+            """)
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_order_idempotency_created ON order_idempotency(created_at)")
+            await db.commit()
+
+            # Добавляем колонку payment_method, если её нет (для существующих БД)
+            try:
+                cur = await db.execute("PRAGMA table_info(orders)")
+                if "payment_method" not in [col[1] for col in await cur.fetchall()]:
+                    await db.execute("ALTER TABLE orders ADD COLUMN payment_method TEXT DEFAULT 'cash'")
+                    await db.commit()
+            except Exception as e:
+                logger.warning("Ошибка при миграции БД (возможно, колонка уже существует): %s", e)
+
+            # Telegram file_id фото товара — чтобы отправлять его ботом без повторной загрузки
+            try:
+                cur = await db.execute("PRAGMA table_info(products)")
+                column_names = [col[1] for col in await cur.fetchall()]
+                for column in ("image_file_id", "image_file_unique_id"):
+                    if column not in column_names:
+                        await db.execute(f"ALTER TABLE products ADD COLUMN {column} TEXT")
+                await db.commit()
+            except Exception as e:
+                logger.warning("Ошибка при миграции БД (колонки file_id): %s", e)
+
+            # Артикул — ключ товара при импорте каталога из CSV (NULL у товаров из мастера /add)
+            try:
+                cur = await db.execute("PRAGMA table_info(products)")
+                if "sku" not in [col[1] for col in await cur.fetchall()]:
+                    await db.execute("ALTER TABLE products ADD COLUMN sku TEXT")
+                await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products(sku)")
+                await db.commit()
+            except Exception as e:
+                logger.warning("Ошибка при миграции БД (колонка sku): %s", e)
+
+    async def write(self, op: WriteOp):
+        try:
+            return await self.writer.submit(lambda conn: op(SQLiteConnection(conn)))
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[SQLiteConnection]:
+        async with aiosqlite.connect(self.path) as conn:
+            yield SQLiteConnection(conn)
+
+    async def order_history(self, user_id: int, limit: int,
+                            before: Optional[Tuple[str, int]] = None) -> List[tuple]:
+        # Заказы старше ORDERS_ARCHIVE_DAYS перенесены задачей archive_orders в архивную БД:
+        # без неё они пропали бы из истории покупателя
+        async with self.read() as db:
+            tables = ["main.orders"]
+            if self.archive_path and os.path.exists(self.archive_path):
+                await db.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+                if await db.fetchval("SELECT 1 FROM archive.sqlite_master WHERE type='table' AND name='orders'"):
+                    tables.append("archive.orders")
+            return await self.orders.for_user(db, user_id, limit, before, tables)
+
+    def iter_order_rows(self, start: str, end: str, chunk: int):
+        # Старые заказы перенесены задачей archive_orders в архивную БД — читаются и оттуда
+        return iter_sqlite_order_rows(self.path, self.archive_path, start, end, chunk)
+
+    def report(self) -> dict:
+        return {"backend": self.dialect, **self.writer.report()}
+
+    async def close(self):
+        await self.writer.stop()
@@ -0,0 +1,90 @@
+"""
+Проверка initData Telegram WebApp.
+
+Telegram подписывает initData: hash = HMAC_SHA256(secret, data_check_string), где
+secret = HMAC_SHA256("WebAppData", BOT_TOKEN), а data_check_string — все поля, кроме
+hash, в виде "ключ=значение", отсортированные и склеенные через перевод строки.
+
+secret вычисляется один раз. WebApp присылает одну и ту же строку initData со всеми
+запросами сессии, поэтому уже проверенные строки хранятся в LRU: повторная проверка —
+это поиск в словаре и сравнение auth_date. Ключ кэша — строка целиком, а не только
+hash: иначе подменённые поля с чужим hash прошли бы без проверки подписи.
+"""
+import hashlib
+import hmac
+import json
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode
+
+# Сколько секунд initData считается действительной (Telegram выдаёт новую при каждом открытии WebApp)
+INIT_DATA_MAX_AGE = 24 * 3600
+
+
+class InitDataError(ValueError):
+    """initData отсутствует, повреждена, подделана или устарела"""
+
+
+class WebAppAuth:
+    """Проверка подписи initData с кэшем уже проверенных строк"""
+
+    def __init__(self, bot_token: str, max_age: int = INIT_DATA_MAX_AGE, cache_size: int = 4096):
+        self._secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+        self.max_age = max_age
+        self.cache_size = cache_size
+        # initData -> (пользователь, auth_date)
+        self._verified: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def validate(self, init_data: str) -> dict:
+        """Возвращает пользователя из initData (dict с id, first_name, username, ...)"""
+        if not init_data:
+            raise InitDataError("initData не передана")
+
+        cached = self._verified.get(init_data)
+        if cached is not None:
+            user, auth_date = cached
+            self._check_age(auth_date)
+            self._verified.move_to_end(init_data)
+            return user
+
+        try:
+            fields = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=True))
+        except ValueError:
+            raise InitDataError("initData повреждена")
+        received_hash = fields.pop("hash", "")
+        data_check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+        expected_hash = hmac.new(self._secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected_hash, received_hash):
+            raise InitDataError("Неверная подпись initData")
+
+        try:
+            auth_date = int(fields.get("auth_date", "0"))
+            user = json.loads(fields.get("user") or "null")
+        except ValueError:
+            raise InitDataError("initData повреждена")
+        if not isinstance(user, dict) or not isinstance(user.get("id"), int):
+            raise InitDataError("В initData нет пользователя")
+        self._check_age(auth_date)
+
+        self._verified[init_data] = (user, auth_date)
+        if len(self._verified) > self.cache_size:
+            self._verified.popitem(last=False)
+        return user
+
+    def _check_age(self, auth_date: int):
+        if self.max_age and time.time() - auth_date > self.max_age:
+            raise InitDataError("initData устарела, откройте магазин заново")
+
+
+def sign_init_data(bot_token: str, user: dict, auth_date: Optional[int] = None, **fields) -> str:
+    """Формирует подписанную initData (для бенчмарков и ручной проверки API)"""
+    fields = {
+        "auth_date": str(auth_date if auth_date is not None else int(time.time())),
+        "user": json.dumps(user, ensure_ascii=False, separators=(",", ":")),
+        **fields,
+    }
+    secret = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    data_check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+    fields["hash"] = hmac.new(secret, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
@@ -0,0 +1,231 @@
+"""
+Несколько магазинов в одном процессе.
+
+Магазины описываются JSON-файлом TENANTS_FILE:
+
+    {
+      "kolesa": {"bot_token": "123:AA...", "orders_chat": "@KolesaUfa02", "db_path": "kolesa.sqlite3",
+                 "address": "г. Уфа, ...", "phone": "+7...", "phones": {"consultation": "+7..."},
+                 "hours": "...", "delivery": "...", "webapp_url": "https://..."},
+      "shiny": {"bot_token": "456:BB...", "orders_chat": "@ShinyChat", "db_path": "shiny.sqlite3"}
+    }
+
+Без TENANTS_FILE работает один магазин «default» из переменных окружения — как раньше.
+
+Маршрутизация (TenantMiddleware):
+- /api/webhook/<магазин> — обновления Telegram бота магазина;
+- /t/<магазин>/... — WebApp и API магазина (/t/kolesa/api/products и т.д.);
+- пути без префикса (и /api/webhook) обслуживает первый магазин из файла.
+
+У каждого магазина свои бот, чат заказов, контакты, БД, кэши каталога в памяти,
+администраторы, лента событий, рассылки и задачи обслуживания. Общие: Dispatcher с обработчиками,
+HTTP-сессия Bot API (пул соединений aiohttp), пул потоков для обработки фото, пул
+соединений PostgreSQL (таблицы магазинов — в разных схемах) и лимиты запросов.
+Текущий магазин — current_shop (ContextVar): его выставляет TenantMiddleware для
+HTTP-запроса и ShopUpdateMiddleware — для обновления Telegram по боту, который его получил.
+"""
+import json
+import os
+import re
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.base import BaseSession
+from fastapi.responses import JSONResponse
+
+from broadcast import BroadcastEngine
+from events import EventHub
+from idempotency import IdempotencyStore
+from maintenance import BACKUP_DIR, create_scheduler
+from search_index import ProductSearchIndex
+from storage import open_storage
+from telegram_auth import WebAppAuth
+from tire_specs import ATTR_FIELDS
+
+TENANTS_FILE = os.environ.get("TENANTS_FILE", "")
+DEFAULT_SLUG = "default"
+TENANT_PREFIX = "/t/"
+WEBHOOK_PREFIX = "/api/webhook/"
+
+_SLUG_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+
+current_shop: ContextVar[Optional["Shop"]] = ContextVar("current_shop", default=None)
+
+
+class TenantConfigError(Exception):
+    pass
+
+
+class Shop:
+    """Магазин: настройки, бот, хранилище и всё, что держится о нём в памяти"""
+
+    def __init__(self, slug: str, bot_token: str, orders_chat: str, db_path: str,
+                 session: Optional[BaseSession] = None, archive_db_path: Optional[str] = None,
+                 database_url: str = "", webapp_url: str = "", address: str = "", phone: str = "",
+                 phones: Optional[Dict[str, str]] = None, hours: str = "", delivery: str = "",
+                 backup_dir: str = BACKUP_DIR):
+        self.slug = slug
+        self.orders_chat = orders_chat
+        self.db_path = db_path
+        self.webapp_url = webapp_url.rstrip("/")
+        self.address = address
+        self.phone = phone
+        self.phones = phones or {}
+        self.hours = hours
+        self.delivery = delivery
+
+        self.bot = Bot(bot_token, session=session)
+        # initData WebApp подписана токеном бота этого магазина
+        self.webapp_auth = WebAppAuth(bot_token)
+        archive_db_path = archive_db_path or f"{os.path.splitext(db_path)[0]}_archive.sqlite3"
+        # В общей БД PostgreSQL таблицы магазинов разведены по схемам
+        self.storage = open_storage(database_url, db_path, archive_db_path,
+                                    schema=None if slug == DEFAULT_SLUG else f"shop_{slug}")
+        self.maintenance = create_scheduler(
+            db_path, storage=None if self.storage.dialect == "sqlite" else self.storage,
+            archive_path=archive_db_path, backup_dir=backup_dir)
+        # Уже оформленные ключи идемпотентности заказов
+        self.order_keys = IdempotencyStore()
+        # Лента событий для администраторов (SSE): заказы и изменения каталога
+        self.events = EventHub()
+        self.broadcasts = BroadcastEngine(
+            self.bot, db_path,
+            recipients=None if self.storage.dialect == "sqlite" else self._customer_ids,
+            archive_path=archive_db_path
+        )
+
+        # Кэши в памяти: обновляются только после коммита записи в БД
+        self.initialized = False
+        self.admin_ids = set()
+        self.facet_counts = {field: Counter() for field in ATTR_FIELDS}
+        self.facets_response = None
+        # Остатки {product_id: {branch_id: qty}}; версия — ETag для /api/stock
+        self.stock = {}
+        self.stock_version = 0
+        self.search_index = ProductSearchIndex()
+
+    async def _customer_ids(self):
+        async with self.storage.read() as db:
+            return await self.storage.orders.customer_ids(db)
+
+    @property
+    def webhook_path(self) -> str:
+        return "/api/webhook" if self.slug == DEFAULT_SLUG else f"{WEBHOOK_PREFIX}{self.slug}"
+
+    def __repr__(self):
+        return f"<Shop {self.slug}>"
+
+
+class ShopRegistry:
+    """Магазины процесса; первый — магазин по умолчанию для путей без префикса"""
+
+    def __init__(self, shops):
+        self.shops: Dict[str, Shop] = {shop.slug: shop for shop in shops}
+        if not self.shops:
+            raise TenantConfigError("не описано ни одного магазина")
+        self.default = next(iter(self.shops.values()))
+        self._by_bot_id = {shop.bot.id: shop for shop in self.shops.values()}
+        if len(self._by_bot_id) != len(self.shops):
+            raise TenantConfigError("у двух магазинов один и тот же бот")
+
+    def get(self, slug: str) -> Optional[Shop]:
+        return self.shops.get(slug)
+
+    def for_bot(self, bot: Bot) -> Optional[Shop]:
+        return self._by_bot_id.get(bot.id)
+
+    def __iter__(self) -> Iterator[Shop]:
+        return iter(self.shops.values())
+
+    def __len__(self):
+        return len(self.shops)
+
+
+def load_shops(path: str, default: dict, session: Optional[BaseSession] = None) -> ShopRegistry:
+    """Магазины из JSON-файла path; без файла — один магазин с настройками default"""
+    if not path:
+        return ShopRegistry([Shop(DEFAULT_SLUG, session=session, **default)])
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise TenantConfigError(f"{path}: ожидается объект {{магазин: настройки}}")
+    shops = []
+    for slug, settings in config.items():
+        if not _SLUG_RE.match(slug) or slug == DEFAULT_SLUG:
+            raise TenantConfigError(f"{path}: недопустимое имя магазина «{slug}» (a-z, 0-9, _ и -)")
+        missing = [key for key in ("bot_token", "orders_chat", "db_path") if not settings.get(key)]
+        if missing:
+            raise TenantConfigError(f"{path}: у магазина «{slug}» не заданы {', '.join(missing)}")
+        settings = {key: value for key, value in settings.items()}
+        settings.setdefault("database_url", default.get("database_url", ""))
+        settings.setdefault("webapp_url", f"{default['webapp_url']}{TENANT_PREFIX}{slug}"
+                            if default.get("webapp_url") else "")
+        settings.setdefault("backup_dir", os.path.join(BACKUP_DIR, slug))
+        try:
+            shops.append(Shop(slug, session=session, **settings))
+        except TypeError as e:
+            raise TenantConfigError(f"{path}: магазин «{slug}»: {e}") from e
+    return ShopRegistry(shops)
+
+
+def _not_found(slug: str) -> JSONResponse:
+    return JSONResponse(status_code=404, content={"status": "error", "message": f"Магазин «{slug}» не найден"})
+
+
+class TenantMiddleware:
+    """ASGI middleware: выбирает магазин по пути и выставляет current_shop на время запроса.
+
+    Префикс /t/<магазин> переносится в root_path: маршруты приложения остаются прежними
+    (/api/products), а request.url — полным, поэтому WebApp магазина ходит в API с тем же
+    префиксом.
+    """
+
+    def __init__(self, app, registry: ShopRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        shop = self.registry.default
+        if path.startswith(TENANT_PREFIX):
+            slug = path[len(TENANT_PREFIX):].split("/", 1)[0]
+            shop = self.registry.get(slug)
+            if shop is None:
+                await _not_found(slug)(scope, receive, send)
+                return
+            scope = dict(scope, root_path=scope.get("root_path", "") + TENANT_PREFIX + slug)
+        elif path.startswith(WEBHOOK_PREFIX):
+            slug = path[len(WEBHOOK_PREFIX):].strip("/")
+            shop = self.registry.get(slug)
+            if shop is None:
+                await _not_found(slug)(scope, receive, send)
+                return
+        scope.setdefault("state", {})["shop"] = shop
+        token = current_shop.set(shop)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_shop.reset(token)
+
+
+class ShopUpdateMiddleware(BaseMiddleware):
+    """Внешний middleware Dispatcher: магазин обновления — по боту, который его получил
+    (webhook магазина или polling нескольких ботов одним Dispatcher)"""
+
+    def __init__(self, registry: ShopRegistry):
+        self.registry = registry
+
+    async def __call__(self, handler, event, data):
+        shop = self.registry.for_bot(data["bot"])
+        if shop is None:
+            return await handler(event, data)
+        token = current_shop.set(shop)
+        try:
+            return await handler(event, data)
+        finally:
+            current_shop.reset(token)
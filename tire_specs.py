@@ -0,0 +1,135 @@
+"""
+Разбор характеристик шин из названия и свободного списка specs.
+
+Из строк вида "Michelin Pilot Sport 4", "205/55 R16", "Летняя" получаем типизированные
+атрибуты: ширина, профиль, диаметр диска, сезон и бренд. Они сохраняются в таблицу
+product_attrs и используются для фильтрации каталога и подсчёта фасетов.
+"""
+import re
+from typing import Dict, Iterable, Optional
+
+# 205/55 R16, 205/55R16, 205/55 ZR16, 205/55-16, 205/55/16, 185/75 R16C, 315/80 R22.5
+_SIZE_RE = re.compile(
+    r"(?<!\d)(\d{3})\s*/\s*(\d{2})\s*(?:Z?R|-|/)?\s*(\d{2}(?:[.,]5)?)(?![\d])",
+    re.IGNORECASE,
+)
+# Отдельно указанный диаметр: "R16", "R 17.5"
+_RIM_RE = re.compile(r"(?<![A-Za-zА-Яа-я\d])R\s?(\d{2}(?:[.,]5)?)(?![\d])", re.IGNORECASE)
+
+SEASON_SUMMER = "summer"
+SEASON_WINTER = "winter"
+SEASON_ALL = "all_season"
+
+SEASON_TITLES = {
+    SEASON_SUMMER: "Летние",
+    SEASON_WINTER: "Зимние",
+    SEASON_ALL: "Всесезонные",
+}
+
+# Порядок важен: "всесезонная" проверяется раньше "летней"/"зимней"
+_SEASON_KEYWORDS = (
+    (SEASON_ALL, ("всесезон", "all-season", "all season", "allseason", "4 seasons", "4seasons")),
+    (SEASON_WINTER, ("зимн", "winter", "шип", "липучк", "нешип", "snow")),
+    (SEASON_SUMMER, ("летн", "summer")),
+)
+
+# Каноническое название бренда -> варианты написания (в нижнем регистре)
+_BRANDS = {
+    "Michelin": ("michelin", "мишлен"),
+    "Bridgestone": ("bridgestone", "бриджстоун"),
+    "Continental": ("continental", "континенталь"),
+    "Pirelli": ("pirelli", "пирелли"),
+    "Nokian": ("nokian", "нокиан"),
+    "Ikon": ("ikon", "икон"),
+    "Goodyear": ("goodyear", "гудиер"),
+    "Dunlop": ("dunlop", "данлоп"),
+    "Yokohama": ("yokohama", "йокохама"),
+    "Hankook": ("hankook", "ханкук"),
+    "Kumho": ("kumho", "кумхо"),
+    "Toyo": ("toyo", "тойо"),
+    "Nitto": ("nitto",),
+    "Falken": ("falken",),
+    "Nexen": ("nexen",),
+    "Roadstone": ("roadstone",),
+    "Maxxis": ("maxxis",),
+    "BFGoodrich": ("bfgoodrich", "bf goodrich"),
+    "Gislaved": ("gislaved",),
+    "Matador": ("matador", "матадор"),
+    "Kormoran": ("kormoran",),
+    "Tigar": ("tigar",),
+    "Laufenn": ("laufenn",),
+    "Triangle": ("triangle",),
+    "Sailun": ("sailun",),
+    "Linglong": ("linglong", "ling long"),
+    "Hifly": ("hifly",),
+    "Headway": ("headway",),
+    "Kleber": ("kleber",),
+    "Formula": ("formula",),
+    "Cordiant": ("cordiant", "кордиант"),
+    "Кама": ("kama", "кама"),
+    "Viatti": ("viatti", "виатти"),
+    "Tunga": ("tunga", "тунга"),
+    "Amtel": ("amtel", "амтел"),
+    "Белшина": ("belshina", "белшина"),
+}
+
+_BRAND_RE = re.compile(
+    r"(?<![\w])(" + "|".join(
+        re.escape(alias) for aliases in _BRANDS.values() for alias in sorted(aliases, key=len, reverse=True)
+    ) + r")(?![\w])",
+    re.IGNORECASE,
+)
+_BRAND_BY_ALIAS = {alias: brand for brand, aliases in _BRANDS.items() for alias in aliases}
+
+# Поля атрибутов в порядке колонок таблицы product_attrs
+ATTR_FIELDS = ("width", "profile", "rim", "season", "brand")
+
+
+def _parse_rim(value: str) -> float:
+    return float(value.replace(",", "."))
+
+
+def parse_tire_attrs(name: str, specs: Iterable[str] = ()) -> Dict[str, Optional[object]]:
+    """Извлекает атрибуты шины из названия и списка характеристик.
+
+    >>> parse_tire_attrs("Michelin Pilot Sport 4", ["205/55 R16", "Летняя"])
+    {'width': 205, 'profile': 55, 'rim': 16.0, 'season': 'summer', 'brand': 'Michelin'}
+    """
+    text = " ".join([name or "", *[str(s) for s in specs or ()]])
+    attrs: Dict[str, Optional[object]] = dict.fromkeys(ATTR_FIELDS)
+
+    size = _SIZE_RE.search(text)
+    if size:
+        attrs["width"] = int(size.group(1))
+        attrs["profile"] = int(size.group(2))
+        attrs["rim"] = _parse_rim(size.group(3))
+    else:
+        rim = _RIM_RE.search(text)
+        if rim:
+            attrs["rim"] = _parse_rim(rim.group(1))
+
+    lowered = text.lower()
+    for season, keywords in _SEASON_KEYWORDS:
+        if any(k in lowered for k in keywords):
+            attrs["season"] = season
+            break
+
+    brand = _BRAND_RE.search(text)
+    if brand:
+        attrs["brand"] = _BRAND_BY_ALIAS[brand.group(1).lower()]
+
+    return attrs
+
+
+def brand_aliases(brand: str) -> tuple:
+    """Все варианты написания бренда (для поиска): "Michelin" -> ("michelin", "мишлен")"""
+    return _BRANDS.get(brand, ())
+
+
+def format_facet_value(field: str, value) -> str:
+    """Человекочитаемое значение фасета ("205", "R17.5", "Летние")."""
+    if field == "rim" and value is not None:
+        return f"R{value:g}"
+    if field == "season":
+        return SEASON_TITLES.get(value, str(value))
+    return str(value)
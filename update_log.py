@@ -0,0 +1,163 @@
+"""
+Журнал обновлений Telegram для воспроизведения (replay_updates.py).
+
+Включается переменной UPDATE_LOG_PATH: каждое обновление, которое получает Dispatcher
+(через webhook или polling), дописывается строкой NDJSON:
+
+    {"ts": 1760000000.123, "shop": "default", "update": {...}}
+
+Перед записью обновление обезличивается (scrub_update): ID пользователей и чатов
+заменяются псевдонимами (HMAC с солью UPDATE_LOG_SALT, по умолчанию — случайной на
+процесс; у одного пользователя в файле псевдоним один и тот же, поэтому цепочки FSM
+сохраняются), имена, username, телефоны, e-mail и координаты — заглушками, номера
+телефонов в тексте и подписях маскируются. Текст, callback_data и file_id остаются:
+без них обработчики не пройдут тот же путь.
+
+Запись идёт в фоновом потоке (очередь), поток event loop не ждёт диска. Когда файл
+дорастает до UPDATE_LOG_MAX_MB, запись прекращается.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+UPDATE_LOG_PATH = os.environ.get("UPDATE_LOG_PATH", "")
+UPDATE_LOG_MAX_MB = float(os.environ.get("UPDATE_LOG_MAX_MB", "100"))
+
+# Объекты, поле id которых — пользователь или чат
+_ID_OBJECTS = {"from", "chat", "user", "sender_chat", "forward_from", "forward_from_chat",
+               "new_chat_member", "new_chat_members", "left_chat_member", "old_chat_member", "via_bot"}
+_ID_FIELDS = {"user_id", "chat_id"}
+_TEXT_FIELDS = {"text", "caption", "query"}
+# Поля, которые заменяются заглушкой целиком
+_REPLACED = {
+    "first_name": "Пользователь",
+    "last_name": "",
+    "title": "Чат",
+    "phone_number": "+70000000000",
+    "email": "user@example.com",
+    "bio": "",
+    "vcard": "",
+    "latitude": 0.0,
+    "longitude": 0.0,
+}
+_PHONE_RE = re.compile(r"(?<!\d)\+?\d[\d\s()-]{8,}\d(?!\d)")
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+
+
+class Pseudonymizer:
+    """Стабильные псевдонимы ID и username в пределах одной соли"""
+
+    def __init__(self, salt: Optional[str] = None):
+        self.salt = (salt or secrets.token_hex(16)).encode()
+
+    def _digest(self, value: str) -> bytes:
+        return hmac.new(self.salt, value.encode(), hashlib.sha256).digest()
+
+    def id(self, value: int) -> int:
+        # Знак сохраняется: отрицательные ID — группы и каналы
+        pseudo = int.from_bytes(self._digest(str(abs(value)))[:5], "big") % 10 ** 10 + 1
+        return -pseudo if value < 0 else pseudo
+
+    def username(self, value: str) -> str:
+        return "u" + self._digest(value.lower()).hex()[:10]
+
+
+def scrub_text(text: str) -> str:
+    """Маскирует номера телефонов и адреса e-mail в тексте"""
+    return _EMAIL_RE.sub("user@example.com", _PHONE_RE.sub("+70000000000", text))
+
+
+def scrub_update(data, pseudonymizer: Pseudonymizer, parent: str = ""):
+    """Обезличенная копия обновления (dict из JSON Bot API)"""
+    if isinstance(data, list):
+        return [scrub_update(item, pseudonymizer, parent) for item in data]
+    if not isinstance(data, dict):
+        return data
+    scrubbed = {}
+    for key, value in data.items():
+        if key in _REPLACED:
+            scrubbed[key] = _REPLACED[key]
+        elif key == "username" and isinstance(value, str):
+            scrubbed[key] = pseudonymizer.username(value)
+        elif isinstance(value, int) and not isinstance(value, bool) and (
+                key in _ID_FIELDS or (key == "id" and parent in _ID_OBJECTS)):
+            scrubbed[key] = pseudonymizer.id(value)
+        elif key in _TEXT_FIELDS and isinstance(value, str):
+            scrubbed[key] = scrub_text(value)
+        else:
+            scrubbed[key] = scrub_update(value, pseudonymizer, key)
+    return scrubbed
+
+
+class UpdateRecorder:
+    """Дописывает обезличенные обновления в NDJSON-файл из фонового потока"""
+
+    def __init__(self, path: str, max_mb: float = UPDATE_LOG_MAX_MB, salt: Optional[str] = None):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.pseudonymizer = Pseudonymizer(salt)
+        self.stats = {"recorded": 0, "dropped": 0}
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._full = False
+        self._thread = threading.Thread(target=self._run, name="update-recorder", daemon=True)
+        self._thread.start()
+
+    def record(self, update: dict, shop: str = ""):
+        """Ставит обновление в очередь записи (обезличивание — здесь, запись — в потоке)"""
+        if self._full:
+            self.stats["dropped"] += 1
+            return
+        self._queue.put({"ts": round(time.time(), 3), "shop": shop,
+                         "update": scrub_update(update, self.pseudonymizer)})
+        self.stats["recorded"] += 1
+
+    def _run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                # Пока в очереди есть ещё строки, сбрасывать буфер на диск незачем
+                if self._queue.empty():
+                    f.flush()
+                    if f.tell() >= self.max_bytes and not self._full:
+                        self._full = True
+                        logger.warning("⚠️ Журнал обновлений %s достиг %s МБ, запись остановлена",
+                                       self.path, self.max_bytes // (1024 * 1024))
+
+    def close(self):
+        """Дописывает очередь и закрывает файл"""
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+def open_recorder(path: str = UPDATE_LOG_PATH) -> Optional[UpdateRecorder]:
+    """UpdateRecorder для UPDATE_LOG_PATH или None, если журнал выключен"""
+    if not path:
+        return None
+    logger.info("📝 Обновления Telegram записываются в %s", path)
+    return UpdateRecorder(path, salt=os.environ.get("UPDATE_LOG_SALT") or None)
+
+
+def read_updates(path: str) -> Iterator[dict]:
+    """Записи журнала по порядку; повреждённые строки (оборванная запись) пропускаются"""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Пропущена повреждённая строка журнала обновлений")
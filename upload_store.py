@@ -0,0 +1,189 @@
+"""
+Хранилище фото товаров по содержимому (content-addressed).
+
+Файл называется SHA-256 загруженных байтов и лежит в двухуровневой раскладке
+uploads/ab/cd/abcd...ef.jpg (не больше 256 файлов-каталогов на уровень). Одинаковое фото,
+загруженное повторно (через API или ботом), хранится один раз: если такой файл уже есть,
+новый не записывается и не уменьшается повторно. Ссылка в products.image — путь
+/api/uploads/ab/cd/abcd...ef.jpg; старые плоские имена (uuid) по-прежнему отдаются.
+
+Загрузка сначала пишется во временный файл uploads/.tmp/, затем переименовывается
+(os.replace) — читатели не видят недописанных файлов.
+
+Сборка мусора (collect_garbage) — mark-and-sweep: помечаются файлы, на которые
+ссылаются товары (список передаёт вызывающий), остальные удаляются, если они старше
+UPLOADS_GC_GRACE_HOURS (фото незавершённого мастера /add или загруженное через API,
+но ещё не сохранённое в товаре, не пропадёт). dry_run=True только считает.
+"""
+import hashlib
+import logging
+import os
+import time
+import uuid
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+UPLOAD_URL_PREFIX = "/api/uploads/"
+# Файлы моложе стольких часов сборка мусора не трогает
+UPLOADS_GC_GRACE_HOURS = float(os.environ.get("UPLOADS_GC_GRACE_HOURS", "24"))
+TMP_DIR = ".tmp"
+# Сколько имён удаляемых файлов показывать в отчёте
+GC_REPORT_SAMPLE = 20
+_HASH_CHUNK = 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class UploadStore:
+    """Каталог загрузок с именами по SHA-256 содержимого"""
+
+    def __init__(self, root: str = UPLOAD_DIR):
+        self.root = root
+        self.stats = {"stored": 0, "deduplicated": 0}
+
+    def temp_path(self, ext: str = ".jpg") -> str:
+        """Путь для временного файла загрузки (тот же диск, что и хранилище — для os.replace)"""
+        tmp_dir = os.path.join(self.root, TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        return os.path.join(tmp_dir, f"{uuid.uuid4().hex}{ext}")
+
+    def path_for(self, name: str) -> Optional[str]:
+        """Путь к файлу по ссылке /api/uploads/... или имени внутри uploads/; None — вне каталога"""
+        if name.startswith(UPLOAD_URL_PREFIX):
+            name = name[len(UPLOAD_URL_PREFIX):]
+        path = os.path.normpath(os.path.join(self.root, name))
+        if not path.startswith(os.path.join(os.path.normpath(self.root), "")) or \
+                os.path.relpath(path, self.root).split(os.sep)[0] == TMP_DIR:
+            return None
+        return path
+
+    def put(self, temp_path: str, ext: str, prepare: Optional[Callable[[str], object]] = None) -> Tuple[str, bool]:
+        """Переносит временный файл в хранилище под именем по содержимому.
+
+        prepare(путь) вызывается только для нового содержимого (например, уменьшение фото);
+        исключение из него удаляет временный файл и пробрасывается. Возвращает
+        (ссылка /api/uploads/..., True — если файл новый). Блокирующая: вызывать в потоке.
+        """
+        digest = file_digest(temp_path)
+        shard = f"{digest[:2]}/{digest[2:4]}"
+        existing = self._find(shard, digest)
+        if existing is not None:
+            name, path = f"{shard}/{existing}", os.path.join(self.root, shard, existing)
+            os.remove(temp_path)
+            # Свежая отметка времени: сборка мусора не удалит файл, пока ссылку на него сохраняют
+            os.utime(path)
+            self.stats["deduplicated"] += 1
+            return UPLOAD_URL_PREFIX + name, False
+        name = f"{shard}/{digest}{ext.lower()}"
+        path = os.path.join(self.root, name)
+        try:
+            if prepare is not None:
+                prepare(temp_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.stats["stored"] += 1
+        return UPLOAD_URL_PREFIX + name, True
+
+    def _find(self, shard: str, digest: str) -> Optional[str]:
+        """Имя уже сохранённого файла с этим содержимым (расширение в имени загрузки могло быть другим)"""
+        try:
+            names = os.listdir(os.path.join(self.root, shard))
+        except FileNotFoundError:
+            return None
+        return next((name for name in names if os.path.splitext(name)[0] == digest), None)
+
+    def iter_files(self) -> Iterator[Tuple[str, os.stat_result]]:
+        """(имя внутри uploads/ через «/», stat) всех файлов, кроме временных"""
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            if dir_path == self.root and TMP_DIR in dir_names:
+                dir_names.remove(TMP_DIR)
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield os.path.relpath(path, self.root).replace(os.sep, "/"), st
+
+    def report(self) -> dict:
+        return dict(self.stats)
+
+
+def collect_garbage(store: UploadStore, referenced: Iterable[str], dry_run: bool = True,
+                    grace_hours: float = UPLOADS_GC_GRACE_HOURS) -> dict:
+    """Удаляет файлы uploads/, на которые не ссылается ни один товар (mark-and-sweep).
+
+    referenced — ссылки из products.image (/api/uploads/...; остальные значения игнорируются).
+    Блокирующая: вызывать в потоке.
+    """
+    marked = {image[len(UPLOAD_URL_PREFIX):] for image in referenced
+              if image and image.startswith(UPLOAD_URL_PREFIX)}
+    cutoff = time.time() - grace_hours * 3600
+    report = {"dry_run": dry_run, "files": 0, "bytes": 0, "referenced": 0, "orphans": 0, "orphan_bytes": 0,
+              "too_recent": 0, "temp_removed": 0, "missing": 0, "sample": []}
+    present = set()
+    for name, st in store.iter_files():
+        report["files"] += 1
+        report["bytes"] += st.st_size
+        present.add(name)
+        if name in marked:
+            report["referenced"] += 1
+            continue
+        if st.st_mtime > cutoff:
+            report["too_recent"] += 1
+            continue
+        report["orphans"] += 1
+        report["orphan_bytes"] += st.st_size
+        if len(report["sample"]) < GC_REPORT_SAMPLE:
+            report["sample"].append(name)
+        if not dry_run:
+            try:
+                os.remove(os.path.join(store.root, name))
+            except FileNotFoundError:
+                pass
+    # Ссылки на отсутствующие файлы: фото из бота восстановятся по file_id при первом запросе
+    report["missing"] = len(marked - present)
+
+    # Временные файлы оборванных загрузок
+    tmp_dir = os.path.join(store.root, TMP_DIR)
+    if os.path.isdir(tmp_dir):
+        for file_name in os.listdir(tmp_dir):
+            path = os.path.join(tmp_dir, file_name)
+            try:
+                if os.path.getmtime(path) <= cutoff:
+                    report["temp_removed"] += 1
+                    if not dry_run:
+                        os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    if not dry_run:
+        # Пустые каталоги шардов
+        for dir_path, _, _ in sorted(os.walk(store.root), key=lambda item: -len(item[0])):
+            if dir_path not in (store.root, tmp_dir):
+                try:
+                    os.rmdir(dir_path)
+                except OSError:
+                    pass
+    return report
+
+
+def format_gc_report(report: dict) -> str:
+    """Краткая строка отчёта для журнала задач обслуживания"""
+    action = "можно удалить" if report["dry_run"] else "удалено"
+    return (f"файлов {report['files']} ({report['bytes'] / 1024 / 1024:.1f} МБ), используется {report['referenced']}, "
+            f"{action} {report['orphans']} ({report['orphan_bytes'] / 1024 / 1024:.1f} МБ), "
+            f"слишком новых {report['too_recent']}, временных {report['temp_removed']}, "
+            f"ссылок на отсутствующие файлы {report['missing']}")